@@ -0,0 +1,33 @@
+"""Cache duration in getfeatureinfo
+
+Revision ID: 4fb475afed4e
+Revises: 0635bb5914e7
+Create Date: 2026-10-18 10:02:13.418520
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = '4fb475afed4e'
+down_revision = '0635bb5914e7'
+branch_labels = None
+depends_on = None
+
+from alembic import op, context
+import sqlalchemy as sa
+
+
+def upgrade():
+    schema = context.get_context().config.get_main_option('schema')
+    op.add_column('lux_getfeature_definition',
+                  sa.Column('cache_ttl',
+                            sa.INTEGER,
+                            autoincrement=False,
+                            nullable=True
+                            ),
+                  schema=schema
+                  )
+
+
+def downgrade():
+    schema = context.get_context().config.get_main_option('schema')
+    op.drop_column('lux_getfeature_definition', 'cache_ttl', schema=schema)
@@ -5,7 +5,7 @@ import httplib2shim
 httplib2shim.patch()
 import distutils.core
 from pyramid.config import Configurator
-from pyramid.events import NewRequest
+from pyramid.events import ApplicationCreated, NewRequest
 from c2cgeoportal_geoportal import (
     locale_negotiator,
     add_interface,
@@ -204,6 +204,7 @@ def main(global_config, **settings):
 
     # ping routes
     config.add_route("ping", "/ping")
+    config.add_route("http_pool_stats", "/ping/httppool")
 
     # mymaps routes
     config.add_route("mymaps", "/mymaps", request_method="HEAD")
@@ -295,8 +296,15 @@ def main(global_config, **settings):
     config.add_route("getremoteroute", "/router/getroute")
     # geocoder routes
     config.add_route("reverse_geocode", "/geocode/reverse")
+    config.add_route(
+        "reverse_geocode_batch", "/geocode/reverse/batch",
+        request_method="POST")
     config.add_route("geocode", "/geocode/search")
+    config.add_route("geocode_batch", "/geocode/batch", request_method="POST")
+    config.add_route("geocode_autocomplete", "/geocode/autocomplete")
     config.add_route("get_address_by_parcel", "/geocode/get_address_by_parcel")
+    config.add_route(
+        "get_address_by_parcels", "/geocode/get_address_by_parcels")
     config.add_route("feedback", "/feedback")
     config.add_route("feedbackanf", "/feedbackanf")
     config.add_route("feedbackcrues", "/feedbackcrues")
@@ -443,4 +451,10 @@ def main(global_config, **settings):
         config.scan("geoportailv3_geoportal.admin.view")
     config.scan(ignore="geoportailv3_geoportal.admin.view")
 
+    # Load the localities of the geocoder before the first request
+    if os.environ.get("GEOCODE_INDEX_WARM_UP", "1") == "1":
+        from geoportailv3_geoportal.lib import geocoding_index
+
+        config.add_subscriber(geocoding_index.warm_up, ApplicationCreated)
+
     return config.make_wsgi_app()
@@ -1,4 +1,6 @@
 from geoportailv3_geoportal.models import LuxGetfeatureDefinition
+from geoportailv3_geoportal.lib import feature_definitions
+from geoportailv3_geoportal.lib import identify_cache
 from functools import partial
 from pyramid.view import view_defaults
 from pyramid.view import view_config
@@ -48,13 +50,19 @@ class LuxGetfeatureDefinitionViews(AbstractViews):
                  request_method='POST',
                  renderer='./templates/edit.jinja2')
     def save(self):
-        return super().save()
+        response = super().save()
+        feature_definitions.invalidate()
+        identify_cache.invalidate()
+        return response
 
     @view_config(route_name='c2cgeoform_item',
                  request_method='DELETE',
                  renderer='fast_json')
     def delete(self):
-        return super().delete()
+        response = super().delete()
+        feature_definitions.invalidate()
+        identify_cache.invalidate()
+        return response
 
     @view_config(route_name='c2cgeoform_item_duplicate',
                  request_method='GET',
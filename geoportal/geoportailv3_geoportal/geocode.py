@@ -79,3 +79,56 @@ class Neighbourhood(Base):
             'name': self.name,
             'locality': self.locality,
             'geom': self.geom}
+
+
+# Aggregates of the address points, see scripts/geocode_aggregates.py
+class LocalityAggregate(Base):
+    __table_args__ = ({'schema': 'geocoding', 'autoload': False})
+    __tablename__ = 'locality_aggregate'
+    id = Column(Integer, primary_key=True)
+    localite = Column(Unicode)
+    geom = Column(Geometry(srid=2169))
+    extent = Column(Geometry(srid=2169))
+    address_count = Column(Integer)
+
+
+class ZipAggregate(Base):
+    __table_args__ = ({'schema': 'geocoding', 'autoload': False})
+    __tablename__ = 'zip_aggregate'
+    id = Column(Integer, primary_key=True)
+    code_postal = Column(Unicode)
+    localite = Column(Unicode)
+    geom = Column(Geometry(srid=2169))
+    extent = Column(Geometry(srid=2169))
+    address_count = Column(Integer)
+
+
+class StreetAggregate(Base):
+    __table_args__ = ({'schema': 'geocoding', 'autoload': False})
+    __tablename__ = 'street_aggregate'
+    id = Column(Integer, primary_key=True)
+    id_caclr_loca = Column(Unicode)
+    id_caclr_rue = Column(Unicode)
+    rue = Column(Unicode)
+    code_postal = Column(Unicode)
+    localite = Column(Unicode)
+    geom = Column(Geometry(srid=2169))
+    extent = Column(Geometry(srid=2169))
+    num_min = Column(Integer)
+    num_max = Column(Integer)
+    address_count = Column(Integer)
+
+
+class HouseNumber(Base):
+    __table_args__ = ({'schema': 'geocoding', 'autoload': False})
+    __tablename__ = 'address_house_number'
+    id = Column(Integer, primary_key=True)
+    # Same type as the gid of the address points
+    gid = Column(Unicode)
+    code_postal = Column(Integer)
+    localite = Column(Unicode)
+    numero = Column(Unicode)
+    numero_part = Column(Unicode)
+    num_from = Column(Integer)
+    num_to = Column(Integer)
+    suffix = Column(Unicode)
@@ -0,0 +1,212 @@
+# -*- coding: utf-8 -*-
+import bisect
+import logging
+import os
+import re
+from collections import namedtuple
+
+from geoalchemy2 import func
+
+from c2cgeoportal_commons.models import DBSessions
+from c2cgeoportal_geoportal.lib.caching import get_region
+from geoportailv3_geoportal.geocode import Address, WKPOI
+from geoportailv3_geoportal.lib import invalidation
+from geoportailv3_geoportal.lib.address_parser import strip_accents
+
+log = logging.getLogger(__name__)
+cache_region = get_region("obj")
+
+# Time in seconds before the index is loaded again from the database
+INDEX_EXPIRATION = int(os.environ.get('GEOCODE_AUTOCOMPLETE_TTL', '3600'))
+# Maximum number of keys read for a prefix, bounds the time of a lookup
+MAX_SCAN = int(os.environ.get('GEOCODE_AUTOCOMPLETE_MAX_SCAN', '2000'))
+
+# Order of the kinds of suggestions with the same key length
+STREET = 0
+POI = 1
+ADDRESS = 2
+KINDS = {STREET: 'street', POI: 'poi', ADDRESS: 'address'}
+
+_NON_WORD = re.compile(r'[\W_]+')
+
+Suggestion = namedtuple('Suggestion', [
+    'kind', 'label', 'num', 'street', 'zip', 'locality', 'x', 'y'])
+
+
+def normalize(text):
+    """
+    Return the key of a text: lower case, without accents and with the words
+    separated by single spaces.
+    """
+    if text is None:
+        return ''
+    return _NON_WORD.sub(' ', strip_accents(text.lower())).strip()
+
+
+def _join(*parts):
+    return ' '.join(str(part).strip() for part in parts
+                    if part is not None and len(str(part).strip()) > 0)
+
+
+class SortedKeys(object):
+    """
+    Keys with the index of their suggestion, grouped by kind and key length
+    and sorted in each group. The groups are read in the order of the
+    ranking, so the keys starting with a prefix are found best first.
+    """
+
+    def __init__(self):
+        self._added = []
+        # (key length, sorted keys, index of their suggestions) by kind and
+        # key length
+        self.buckets = []
+
+    def add(self, text, idx, kind):
+        key = normalize(text)
+        if len(key) > 0:
+            self._added.append((kind, key, idx))
+
+    def sort(self):
+        buckets = {}
+        for kind, key, idx in self._added:
+            buckets.setdefault((kind, len(key)), []).append((key, idx))
+        self.buckets = []
+        for kind, length in sorted(buckets):
+            items = sorted(buckets[(kind, length)])
+            self.buckets.append((
+                length, [key for key, idx in items],
+                [idx for key, idx in items]))
+        self._added = []
+
+    def find(self, prefix, limit):
+        """
+        Return the index of the limit best suggestions of the keys starting
+        with the prefix, by kind, key length then key. At most MAX_SCAN keys
+        are read.
+        """
+        found = []
+        seen = set()
+        scanned = 0
+        for length, keys, entries in self.buckets:
+            if length < len(prefix):
+                continue
+            lo = bisect.bisect_left(keys, prefix)
+            hi = bisect.bisect_left(keys, prefix + u'\uffff', lo)
+            for i in range(lo, hi):
+                idx = entries[i]
+                if idx not in seen:
+                    seen.add(idx)
+                    found.append(idx)
+                scanned += 1
+                if len(found) >= limit or scanned >= MAX_SCAN:
+                    return found
+        return found
+
+
+class AutocompleteIndex(object):
+    """
+    Sorted keys of the streets, well known POI and address points. An
+    address is found from its house number followed by the street or from
+    the street followed by its house number, a street or a POI from its
+    name or its locality. The streets and POI are suggested before the
+    address points.
+    """
+
+    def __init__(self):
+        self.suggestions = []
+        self.places = SortedKeys()
+        self.addresses = SortedKeys()
+
+    def load(self, session):
+        streets = {}
+        for rue, numero, code_postal, localite, x, y in session.query(
+                Address.rue, Address.numero, Address.code_postal,
+                Address.localite,
+                func.ST_X(Address.geom).label("x"),
+                func.ST_Y(Address.geom).label("y")).\
+                filter(Address.geom.isnot(None)):
+            if rue is None:
+                continue
+            rue = rue.strip()
+            street = streets.get((rue, code_postal, localite))
+            if street is None:
+                street = streets[(rue, code_postal, localite)] = [0, 0., 0.]
+            street[0] += 1
+            street[1] += x
+            street[2] += y
+            if numero is None or len(numero.strip()) == 0:
+                continue
+            numero = numero.strip()
+            idx = self._add(Suggestion(
+                ADDRESS,
+                "%s, %s, %s %s" % (numero, rue, code_postal or '',
+                                   localite or ''),
+                numero, rue, code_postal, localite, x, y))
+            self.addresses.add(
+                _join(numero, rue, code_postal, localite), idx, ADDRESS)
+            self.addresses.add(
+                _join(rue, numero, code_postal, localite), idx, ADDRESS)
+
+        for (rue, code_postal, localite), (count, x, y) in streets.items():
+            idx = self._add(Suggestion(
+                STREET,
+                "%s, %s %s" % (rue, code_postal or '', localite or ''),
+                None, rue, code_postal, localite, x / count, y / count))
+            self.places.add(_join(rue, code_postal, localite), idx, STREET)
+            self.places.add(_join(localite, rue), idx, STREET)
+
+        for name, zip, locality, street, x, y in session.query(
+                WKPOI.name, WKPOI.zip, WKPOI.locality, WKPOI.street,
+                func.ST_X(func.ST_Centroid(WKPOI.geom)).label("x"),
+                func.ST_Y(func.ST_Centroid(WKPOI.geom)).label("y")):
+            if name is None:
+                continue
+            idx = self._add(Suggestion(
+                POI, "%s, %s" % (name.strip(), locality or ''),
+                None, street, zip, locality, x, y))
+            self.places.add(_join(name, locality), idx, POI)
+            self.places.add(_join(locality, name), idx, POI)
+
+        self.places.sort()
+        self.addresses.sort()
+        log.info("Loaded %d suggestions for the autocomplete",
+                 len(self.suggestions))
+
+    def _add(self, suggestion):
+        self.suggestions.append(suggestion)
+        return len(self.suggestions) - 1
+
+    def complete(self, text, limit=10):
+        """
+        Return the limit best suggestions for the text: the streets and POI
+        then the address points, the shortest keys first.
+        """
+        prefix = normalize(text)
+        if len(prefix) == 0:
+            return []
+        found = self.places.find(prefix, limit)
+        if len(found) < limit:
+            found += self.addresses.find(prefix, limit - len(found))
+        return [self.suggestions[idx] for idx in found]
+
+
+@cache_region.cache_on_arguments(expiration_time=INDEX_EXPIRATION)
+def _load_autocomplete_index():
+    index = AutocompleteIndex()
+    index.load(DBSessions['ecadastre'])
+    return index
+
+
+def get_autocomplete_index():
+    invalidation.check(
+        'address-autocomplete', _load_autocomplete_index.invalidate)
+    return _load_autocomplete_index()
+
+
+def invalidate():
+    """
+    Called by scripts/geocode_aggregates.py, the streets and address points
+    of the suggestions may have changed.
+    """
+    _load_autocomplete_index.invalidate()
+    invalidation.publish('address-autocomplete')
@@ -0,0 +1,215 @@
+# -*- coding: utf-8 -*-
+"""
+Normalization and parsing of the addresses given to the geocoder. The
+regular expressions and translation tables are compiled once and the
+results of the functions called on every search are memoized.
+"""
+import os
+import re
+from collections import namedtuple
+from functools import lru_cache
+
+# Number of parsed addresses and normalized strings kept in memory
+CACHE_SIZE = int(os.environ.get('GEOCODE_PARSE_CACHE_SIZE', '10000'))
+
+ParsedAddress = namedtuple(
+    'ParsedAddress', ['street', 'num', 'zip', 'locality'])
+
+_ACCENTS = str.maketrans({
+    u'à': u'a', u'ã': u'a', u'á': u'a', u'â': u'a',
+    u'é': u'e', u'è': u'e', u'ê': u'e', u'ë': u'e',
+    u'î': u'i', u'ï': u'i',
+    u'ù': u'u', u'ü': u'u', u'û': u'u',
+    u'ô': u'o', u'ö': u'o'})
+_SEPARATORS = str.maketrans({u'-': u' ', u'.': u' ', u',': u' ', u';': u' '})
+_NUMBERS = re.compile(r'\d+')
+_PARENTHESIS = re.compile(r'\([^)]*\)')
+
+# The abbreviations and noise words of the street names, the substitutions
+# are applied in this order
+_ABBREVIATIONS = [
+    (u"p\\.", u"place"),
+    (u"pl", u"place"),
+    (u"av", u"avenue"),
+    (u"bd", u"boulevard"),
+    (u"bvd", u"boulevard"),
+    (u"bld", u"boulevard"),
+    (u"zi", u"zone industrielle"),
+    (u"z i", u"zone industrielle"),
+    (u"z a c", u"zone activité"),
+    (u"zac", u"zone activité"),
+    (u"z a e", u"zone activité"),
+    (u"zone activité commerciale", u"zone activité"),
+    (u"zae", u"zone activité"),
+    (u"ctre", u"zone centre"),
+    (u"r", u"rue"),
+    (u"rte", u"route"),
+    (u"r\\.", u"rue"),
+    (u"rt", u"route"),
+    (u"ob", u""),
+    (u"de", u""),
+    (u"des", u""),
+    (u"du", u""),
+    (u"le", u""),
+    (u"la", u""),
+    (u"les", u""),
+    (u"op", u""),
+    (u"um", u""),
+    (u"an", u""),
+    (u"imp", u""),
+    (u"imp.", u""),
+    (u"chat", u"chateau"),
+    (u"zone industrielle", u""),
+    (u"ch", u""),
+    (u"a", u""),
+    (u"d", u""),
+    (u"l", u""),
+    (u"'", u" "),
+    (u"1er", u""),
+    (u"1 er", u""),
+    (u"I er", u""),
+    (u"ier", u""),
+    (u"er", u""),
+    (u"premier", u"1"),
+    (u"ste", u"sainte"),
+    (u"i", u"1"),
+    (u"un", u"1"),
+    (u"ii", u"2"),
+    (u"deux", u"2"),
+    (u"iii", u"3"),
+    (u"trois", u"3"),
+    (u"X", u"10"),
+    (u"XX", u"20"),
+    (u"eme", u""),
+    (u"ème", u""),
+    (u"2eme", u"2"),
+    (u"2ème", u"2"),
+    (u"st", u""),
+    (u"1st", u"1"),
+    (u"nd", u""),
+    (u"2nd", u"2"),
+]
+_ABBREVIATION_PATTERNS = [
+    (re.compile(r'\b%s\b' % abbreviation), replacement)
+    for abbreviation, replacement in _ABBREVIATIONS]
+
+
+@lru_cache(maxsize=CACHE_SIZE)
+def strip_accents(text):
+    if text is None:
+        return None
+    return text.translate(_ACCENTS)
+
+
+@lru_cache(maxsize=CACHE_SIZE)
+def replace_words(text):
+    """
+    Return the street name without punctuation, with the abbreviations
+    expanded and without the noise words.
+    """
+    if text is None:
+        return None
+
+    text = text.translate(_SEPARATORS).strip()
+    text = text.replace(": ", " ").strip()
+    for pattern, replacement in _ABBREVIATION_PATTERNS:
+        text = pattern.sub(replacement, text)
+    text = _PARENTHESIS.sub('', text)
+    return text.replace(u"'", u" ")
+
+
+def _clean(text):
+    return text.replace(",", "").replace("L-", "").replace("l-", "").strip()
+
+
+def normalize_locality(locality):
+    if locality is None:
+        return None
+    locality = _clean(locality).lower()
+    return locality.replace(" sur ", "-sur-").replace("/", "-sur-")
+
+
+def split_street_and_house_number(streetandhouse):
+    """
+    Return the house number and the street of a street with a house number
+    before or after it.
+    """
+    nums = _NUMBERS.findall(streetandhouse)
+    if len(nums) == 0:
+        return None, streetandhouse
+
+    idx = streetandhouse.find(nums[0])
+    if idx == 0:
+        house_num = nums[0]
+        end = len(house_num)
+        next_char = streetandhouse[end:end + 1]
+        if next_char == "-":
+            # 7-9 rue ...
+            nums2 = _NUMBERS.findall(streetandhouse[end + 1:])
+            if len(nums2) > 0:
+                idx2 = streetandhouse.find(nums2[0])
+                house_num = streetandhouse[:idx2 + len(nums2[0])]
+        elif next_char != " " and next_char != "," and\
+                streetandhouse[end + 1:end + 2] == " ":
+            # 54A rue ...
+            house_num = streetandhouse[:end + 1]
+    else:
+        # Rue du 9 mai
+        house_num = nums[-1]
+        end = idx + len(house_num)
+        next_char = streetandhouse[end:end + 1]
+        if next_char != " " and next_char != ",":
+            house_num = streetandhouse[idx:end]
+    return house_num, streetandhouse[len(house_num) + 1:]
+
+
+# We start with house number + street or street + house number
+# 54 avenue G. Diderich or avenue G. Diderich 54
+# Post code 4 digits
+# House number after or before the street
+# House number composed of digit but sometimes letter 54A
+# Post code is followed by locality
+# 54 Avenue gaston diderich 1420 luxembourg
+# Avenue gaston diderich 54 , 1420 luxembourg
+# 14 Allée de la Jeunesse Sacrifiée 1940-1945 5863 Alzinghen
+# 2A Rue du 9 mai 1944 2112 Howald
+@lru_cache(maxsize=CACHE_SIZE)
+def parse_address(address):
+    """
+    Return the ParsedAddress of a full address. The last word is the
+    locality, except when it is a post code: then the locality is None and
+    is to be found from the post code.
+    """
+    if address is None:
+        return ParsedAddress(None, None, None, None)
+
+    address = _PARENTHESIS.sub('', address.strip()).strip()
+    address = address.replace(",", " ").replace("L-", "").replace("l-", "")
+
+    zip = None
+    words = address.split(" ")
+    locality = words[-1]
+    if locality.isdigit():
+        zip = locality
+        locality = None
+    else:
+        # Next to the last word, if 4 digits then this is the post code
+        t_zip = words[len(words) - 2]
+        if t_zip.isdigit() and len(t_zip) == 4:
+            zip = t_zip
+
+    if zip is not None:
+        street = address.split(zip)[0]
+    else:
+        street = address[0:len(address) - len(locality)]
+
+    house_num, street = split_street_and_house_number(street)
+
+    if street is not None:
+        street = _clean(street).lower()
+    if house_num is not None:
+        house_num = _clean(house_num)
+    if zip is not None:
+        zip = _clean(zip)
+
+    return ParsedAddress(street, house_num, zip, normalize_locality(locality))
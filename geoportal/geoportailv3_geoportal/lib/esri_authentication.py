@@ -1,9 +1,21 @@
 from typing import Optional, Dict
+import hashlib
 import json
+import os
+import threading
 from datetime import datetime, timedelta
-import requests
 import urllib
 from collections import namedtuple
+from c2cgeoportal_geoportal.lib.caching import get_region
+from geoportailv3_geoportal.lib import http_client
+
+# Shared by the workers, see the cache configuration in vars.yaml
+token_region = get_region("arcgis-token")
+_token_region_lock = threading.Lock()
+
+# Seconds before the expiry of a token when it is renewed
+TOKEN_RENEW_MARGIN = int(os.environ.get('ARCGIS_TOKEN_RENEW_MARGIN', '120'))
+MIN_RENEW_DELAY = 30
 
 
 class ESRITokenException(Exception):
@@ -17,18 +29,55 @@ class ESRIServerException(Exception):
 ResultTuple = namedtuple('ResultTuple', ['data', 'content_type'])
 
 
-def read_request_with_token(url_request, parent_request, log, timeout=15, renew_token=True):
-    result = urllib.request.urlopen(url_request, None, timeout)
-    data = result.read()
+# Only the answers with one of these content types can hold an ArcGIS error
+ERROR_CONTENT_TYPES = ('json', 'javascript', 'text/plain')
+# ArcGIS errors are small documents, larger answers are never parsed
+ERROR_MAX_SIZE = 64 * 1024
+
+
+def _open(url_request, timeout):
+    return http_client.request(
+        url_request.get_method(), url_request.full_url,
+        data=url_request.data, headers=dict(url_request.header_items()),
+        timeout=timeout, stream=True)
+
+
+def _read_error(result):
+    """
+    Return the parsed answer if it is an ArcGIS error, None otherwise.
+    Images, documents and large answers are left unread.
+    """
+    content_type = (result.headers.get('Content-Type') or '').lower()
+    if content_type and not any(t in content_type for t in ERROR_CONTENT_TYPES):
+        return None
+    content_length = result.headers.get('Content-Length', '')
+    if content_length.isdigit() and int(content_length) > ERROR_MAX_SIZE:
+        return None
+    data = result.content
+    if len(data) > ERROR_MAX_SIZE:
+        return None
     try:
         resp = json.loads(data)
-    except Exception as e:
-        resp = {}
-        # log.info(f"Response is no valid json, {type(e)}: {str(e)}")
-    error = resp.get("error")
-    if error is None:
-        return ResultTuple(data, result.info()['Content-Type'])
-    elif error.get("code") not in (498, 499):
+    except Exception:
+        return None
+    if isinstance(resp, dict) and resp.get("error") is not None:
+        return resp
+    return None
+
+
+def open_request_with_token(url_request, parent_request, log, timeout=None, renew_token=True):
+    """
+    Open the url, renew the token if it is refused by the ArcGIS server and
+    return the streamed response. The body is only read to look for an
+    error when it may be one, binary content can be streamed to the client
+    with http_client.iter_content.
+    """
+    result = _open(url_request, timeout)
+    resp = _read_error(result)
+    if resp is None:
+        return result
+    result.close()
+    if resp["error"].get("code") not in (498, 499):
         # not a token error
         raise ESRIServerException(f'Original server error: {resp}')
     else:
@@ -38,74 +87,114 @@ def read_request_with_token(url_request, parent_request, log, timeout=15, renew_
             raise ESRITokenException(f'Original server error: {resp}')
         else:
             log.info("Try to get new token")
-            auth_token = get_arcgis_token(parent_request, log, force_renew=True, service_url=url_request.full_url)
+            (scheme, netloc, path, query, fragment) = urllib.parse.urlsplit(url_request.full_url)
+            query_params = dict(urllib.parse.parse_qsl(query))
+            refused_token = query_params.get("token")
+            if refused_token is None and isinstance(url_request.data, bytes):
+                refused_token = dict(urllib.parse.parse_qsl(url_request.data.decode())).get("token")
+            auth_token = get_arcgis_token(
+                parent_request, log, force_renew=True,
+                service_url=url_request.full_url, refused_token=refused_token)
             if 'token' in auth_token:
-                (scheme, netloc, path, query, fragment) = urllib.parse.urlsplit(url_request.full_url)
-                query_params = dict(urllib.parse.parse_qsl(query))
                 query_params["token"] = auth_token['token']
                 url_tuple = (scheme, netloc, path, urllib.parse.urlencode(query_params), fragment)
                 url = urllib.parse.urlunsplit(url_tuple)
                 url_request.full_url = url
 
                 # Try to re-read with new token
-                result = urllib.request.urlopen(url_request, None, timeout)
-                data = result.read()
-
-            try:
-                resp = json.loads(data)
-            except Exception as e:
-                resp = {}
-                log.info(f"Response is no valid json, {type(e)}: {str(e)}")
-            if 'error' in resp:
-                raise ESRITokenException(f'Original server error: {resp}')
-            return ResultTuple(data, result.info()['Content-Type'])
-
-def get_arcgis_token(request, log, force_renew=False, token_check_url: Optional[str] = None, service_url: Optional[str] = None) -> Dict:
-    session = request.session
+                result = _open(url_request, timeout)
+                resp = _read_error(result)
+                if resp is None:
+                    return result
+                result.close()
+            raise ESRITokenException(f'Original server error: {resp}')
+
+
+def read_request_with_token(url_request, parent_request, log, timeout=None, renew_token=True):
+    result = open_request_with_token(url_request, parent_request, log, timeout, renew_token)
+    return ResultTuple(result.content, result.headers.get('Content-Type'))
+
+
+def get_arcgis_token(request, log, force_renew=False, token_check_url: Optional[str] = None,
+                     service_url: Optional[str] = None, refused_token: Optional[str] = None) -> Dict:
+    """
+    Return the token of the ArcGIS portal of the service url. The tokens are
+    shared by all the sessions and workers through the arcgis-token cache
+    region, only one of them asks for a new token when it is about to
+    expire, the others keep using the current one meanwhile.
+    With force_renew the token is renewed unless the refused_token has
+    already been replaced by another request.
+    """
     config = request.registry.settings
-    auth_token = {}
+    generate_token_url = _get_generate_token_url(config, service_url)
+    key = _get_token_key(config, generate_token_url)
+    region = _get_token_region()
+
+    def creator():
+        return _renew_arcgis_token(config, log, generate_token_url)
+
     if force_renew:
-        log.info('force renew token')
-        auth_token = _renew_arcgis_token(session, config, log, service_url=service_url)
-    elif 'auth_token' not in session:
-        log.info('could not find token in session - request new token')
-        auth_token = _renew_arcgis_token(session, config, log, service_url=service_url)
-    else:
-        auth_token = session['auth_token']
-        token_expire = datetime.fromtimestamp(float(auth_token['expires'])/1000)
-        # check if token is expired in the next 30s.
-        is_expired = token_expire < (datetime.now() + timedelta(seconds=30))
-        if is_expired:
-            log.info('token expired - request new token')
-            auth_token = _renew_arcgis_token(session, config, log, service_url=service_url)
+        current = region.get(key, ignore_expiration=True)
+        if not current or refused_token is None or current.get('token') == refused_token:
+            log.info('force renew token')
+            region.delete(key)
         else:
-            log.info('token still valid')
-            # the parameter token_check_url allows to check the token directly on the
-            # destination url, by default the check is performed on the token issuing url
-            # TODO: disable systematic token check below in prod, enable only in dev
-            if False:
-                token_check_data = urllib.parse.urlencode({'f': 'json', 'token': auth_token['token']}).encode()
-                if token_check_url is None:
-                    token_check_request = urllib.request.Request(config['arcgis_token_url'], data=token_check_data)
-                else:
-                    token_check_request = urllib.request.Request(token_check_url, data=token_check_data)
-                try:
-                    log.info(f"Check token at: {token_check_request.full_url}")
-                    rep = urllib.request.urlopen(token_check_request, timeout=15)
-                    check = json.load(rep)
-                    if 'error' in check:
-                        log.error(f"Token refused by: {token_check_request.full_url} - "
-                                  f"server answered {check['error']}")
-                    else:
-                        log.info(f"Token OK, answer: {check}")
-                except:
-                    log.error(f"Failed token check at: {token_check_request.full_url}")
-                assert 'error' not in check
-
+            log.info('token already renewed by another request')
+    auth_token = region.get_or_create(
+        key, creator, expiration_time=_get_renew_delay(config),
+        should_cache_fn=lambda token: 'token' in token)
+    if 'token' in auth_token and _expires_soon(auth_token):
+        # The portal gave a token shorter than the configured validity
+        log.info('token expired - request new token')
+        region.delete(key)
+        auth_token = region.get_or_create(
+            key, creator, expiration_time=_get_renew_delay(config),
+            should_cache_fn=lambda token: 'token' in token)
     return auth_token
 
 
-def _renew_arcgis_token(session, config, log, service_url=None):
+def _get_token_region():
+    # Outside of the application (lingua extractor) the cache regions are not
+    # configured, the tokens are then only kept in the process.
+    if not token_region.is_configured:
+        with _token_region_lock:
+            if not token_region.is_configured:
+                token_region.configure('dogpile.cache.memory')
+    return token_region
+
+
+def _get_generate_token_url(config, service_url=None):
+    #/portal/sharing/rest/generateToken
+    # The token url is no more read from config.
+    # As we could have more than one token url, we decided to use the request url to find out the token url
+    if service_url is None:
+        return urllib.parse.urljoin(f"{config['arcgis_token_url']}/", "generateToken")
+    parsed_url = urllib.parse.urlparse(service_url)
+    # Reconstruction du protocole et du host
+    return f"{parsed_url.scheme}://{parsed_url.netloc}/portal/sharing/rest/generateToken"
+
+
+def _get_token_key(config, generate_token_url):
+    # The password is hashed to get a new token when the credentials change
+    credential = hashlib.sha1(
+        f"{config['arcgis_token_username']}:{config['arcgis_token_password']}".encode()
+    ).hexdigest()
+    return f"arcgis_token:{generate_token_url}:{credential}"
+
+
+def _get_renew_delay(config):
+    # The validity is in minutes, the token is renewed before it expires
+    validity = int(config.get('arcgis_token_validity', 600) or 600) * 60
+    return max(validity - TOKEN_RENEW_MARGIN, MIN_RENEW_DELAY)
+
+
+def _expires_soon(auth_token):
+    token_expire = datetime.fromtimestamp(float(auth_token.get('expires', 0)) / 1000)
+    # check if token is expired in the next 30s.
+    return token_expire < (datetime.now() + timedelta(seconds=30))
+
+
+def _renew_arcgis_token(config, log, generate_token_url):
     token_data = {
         'f': 'json',
         'username': config["arcgis_token_username"],
@@ -113,25 +202,13 @@ def _renew_arcgis_token(session, config, log, service_url=None):
         'referer': config.get('arcgis_token_referer', 'x'),
         'expiration': config.get('arcgis_token_validity', 600)
     }
-    #/portal/sharing/rest/generateToken
-    # The token url is no more read from config.
-    # As we could have more than one token url, we decided to use the request url to find out the token url
-    if service_url is None:
-        generate_token_url = urllib.parse.urljoin(f"{config['arcgis_token_url']}/", "generateToken")
-    else:
-        parsed_url = urllib.parse.urlparse(service_url)
-        # Reconstruction du protocole et du host
-        generate_token_url = f"{parsed_url.scheme}://{parsed_url.netloc}/portal/sharing/rest/generateToken"
-    response = requests.post(generate_token_url, data=token_data, timeout=15)
-    response.raise_for_status()
+    response = http_client.request('POST', generate_token_url, data=token_data)
     auth_token = response.json()
     if 'error' in auth_token:
         log.error(f"Failed getting token from: {generate_token_url} - "
                   f"server answered {auth_token['error']}")
         auth_token = {}
-        session.pop('auth_token', None)
     else:
         log.info("Success: token valid until "
                  f"{datetime.fromtimestamp(float(auth_token.get('expires', 0)) / 1000)}")
-        session['auth_token'] = auth_token
     return auth_token
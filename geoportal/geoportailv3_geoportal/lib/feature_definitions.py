@@ -0,0 +1,127 @@
+# -*- coding: utf-8 -*-
+import logging
+import os
+from collections import namedtuple
+
+from c2cgeoportal_commons.models import DBSession
+from c2cgeoportal_commons.models.main import RestrictionArea, Role, Layer, Metadata
+from c2cgeoportal_geoportal.lib.caching import get_region
+from geoportailv3_geoportal.lib import invalidation
+from geoportailv3_geoportal.models import LuxGetfeatureDefinition, LuxLayerInternalWMS
+
+log = logging.getLogger(__name__)
+cache_region = get_region("obj")
+
+# Time in seconds before the snapshot is reloaded from the database
+SNAPSHOT_EXPIRATION = int(os.environ.get('GFI_DEFINITIONS_CACHE_TTL', '300'))
+
+# Layer metadata used by the getfeatureinfo service
+METADATA_NAMES = (
+    'return_clicked_point',
+    'ogc_layers',
+    'ogc_query_layers',
+    'ogc_info_format',
+    'ogc_info_srs',
+    'ogc_info_url',
+)
+
+# Read only copy of a LuxGetfeatureDefinition, safe to share between
+# requests and threads.
+FeatureDefinition = namedtuple(
+    'FeatureDefinition',
+    [attr.key for attr in LuxGetfeatureDefinition.__mapper__.column_attrs])
+
+InternalWMS = namedtuple('InternalWMS', ['url', 'layers'])
+
+
+class FeatureDefinitionSnapshot(object):
+    """
+    In memory copy of everything the getfeatureinfo service reads from
+    the main database for a layer: the definitions by role, the public flag,
+    the roles of the restriction areas, the metadata and the internal WMS
+    configuration. All the layer ids are strings.
+    """
+
+    def __init__(self):
+        self.public = {}
+        self.restricted_roles = {}
+        self.definitions = {}
+        self.metadata = {}
+        self.internal_wms = {}
+
+    def load(self, session):
+        for layer_id, public in session.query(Layer.id, Layer.public):
+            self.public[str(layer_id)] = public
+
+        restrictions = session.query(Layer.id, Role.id).\
+            select_from(RestrictionArea).\
+            join(RestrictionArea.layers).\
+            join(RestrictionArea.roles)
+        for layer_id, role_id in restrictions:
+            self.restricted_roles.setdefault(str(layer_id), set()).add(role_id)
+
+        definitions = session.query(LuxGetfeatureDefinition).\
+            order_by(LuxGetfeatureDefinition.id)
+        for definition in definitions:
+            key = (str(definition.layer).strip(), definition.role)
+            self.definitions.setdefault(key, []).append(FeatureDefinition(
+                *[getattr(definition, field) for field in FeatureDefinition._fields]))
+
+        metadatas = session.query(
+            Metadata.item_id, Metadata.name, Metadata.value).\
+            filter(Metadata.name.in_(METADATA_NAMES)).\
+            order_by(Metadata.id)
+        for item_id, name, value in metadatas:
+            self.metadata.setdefault(str(item_id), {}).setdefault(name, value)
+
+        for layer_id, url, layers in session.query(
+                LuxLayerInternalWMS.id, LuxLayerInternalWMS.url,
+                LuxLayerInternalWMS.layers):
+            self.internal_wms[str(layer_id)] = InternalWMS(url, layers)
+
+        log.info("Loaded %d getfeatureinfo definitions for %d layers",
+                 sum(len(d) for d in self.definitions.values()),
+                 len(self.public))
+
+    def get_definitions(self, layer, role_id=None, bypass_public=False):
+        """
+        Return the definitions of the layer for the role, or an empty list
+        if the layer does not exist or the role is not allowed to query it.
+        """
+        layer = str(layer).strip()
+        if layer not in self.public:
+            return []
+        if not bypass_public and not self.public[layer]:
+            if role_id is None or \
+                    role_id not in self.restricted_roles.get(layer, ()):
+                return []
+        if role_id is not None and (layer, role_id) in self.definitions:
+            return self.definitions[(layer, role_id)]
+        return self.definitions.get((layer, None), [])
+
+    def get_metadata(self, layer, name):
+        return self.metadata.get(str(layer).strip(), {}).get(name)
+
+    def get_internal_wms(self, layer):
+        return self.internal_wms.get(str(layer).strip())
+
+
+@cache_region.cache_on_arguments(expiration_time=SNAPSHOT_EXPIRATION)
+def _load_snapshot():
+    snapshot = FeatureDefinitionSnapshot()
+    snapshot.load(DBSession)
+    return snapshot
+
+
+def get_snapshot():
+    invalidation.check('gfi-definitions', _load_snapshot.invalidate)
+    return _load_snapshot()
+
+
+def invalidate():
+    """
+    Reload the definitions in this process now, and in the other processes
+    at their next check, see lib/invalidation.py.
+    """
+    _load_snapshot.invalidate()
+    invalidation.publish('gfi-definitions')
@@ -0,0 +1,311 @@
+# -*- coding: utf-8 -*-
+import difflib
+import logging
+import os
+import re
+from collections import Counter, namedtuple
+
+from geoalchemy2 import func
+from geoalchemy2.elements import WKBElement
+from geoalchemy2.shape import to_shape
+from shapely.wkt import loads
+
+from c2cgeoportal_commons.models import DBSessions
+from c2cgeoportal_geoportal.lib.caching import get_region
+from geoportailv3_geoportal.geocode import LocalityAggregate, Neighbourhood, \
+    ZipAggregate
+from geoportailv3_geoportal.lib import invalidation
+from geoportailv3_geoportal.lib.address_parser import strip_accents
+
+log = logging.getLogger(__name__)
+cache_region = get_region("obj")
+
+# Time in seconds before the index is loaded again from the database
+INDEX_EXPIRATION = int(os.environ.get('GEOCODE_INDEX_TTL', '3600'))
+# Number of entries sharing the most trigrams with the searched name which
+# are compared first, their best ratio bounds the other comparisons
+MAX_CANDIDATES = 30
+
+_PARENTHESIS = re.compile(r'\([^)]*\)')
+
+# name is the lower case name, key the normalized name to compare with and
+# label the name as written in the database
+Entry = namedtuple('Entry', ['name', 'key', 'geom', 'label'])
+LocalityMatch = namedtuple(
+    'LocalityMatch', ['name', 'geom', 'ratio', 'is_neighbourhood'])
+
+
+def _to_shape(geom):
+    if isinstance(geom, str):
+        return loads(geom)
+    if isinstance(geom, WKBElement):
+        return to_shape(geom)
+    return geom
+
+
+def _length_bound(length, other_length):
+    # Upper bound of the difflib ratio of two strings of these lengths
+    total = length + other_length
+    if total == 0:
+        return 1.0
+    return 2.0 * min(length, other_length) / total
+
+
+def _trigrams(key):
+    key = ' ' + key + ' '
+    return {key[i:i + 3] for i in range(len(key) - 2)}
+
+
+class TrigramMatcher(object):
+    """
+    Find the entries with the best difflib ratio, the ratio the geocoder
+    always used. The entries sharing the most trigrams are compared first,
+    the other ones only when the upper bound of their ratio, given by their
+    length then by their characters, can still beat the best ratio. The
+    results are the ones of a comparison with every entry.
+    """
+
+    def __init__(self, entries):
+        self.entries = entries
+        self.by_key = {}
+        # length of the key -> indexes of the entries
+        self.by_length = {}
+        self.trigrams = {}
+        self.counters = []
+        for idx, entry in enumerate(entries):
+            self.by_key.setdefault(entry.key, idx)
+            self.by_length.setdefault(len(entry.key), []).append(idx)
+            self.counters.append(Counter(entry.key))
+            for trigram in _trigrams(entry.key):
+                self.trigrams.setdefault(trigram, []).append(idx)
+
+    def candidates(self, key, limit=MAX_CANDIDATES):
+        counts = {}
+        for trigram in _trigrams(key):
+            for idx in self.trigrams.get(trigram, ()):
+                counts[idx] = counts.get(idx, 0) + 1
+        return sorted(counts, key=lambda idx: (-counts[idx], idx))[:limit]
+
+    def _ratio(self, key, idx):
+        return difflib.SequenceMatcher(None, key, self.entries[idx].key).ratio()
+
+    def _upper_bound(self, key, key_counter, idx):
+        # The difflib quick_ratio, without building a SequenceMatcher
+        counter = self.counters[idx]
+        length = len(key) + len(self.entries[idx].key)
+        if length == 0:
+            return 1.0
+        common = sum(min(count, counter[char])
+                     for char, count in key_counter.items() if char in counter)
+        return 2.0 * common / length
+
+    def _lengths(self, key, min_ratio):
+        # The lengths of which the entries may have a ratio of at least
+        # min_ratio, the ones with the greatest bound first
+        bounds = [(_length_bound(len(key), length), length)
+                  for length in self.by_length]
+        bounds.sort(key=lambda bound: (-bound[0], bound[1]))
+        return [(bound, length) for bound, length in bounds
+                if bound >= min_ratio]
+
+    def best(self, key):
+        """
+        Return the best entry and its ratio, the first of the entries wins
+        on equal ratios.
+        """
+        if key in self.by_key:
+            return self.entries[self.by_key[key]], 1.0
+        best_idx = None
+        best_ratio = 0
+        compared = set()
+        for idx in self.candidates(key):
+            compared.add(idx)
+            ratio = self._ratio(key, idx)
+            if ratio > best_ratio or \
+                    (ratio == best_ratio and best_idx is not None and
+                     idx < best_idx):
+                best_idx, best_ratio = idx, ratio
+        key_counter = Counter(key)
+        for length_bound, length in self._lengths(key, best_ratio):
+            # The bounds of the next lengths are not greater
+            if length_bound < best_ratio or length_bound == 0:
+                break
+            for idx in self.by_length[length]:
+                if idx in compared:
+                    continue
+                upper_bound = self._upper_bound(key, key_counter, idx)
+                if upper_bound < best_ratio or upper_bound == 0 or \
+                        (upper_bound == best_ratio and idx > best_idx):
+                    continue
+                ratio = self._ratio(key, idx)
+                if ratio > best_ratio or \
+                        (ratio == best_ratio and best_idx is not None and
+                         idx < best_idx):
+                    best_idx, best_ratio = idx, ratio
+        if best_idx is None:
+            return None, 0
+        return self.entries[best_idx], best_ratio
+
+    def matches(self, key, min_ratio):
+        """
+        Return the entries with a ratio greater than min_ratio, in their
+        order.
+        """
+        key_counter = Counter(key)
+        indexes = sorted(
+            idx for length_bound, length in self._lengths(key, min_ratio)
+            if length_bound > min_ratio for idx in self.by_length[length])
+        return [
+            self.entries[idx] for idx in indexes
+            if self._upper_bound(key, key_counter, idx) > min_ratio and
+            self._ratio(key, idx) > min_ratio]
+
+
+class GeocodingIndex(object):
+    """
+    In memory copy of the localities, neighbourhoods and post codes of the
+    address points, used by the geocoder to resolve a locality without
+    querying the database. It is loaded from the aggregates built by
+    scripts/geocode_aggregates.py.
+    """
+
+    def __init__(self):
+        self.localities = []
+        self.locality_by_name = {}
+        self.neighbourhoods = []
+        # One entry by post code and locality of the address points, the
+        # names are the post codes
+        self.zip_localities = []
+        self.zip_centroids = {}
+        self.localities_by_zip = {}
+        self.locality_matcher = None
+        self.neighbourhood_matcher = None
+        self.zip_matcher = None
+
+    def load(self, session):
+        for geom, localite in session.query(
+                func.ST_AsText(LocalityAggregate.geom).label("geom"),
+                LocalityAggregate.localite).order_by(LocalityAggregate.id):
+            if localite is None:
+                continue
+            entry = Entry(
+                localite.strip().lower(),
+                _PARENTHESIS.sub('', strip_accents(localite)).strip().lower(),
+                _to_shape(geom),
+                localite.strip())
+            self.localities.append(entry)
+            self.locality_by_name.setdefault(entry.name, entry)
+
+        for geom, locality, name in session.query(
+                (func.ST_AsText(func.ST_Centroid(Neighbourhood.geom))).
+                label("geom"),
+                Neighbourhood.locality,
+                Neighbourhood.name):
+            self.neighbourhoods.append(Entry(
+                locality.strip().lower(),
+                strip_accents(name.strip().lower().replace("-", " ")),
+                _to_shape(geom),
+                locality.strip()))
+
+        for geom, code_postal, localite in session.query(
+                func.ST_AsText(ZipAggregate.geom).label("geom"),
+                ZipAggregate.code_postal, ZipAggregate.localite).\
+                order_by(ZipAggregate.id):
+            if localite is None:
+                continue
+            code_postal = str(code_postal).strip()
+            self.zip_localities.append(Entry(
+                code_postal,
+                _PARENTHESIS.sub('', strip_accents(localite)).strip().lower(),
+                None,
+                localite.strip()))
+            self.localities_by_zip.setdefault(code_postal.lower(), []).\
+                append(localite.strip())
+            self.zip_centroids.setdefault(code_postal.lower(), []).append(
+                (localite, _to_shape(geom)))
+
+        self.locality_matcher = TrigramMatcher(self.localities)
+        self.neighbourhood_matcher = TrigramMatcher(self.neighbourhoods)
+        self.zip_matcher = TrigramMatcher(self.zip_localities)
+        log.info("Loaded %d localities, %d neighbourhoods and %d post codes "
+                 "for the geocoder", len(self.localities),
+                 len(self.neighbourhoods), len(self.localities_by_zip))
+
+    def best_locality(self, p_locality):
+        """
+        Return the LocalityMatch of the locality or neighbourhood closest to
+        the given name, or None.
+        """
+        key = strip_accents(p_locality.strip().lower())
+        entry, ratio = self.locality_matcher.best(key)
+        is_neighbourhood = False
+        if ratio != 1:
+            neighbourhood, neighbourhood_ratio = \
+                self.neighbourhood_matcher.best(key)
+            if neighbourhood_ratio > ratio:
+                entry, ratio = neighbourhood, neighbourhood_ratio
+                is_neighbourhood = True
+        if entry is None:
+            return None
+        return LocalityMatch(entry.name, entry.geom, ratio, is_neighbourhood)
+
+    def get_locality(self, name):
+        """
+        Return the Entry of the locality with exactly this name.
+        """
+        return self.locality_by_name.get(name.strip().lower())
+
+    def get_zips(self, locality, min_ratio=0.80):
+        key = strip_accents(locality.strip().lower())
+        return [entry.name for entry in self.zip_matcher.matches(key, min_ratio)]
+
+    def has_zip(self, p_zip):
+        return p_zip.lower() in self.localities_by_zip
+
+    def get_localities(self, p_zip):
+        return self.localities_by_zip.get(str(p_zip).strip().lower(), [])
+
+    def get_zip_centroids(self, p_zip):
+        """
+        Return the (locality, centroid) of the address points of the post
+        code.
+        """
+        return self.zip_centroids.get(str(p_zip).strip().lower(), [])
+
+
+@cache_region.cache_on_arguments(expiration_time=INDEX_EXPIRATION)
+def _load_index():
+    index = GeocodingIndex()
+    index.load(DBSessions['ecadastre'])
+    return index
+
+
+def get_index():
+    invalidation.check('geocoding-index', _load_index.invalidate)
+    return _load_index()
+
+
+def warm_up(event):
+    """
+    Subscriber of ApplicationCreated, the index is loaded before the first
+    geocoding. The connections are closed afterwards, a forking server must
+    not share them with its workers.
+    """
+    try:
+        get_index()
+    except Exception:
+        log.exception("Unable to load the geocoding index at startup")
+    finally:
+        session = DBSessions.get('ecadastre')
+        if session is not None:
+            session.remove()
+            session.bind.dispose()
+
+
+def invalidate():
+    """
+    Called by scripts/geocode_aggregates.py once the localities and post
+    codes are rebuilt, the processes of the application load them again.
+    """
+    _load_index.invalidate()
+    invalidation.publish('geocoding-index')
@@ -0,0 +1,103 @@
+# -*- coding: utf-8 -*-
+import os
+import threading
+
+import requests
+from requests.adapters import HTTPAdapter
+
+# Number of hosts and number of kept alive connections per host
+POOL_CONNECTIONS = int(os.environ.get('ARCGIS_POOL_CONNECTIONS', '10'))
+POOL_MAXSIZE = int(os.environ.get('ARCGIS_POOL_MAXSIZE', '20'))
+# Default timeouts in seconds
+CONNECT_TIMEOUT = float(os.environ.get('ARCGIS_CONNECT_TIMEOUT', '5'))
+READ_TIMEOUT = float(os.environ.get('ARCGIS_READ_TIMEOUT', '15'))
+# Size of the chunks of the streamed answers
+CHUNK_SIZE = 64 * 1024
+
+_lock = threading.Lock()
+_session = None
+_pid = None
+
+
+def get_session():
+    """
+    Return the requests session shared by the process for the ArcGIS
+    servers. The session is created again after a fork so the workers
+    never share their sockets with the master process.
+    """
+    global _session, _pid
+    if _session is None or _pid != os.getpid():
+        with _lock:
+            if _session is None or _pid != os.getpid():
+                session = requests.Session()
+                adapter = HTTPAdapter(
+                    pool_connections=POOL_CONNECTIONS,
+                    pool_maxsize=POOL_MAXSIZE)
+                session.mount('http://', adapter)
+                session.mount('https://', adapter)
+                session.headers['Accept-Encoding'] = 'gzip, deflate'
+                _session = session
+                _pid = os.getpid()
+    return _session
+
+
+def get_timeout(read_timeout=None):
+    if read_timeout is None:
+        read_timeout = READ_TIMEOUT
+    return (CONNECT_TIMEOUT, read_timeout)
+
+
+def request(method, url, data=None, headers=None, timeout=None, stream=False):
+    """
+    Send a request with the shared session, the HTTP errors are raised
+    like with urllib.request.urlopen.
+    """
+    response = get_session().request(
+        method, url, data=data, headers=headers,
+        timeout=get_timeout(timeout), stream=stream)
+    try:
+        response.raise_for_status()
+    except Exception:
+        response.close()
+        raise
+    return response
+
+
+def iter_content(response, chunk_size=CHUNK_SIZE):
+    """
+    Iterate over the body of a streamed response, to be used as the
+    app_iter of a pyramid response. The connection goes back to the pool
+    when the body is read or the client is gone.
+    """
+    try:
+        for chunk in response.iter_content(chunk_size):
+            yield chunk
+    finally:
+        response.close()
+
+
+def get_stats():
+    """
+    Return the reuse statistics of the connection pools of the process:
+    for each host the number of opened connections and the number of
+    requests sent, the difference is the number of reused connections.
+    """
+    stats = []
+    session = _session
+    if session is None or _pid != os.getpid():
+        return stats
+    pools = session.get_adapter('https://').poolmanager.pools
+    for key in list(pools.keys()):
+        pool = pools.get(key)
+        if pool is None:
+            continue
+        stats.append({
+            'scheme': pool.scheme,
+            'host': pool.host,
+            'port': pool.port,
+            'connections': pool.num_connections,
+            'requests': pool.num_requests,
+            'reused': pool.num_requests - pool.num_connections,
+            'maxsize': POOL_MAXSIZE,
+        })
+    return stats
@@ -0,0 +1,77 @@
+# -*- coding: utf-8 -*-
+import copy
+import os
+
+from geoportailv3_geoportal.lib import invalidation
+from geoportailv3_geoportal.lib.ttl_cache import TTLCache
+
+# Maximum number of results kept by each process, the least recently used
+# are dropped first
+MAX_ENTRIES = int(os.environ.get('GFI_CACHE_MAX_ENTRIES', '10000'))
+# Size of the grid on which the clicks are snapped, relative to the size of
+# the box, the clicks in the same cell share their results
+SNAP_RATIO = float(os.environ.get('GFI_CACHE_SNAP_RATIO', '0.25'))
+
+# The first item of the keys is the layer, the time to live is the one of
+# the layer
+_entries = TTLCache(MAX_ENTRIES, 0)
+
+
+def snap_box(coordinates):
+    """
+    Return the box snapped on a grid proportional to its size, to be used in
+    a cache key. Two clicks closer than a fraction of the tolerance give the
+    same snapped box.
+    """
+    if coordinates is None:
+        return None
+    minx, miny, maxx, maxy = [float(c) for c in coordinates]
+    step = max(maxx - minx, maxy - miny) * SNAP_RATIO
+    if step <= 0:
+        return (minx, miny, maxx, maxy)
+    return (round(step, 3),) + tuple(
+        int(round(c / step)) for c in (minx, miny, maxx, maxy))
+
+
+def snap_resolution(bbox, width):
+    """
+    Return the resolution of the map rounded to two significant digits, to
+    be used in a cache key, or None if it is unknown.
+    """
+    try:
+        minx, miny, maxx, maxy = [float(c) for c in bbox.split(',')]
+        resolution = abs(maxx - minx) / float(width)
+    except (AttributeError, TypeError, ValueError, ZeroDivisionError):
+        return None
+    return float('%.2g' % resolution)
+
+
+def get(key):
+    """
+    Return a copy of the cached results, or None if they are missing or
+    expired.
+    """
+    invalidation.check('gfi-results', _entries.clear)
+    results = _entries.get(key)
+    if results is None:
+        return None
+    # The results are completed by the caller (tooltips, stats)
+    return copy.deepcopy(results)
+
+
+def set(key, results, ttl):
+    _entries.set(key, copy.deepcopy(results), ttl)
+
+
+def invalidate(layer=None):
+    """
+    Drop the cached results of a layer, or of all the layers. The other
+    processes drop all their results at their next check, see
+    lib/invalidation.py.
+    """
+    if layer is None:
+        _entries.clear()
+    else:
+        layer = str(layer).strip()
+        _entries.discard(lambda key: key[0] == layer)
+    invalidation.publish('gfi-results')
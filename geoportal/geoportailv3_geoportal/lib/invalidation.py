@@ -0,0 +1,84 @@
+# -*- coding: utf-8 -*-
+import logging
+import os
+import threading
+import uuid
+from time import monotonic
+
+from dogpile.cache.api import NO_VALUE
+
+from c2cgeoportal_geoportal.lib.caching import get_region
+
+log = logging.getLogger(__name__)
+
+# Shared by the workers, see the cache configuration in vars.yaml
+generation_region = get_region("invalidation")
+_region_lock = threading.Lock()
+
+# Time in seconds between two reads of the generation of a cache
+CHECK_DELAY = int(os.environ.get('CACHE_INVALIDATION_CHECK_DELAY', '10'))
+
+_lock = threading.Lock()
+# name -> (next check, generation)
+_checked = {}
+
+
+def _get_region():
+    # Outside of the application (scripts) the cache regions may not be
+    # configured, the invalidations then only reach the current process.
+    if not generation_region.is_configured:
+        with _region_lock:
+            if not generation_region.is_configured:
+                generation_region.configure('dogpile.cache.memory')
+    return generation_region
+
+
+def publish(name):
+    """
+    Ask the other processes to drop their in-memory cache name, they do it
+    at their next check. The caller drops the cache of its own process.
+    """
+    generation = uuid.uuid4().hex
+    try:
+        _get_region().set(name, generation)
+    except Exception:
+        log.exception("Unable to publish the invalidation of %s", name)
+        return
+    with _lock:
+        _checked[name] = (monotonic() + CHECK_DELAY, generation)
+
+
+def _get_generation(name):
+    generation = _get_region().get(name)
+    return None if generation is NO_VALUE else generation
+
+
+def check(name, invalidate, get_generation=None, delay=None):
+    """
+    Call invalidate if the generation of the cache name changed since the
+    last check, the generation is read at most every delay seconds
+    (CHECK_DELAY by default). Without get_generation it is the one given by
+    publish in another process.
+    """
+    if delay is None:
+        delay = CHECK_DELAY
+    with _lock:
+        checked = _checked.get(name)
+        if checked is not None and checked[0] > monotonic():
+            return
+        # The other threads keep the previous generation during the check
+        _checked[name] = (monotonic() + delay,
+                          checked[1] if checked is not None else None)
+    try:
+        if get_generation is None:
+            generation = _get_generation(name)
+        else:
+            generation = get_generation()
+    except Exception:
+        log.exception("Unable to get the generation of %s", name)
+        return
+    with _lock:
+        changed = checked is not None and checked[1] != generation
+        _checked[name] = (monotonic() + delay, generation)
+    if changed:
+        invalidate()
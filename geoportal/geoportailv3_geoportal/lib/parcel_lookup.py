@@ -0,0 +1,116 @@
+# -*- coding: utf-8 -*-
+import copy
+import os
+
+from geoalchemy2 import func
+
+from geoportailv3_geoportal.geocode import Address, Parcel
+from geoportailv3_geoportal.lib import invalidation, reverse_geocoder
+from geoportailv3_geoportal.lib.projections import transform_coordinates
+from geoportailv3_geoportal.lib.ttl_cache import TTLCache
+
+# Maximum number of parcels kept by each process, the least recently used
+# are dropped first
+MAX_ENTRIES = int(os.environ.get('PARCEL_CACHE_MAX_ENTRIES', '50000'))
+# Time in seconds during which the addresses of a parcel are kept
+TTL = int(os.environ.get('PARCEL_CACHE_TTL', '3600'))
+# Maximum number of parcels of a query
+CHUNK_SIZE = 500
+
+# (kind, parcel id) -> value, the parcels without address are kept too
+_entries = TTLCache(MAX_ENTRIES, TTL)
+
+
+def _chunks(values):
+    values = list(values)
+    for i in range(0, len(values), CHUNK_SIZE):
+        yield values[i:i + CHUNK_SIZE]
+
+
+def _lookup(kind, parcel_ids, load):
+    invalidation.check('parcel-lookup', _entries.clear)
+    found = {}
+    missing = []
+    for parcel_id in dict.fromkeys(parcel_ids):
+        value = _entries.get((kind, parcel_id))
+        if value is None:
+            missing.append(parcel_id)
+        else:
+            found[parcel_id] = value
+    for chunk in _chunks(missing):
+        loaded = load(chunk)
+        for parcel_id in chunk:
+            value = loaded.get(parcel_id, ())
+            _entries.set((kind, parcel_id), value)
+            found[parcel_id] = value
+    return found
+
+
+def get_addresses(session, parcel_ids):
+    """
+    Return for each parcel the list of its addresses, formatted like the
+    results of the reverse geocoder. The parcels missing in the cache are
+    loaded with one query and their commune is found in memory.
+    """
+    def load(chunk):
+        rows = session.query(
+            Address.id_caclr_loca, Address.id_caclr_rue, Address.id_caclr_bat,
+            Address.rue, Address.numero, Address.localite,
+            Address.code_postal, Address.cle_parcelle,
+            func.ST_X(Address.geom).label("x"),
+            func.ST_Y(Address.geom).label("y")).\
+            filter(Address.cle_parcelle.in_(chunk)).all()
+        lons, lats = [], []
+        if len(rows) > 0:
+            lons, lats = transform_coordinates(
+                [row.x for row in rows], [row.y for row in rows],
+                'epsg:2169', 'epsg:4326')
+        communes = reverse_geocoder.get_commune_index()
+        loaded = {}
+        for row, lon, lat in zip(rows, lons, lats):
+            commune = communes.get_commune(row.x, row.y)
+            loaded.setdefault(row.cle_parcelle, []).append({
+                "id_caclr_locality": row.id_caclr_loca,
+                "id_caclr_street": row.id_caclr_rue,
+                "id_caclr_bat": row.id_caclr_bat,
+                "street": row.rue,
+                "number": row.numero,
+                "locality": row.localite,
+                "commune": commune.commune if commune is not None else None,
+                "postal_code": row.code_postal,
+                "country": "Luxembourg",
+                "country_code": "lu",
+                "distance": 0,
+                "contributor": "ACT",
+                "parcel_id": row.cle_parcelle,
+                "geom": {"type": "Point", "coordinates": [row.x, row.y]},
+                "geomlonlat": {"type": "Point", "coordinates": [lon, lat]}})
+        return {parcel_id: tuple(addresses)
+                for parcel_id, addresses in loaded.items()}
+
+    # The results are completed by the callers
+    return {parcel_id: [copy.deepcopy(address) for address in addresses]
+            for parcel_id, addresses in
+            _lookup('addresses', parcel_ids, load).items()}
+
+
+def get_labels(session, parcel_ids):
+    """
+    Return the label of each parcel, None for the unknown parcels.
+    """
+    def load(chunk):
+        return {id: (label,) for id, label in session.query(
+            Parcel.id, Parcel.label).filter(Parcel.id.in_(chunk))}
+
+    return {parcel_id: value[0] if len(value) > 0 else None
+            for parcel_id, value in
+            _lookup('label', parcel_ids, load).items()}
+
+
+def invalidate():
+    """
+    Called by scripts/geocode_aggregates.py, the addresses of the parcels
+    are read again from the database by every process.
+    """
+    _entries.clear()
+    invalidation.publish('parcel-lookup')
@@ -0,0 +1,121 @@
+# -*- coding: utf-8 -*-
+import threading
+
+from shapely.geometry import shape
+from shapely.ops import transform
+
+try:
+    from pyproj import Transformer
+except ImportError:
+    # pyproj 1.9, pinned below 2.0 by c2cgeoportal (upstream_requirements.txt)
+    from pyproj import Proj, transform as proj_transform
+    Transformer = None
+
+# pyproj transformers must not be shared between threads, each thread keeps
+# its own registry.
+_local = threading.local()
+
+
+class ProjTransformer(object):
+    """
+    The transformation between two Proj of pyproj 1.9, with the transform
+    method of the pyproj 2 Transformer.
+    """
+
+    def __init__(self, source, dest):
+        self.source = Proj(init=source)
+        self.dest = Proj(init=dest)
+
+    def transform(self, xs, ys):
+        return proj_transform(self.source, self.dest, xs, ys)
+
+
+def get_transformer(source, dest):
+    """
+    Return the cached transformer from the source to the destination
+    coordinate system. The coordinates are always in the x, y
+    (longitude, latitude) order like with the former pyproj.Proj(init=...).
+    """
+    transformers = getattr(_local, 'transformers', None)
+    if transformers is None:
+        transformers = _local.transformers = {}
+    key = (source.lower(), dest.lower())
+    transformer = transformers.get(key)
+    if transformer is None:
+        if Transformer is None:
+            transformer = ProjTransformer(*key)
+        else:
+            transformer = Transformer.from_crs(source, dest, always_xy=True)
+        transformers[key] = transformer
+    return transformer
+
+
+def transform_coordinates(xs, ys, source, dest):
+    """
+    Reproject sequences of x and y coordinates with a single call.
+    """
+    return get_transformer(source, dest).transform(xs, ys)
+
+
+def transform_geometry(geometry, source, dest):
+    """
+    Reproject a shapely geometry or a GeoJSON geometry, return a shapely
+    geometry.
+    """
+    return transform(get_transformer(source, dest).transform, shape(geometry))
+
+
+def transform_geojson(geometries, source, dest):
+    """
+    Reproject a list of GeoJSON geometries. The coordinates of all the
+    geometries are reprojected together, return the new GeoJSON geometries
+    in the same order, None geometries are kept.
+    """
+    positions = []
+    for geometry in geometries:
+        if geometry is not None:
+            _collect_positions(geometry, positions)
+    projected = iter(())
+    if len(positions) > 0:
+        xs, ys = transform_coordinates(
+            [position[0] for position in positions],
+            [position[1] for position in positions], source, dest)
+        projected = iter(zip(xs, ys))
+    return [_rebuild(geometry, projected) for geometry in geometries]
+
+
+def _collect_positions(geometry, positions):
+    if geometry['type'] == 'GeometryCollection':
+        for child in geometry['geometries']:
+            _collect_positions(child, positions)
+    else:
+        _collect_coordinates(geometry['coordinates'], positions)
+
+
+def _collect_coordinates(coordinates, positions):
+    if len(coordinates) > 0 and isinstance(coordinates[0], (int, float)):
+        positions.append(coordinates)
+    else:
+        for child in coordinates:
+            _collect_coordinates(child, positions)
+
+
+def _rebuild(geometry, projected):
+    if geometry is None:
+        return None
+    if geometry['type'] == 'GeometryCollection':
+        return {'type': 'GeometryCollection',
+                'geometries': [_rebuild(child, projected)
+                               for child in geometry['geometries']]}
+    return {'type': geometry['type'],
+            'coordinates': _rebuild_coordinates(
+                geometry['coordinates'], projected)}
+
+
+def _rebuild_coordinates(coordinates, projected):
+    if len(coordinates) > 0 and isinstance(coordinates[0], (int, float)):
+        x, y = next(projected)
+        # Keep the z and m values untouched
+        return [x, y] + list(coordinates[2:])
+    return [_rebuild_coordinates(child, projected) for child in coordinates]
+
@@ -0,0 +1,232 @@
+# -*- coding: utf-8 -*-
+import logging
+import math
+import os
+from collections import namedtuple
+
+from geoalchemy2 import func
+from shapely import wkb
+from shapely.geometry import Point
+from shapely.prepared import prep
+
+from c2cgeoportal_commons.models import DBSessions
+from c2cgeoportal_geoportal.lib.caching import get_region
+from geoportailv3_geoportal.geocode import Address, CommunesLimAdm
+from geoportailv3_geoportal.lib import invalidation
+from geoportailv3_geoportal.lib.projections import transform_coordinates
+
+log = logging.getLogger(__name__)
+cache_region = get_region("obj")
+
+# Time in seconds before the index is loaded again from the database
+INDEX_EXPIRATION = int(os.environ.get('REVERSE_GEOCODE_INDEX_TTL', '3600'))
+# Size in meters of the cells of the grids of the address points and of the
+# communes
+ADDRESS_CELL_SIZE = 200
+COMMUNE_CELL_SIZE = 2000
+
+AddressPoint = namedtuple('AddressPoint', [
+    'id_caclr_loca', 'id_caclr_rue', 'id_caclr_bat', 'rue', 'numero',
+    'localite', 'code_postal', 'x', 'y', 'lon', 'lat'])
+Commune = namedtuple('Commune', ['id', 'commune', 'canton', 'district'])
+
+
+def _cell(x, y, size):
+    return int(math.floor(x / size)), int(math.floor(y / size))
+
+
+class CommuneIndex(object):
+    """
+    In memory copy of the communes, used to find the commune of a point
+    without querying the database. The communes are prepared polygons
+    bucketed by their bounds.
+    """
+
+    def __init__(self):
+        self.communes = []
+        self.commune_cells = {}
+
+    def load(self, session):
+        for id, commune, canton, district, geom in session.query(
+                CommunesLimAdm.id, CommunesLimAdm.commune,
+                CommunesLimAdm.canton, CommunesLimAdm.district,
+                func.ST_AsBinary(CommunesLimAdm.geom)):
+            if geom is None:
+                continue
+            self.add_commune(
+                Commune(id, commune, canton, district),
+                wkb.loads(bytes(geom)))
+        log.info("Loaded %d communes", len(self.communes))
+
+    def add_commune(self, commune, geom):
+        entry = (commune, prep(geom))
+        self.communes.append(entry)
+        minx, miny, maxx, maxy = geom.bounds
+        min_col, min_row = _cell(minx, miny, COMMUNE_CELL_SIZE)
+        max_col, max_row = _cell(maxx, maxy, COMMUNE_CELL_SIZE)
+        for col in range(min_col, max_col + 1):
+            for row in range(min_row, max_row + 1):
+                self.commune_cells.setdefault((col, row), []).append(entry)
+
+    def get_commune(self, x, y):
+        """
+        Return the Commune containing the point, or None outside of the
+        country.
+        """
+        candidates = self.commune_cells.get(_cell(x, y, COMMUNE_CELL_SIZE))
+        if candidates is None:
+            return None
+        point = Point(x, y)
+        for commune, geom in candidates:
+            if geom.contains(point):
+                return commune
+        return None
+
+
+class ReverseGeocoder(object):
+    """
+    In memory copy of the address points, used to find the nearest address
+    of a point without querying the database.
+    The address points are bucketed in a regular grid searched ring by ring
+    around the point, the communes are found in the given CommuneIndex.
+    """
+
+    def __init__(self, commune_index=None):
+        self.addresses = []
+        self.address_cells = {}
+        self.commune_index = commune_index if commune_index is not None \
+            else CommuneIndex()
+        self.bounds = None
+
+    def load(self, session):
+        rows = session.query(
+            Address.id_caclr_loca, Address.id_caclr_rue, Address.id_caclr_bat,
+            Address.rue, Address.numero, Address.localite,
+            Address.code_postal,
+            func.ST_X(Address.geom).label("x"),
+            func.ST_Y(Address.geom).label("y")).\
+            filter(Address.geom.isnot(None)).all()
+        if len(rows) > 0:
+            lons, lats = transform_coordinates(
+                [row.x for row in rows], [row.y for row in rows],
+                'epsg:2169', 'epsg:4326')
+        else:
+            lons, lats = [], []
+        for row, lon, lat in zip(rows, lons, lats):
+            self.add_address(AddressPoint(*(tuple(row) + (lon, lat))))
+        log.info("Loaded %d address points for the reverse geocoder",
+                 len(self.addresses))
+
+    def add_address(self, address):
+        self.addresses.append(address)
+        self.address_cells.setdefault(
+            _cell(address.x, address.y, ADDRESS_CELL_SIZE), []).append(address)
+        if self.bounds is None:
+            self.bounds = [address.x, address.y, address.x, address.y]
+        else:
+            self.bounds = [
+                min(self.bounds[0], address.x), min(self.bounds[1], address.y),
+                max(self.bounds[2], address.x), max(self.bounds[3], address.y)]
+
+    def get_commune(self, x, y):
+        return self.commune_index.get_commune(x, y)
+
+    def _max_ring(self, col, row):
+        # Number of rings after which all the cells of the grid were seen
+        if self.bounds is None:
+            return -1
+        min_col, min_row = _cell(
+            self.bounds[0], self.bounds[1], ADDRESS_CELL_SIZE)
+        max_col, max_row = _cell(
+            self.bounds[2], self.bounds[3], ADDRESS_CELL_SIZE)
+        return max(col - min_col, max_col - col, row - min_row, max_row - row)
+
+    def _ring(self, col, row, ring):
+        if ring == 0:
+            yield col, row
+            return
+        for c in range(col - ring, col + ring + 1):
+            yield c, row - ring
+            yield c, row + ring
+        for r in range(row - ring + 1, row + ring):
+            yield col - ring, r
+            yield col + ring, r
+
+    def get_nearest(self, x, y):
+        """
+        Return the nearest AddressPoint and its distance, or (None, None)
+        without address points. On equal distances the first loaded address
+        wins.
+        """
+        col, row = _cell(x, y, ADDRESS_CELL_SIZE)
+        best = None
+        best_distance = None
+        max_ring = self._max_ring(col, row)
+        ring = 0
+        while ring <= max_ring:
+            for cell in self._ring(col, row, ring):
+                for address in self.address_cells.get(cell, ()):
+                    distance = math.hypot(address.x - x, address.y - y)
+                    if best is None or distance < best_distance:
+                        best = address
+                        best_distance = distance
+            # The cells of the next rings are at least ring * cell size away
+            if best is not None and best_distance <= ring * ADDRESS_CELL_SIZE:
+                break
+            ring += 1
+        return best, best_distance
+
+    def reverse(self, x, y):
+        """
+        Return the nearest AddressPoint of a point in the country with its
+        distance and the Commune of the address, or None if the point is
+        outside of the country.
+        """
+        if self.get_commune(x, y) is None:
+            return None
+        address, distance = self.get_nearest(x, y)
+        if address is None:
+            return None
+        return address, distance, self.get_commune(address.x, address.y)
+
+    def reverse_many(self, points):
+        """
+        Return the result of reverse for each (x, y) point.
+        """
+        return [self.reverse(x, y) for x, y in points]
+
+
+@cache_region.cache_on_arguments(expiration_time=INDEX_EXPIRATION)
+def _load_commune_index():
+    commune_index = CommuneIndex()
+    commune_index.load(DBSessions['ecadastre'])
+    return commune_index
+
+
+def get_commune_index():
+    """
+    Return the communes without the address points, used by the lookups
+    that only need the commune of a point.
+    """
+    return _load_commune_index()
+
+
+@cache_region.cache_on_arguments(expiration_time=INDEX_EXPIRATION)
+def _load_reverse_geocoder():
+    geocoder = ReverseGeocoder(get_commune_index())
+    geocoder.load(DBSessions['ecadastre'])
+    return geocoder
+
+
+def get_reverse_geocoder():
+    invalidation.check('reverse-geocoder', _load_reverse_geocoder.invalidate)
+    return _load_reverse_geocoder()
+
+
+def invalidate():
+    """
+    Called by scripts/geocode_aggregates.py after an update of the address
+    points, the grid of the points is built again in every process.
+    """
+    _load_reverse_geocoder.invalidate()
+    invalidation.publish('reverse-geocoder')
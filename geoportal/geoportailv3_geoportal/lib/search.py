@@ -1,18 +1,50 @@
 from elasticsearch import Elasticsearch
 import json
 import os
+import threading
 
 SETTINGS_FILE = os.path.join(os.path.dirname(__file__), 'index_settings.json')
 
+# Number of kept alive connections per Elasticsearch node
+POOL_MAXSIZE = int(os.environ.get('ELASTIC_POOL_MAXSIZE', '10'))
+# Default timeout in seconds, and timeout of the searches of the views
+TIMEOUT = float(os.environ.get('ELASTIC_TIMEOUT', '60'))
+SEARCH_TIMEOUT = float(os.environ.get('ELASTIC_SEARCH_TIMEOUT', '10'))
+# Number of retries on another node on a connection error or a timeout
+MAX_RETRIES = int(os.environ.get('ELASTIC_MAX_RETRIES', '2'))
+RETRY_ON_TIMEOUT = os.environ.get('ELASTIC_RETRY_ON_TIMEOUT', '0') == '1'
+# Discover the nodes of the cluster from the configured ones
+SNIFF = os.environ.get('ELASTIC_SNIFF', '0') == '1'
+
 with open(SETTINGS_FILE) as json_file:
     settings = json.load(json_file)
 
+_lock = threading.Lock()
+_client = None
+_pid = None
+
+
 def get_host():
     return os.environ['ELASTIC_SERVERS'] if 'ELASTIC_SERVERS' in os.environ else 'localhost:9200'
 
 
 def get_elasticsearch(request):
-    return Elasticsearch(hosts=get_host(), timeout=60)
+    """
+    Return the Elasticsearch client shared by the process, its connections
+    are kept alive between the requests. The client is created again after
+    a fork so the gunicorn workers never share their sockets.
+    """
+    global _client, _pid
+    if _client is None or _pid != os.getpid():
+        with _lock:
+            if _client is None or _pid != os.getpid():
+                _client = Elasticsearch(
+                    hosts=get_host(), timeout=TIMEOUT, maxsize=POOL_MAXSIZE,
+                    max_retries=MAX_RETRIES, retry_on_timeout=RETRY_ON_TIMEOUT,
+                    sniff_on_start=SNIFF, sniff_on_connection_fail=SNIFF,
+                    sniffer_timeout=60 if SNIFF else None)
+                _pid = os.getpid()
+    return _client
 
 
 def get_index(request):
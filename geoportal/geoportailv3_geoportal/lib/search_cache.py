@@ -0,0 +1,83 @@
+# -*- coding: utf-8 -*-
+import copy
+import os
+
+from geoportailv3_geoportal.lib import invalidation
+from geoportailv3_geoportal.lib.ttl_cache import TTLCache
+
+# Maximum number of search results kept by each process, the least recently
+# used are dropped first
+MAX_ENTRIES = int(os.environ.get('SEARCH_CACHE_MAX_ENTRIES', '5000'))
+# Time in seconds during which the results of a search are kept
+TTL = int(os.environ.get('SEARCH_CACHE_TTL', '300'))
+# Time in seconds between two checks that an index was not replaced
+CHECK_DELAY = int(os.environ.get('SEARCH_CACHE_CHECK_DELAY', '30'))
+# Number of decimals of the extents in the keys
+EXTENT_PRECISION = 5
+
+# The first item of the keys is the index
+_entries = TTLCache(MAX_ENTRIES, TTL)
+
+
+def normalize_query(query):
+    return ' '.join(query.lower().split())
+
+
+def extent_bucket(extent):
+    """
+    Return the extent rounded to be used in a key, the searches in almost
+    the same extent share their results.
+    """
+    if not extent:
+        return None
+    try:
+        return tuple(round(float(c), EXTENT_PRECISION)
+                     for c in extent.split(','))
+    except ValueError:
+        return extent
+
+
+def _get_generation(es, index):
+    # The concrete indexes behind the name, an alias swap or a recreated
+    # index give a new generation
+    result = es.indices.get_settings(index=index, name='index.creation_date')
+    return tuple(sorted(
+        (name, value['settings']['index']['creation_date'])
+        for name, value in result.items()))
+
+
+def check_index(es, index):
+    """
+    Drop the cached results of the index if it was replaced since the last
+    check, the check is done at most every CHECK_DELAY seconds.
+    """
+    invalidation.check(
+        ('search', index), lambda: invalidate(index),
+        lambda: _get_generation(es, index), CHECK_DELAY)
+
+
+def get(es, key):
+    """
+    Return a copy of the cached results, or None if they are missing or
+    expired. The first item of the key is the searched index.
+    """
+    check_index(es, key[0])
+    results = _entries.get(key)
+    if results is None:
+        return None
+    return copy.deepcopy(results)
+
+
+def set(key, results):
+    _entries.set(key, copy.deepcopy(results))
+
+
+def invalidate(index=None):
+    """
+    Drop the cached results of an index, or of all the indexes, in this
+    process.
+    """
+    if index is None:
+        _entries.clear()
+    else:
+        _entries.discard(lambda key: key[0] == index)
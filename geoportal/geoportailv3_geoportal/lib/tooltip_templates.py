@@ -0,0 +1,99 @@
+# -*- coding: utf-8 -*-
+import logging
+import os
+import threading
+from functools import lru_cache
+from os.path import isfile
+from time import monotonic
+
+from mako.template import Template
+from pkg_resources import resource_filename
+
+from geoportailv3_geoportal.lib import http_client
+
+log = logging.getLogger(__name__)
+
+# Time in seconds during which a remote template is used without asking the
+# remote server if it changed
+REVALIDATE_DELAY = int(os.environ.get('GFI_TEMPLATE_REVALIDATE', '300'))
+TIMEOUT = 15
+
+
+@lru_cache(maxsize=None)
+def has_template(path):
+    """
+    Return True if the tooltip template exists in the package.
+    """
+    return isfile(resource_filename('geoportailv3_geoportal', path))
+
+
+class RemoteTemplate(object):
+
+    def __init__(self, url):
+        self.url = url
+        self.data = None
+        self.etag = None
+        self.last_modified = None
+        self.checked = None
+        self._template = None
+        self._lock = threading.Lock()
+
+    @property
+    def template(self):
+        # Compiled once for each version of the data, on first use
+        data = self.data
+        compiled = self._template
+        if compiled is None or compiled[0] is not data:
+            compiled = self._template = (data, Template(data.decode('utf-8')))
+        return compiled[1]
+
+    def is_fresh(self):
+        return self.checked is not None and \
+            monotonic() - self.checked < REVALIDATE_DELAY
+
+    def refresh(self):
+        """
+        Fetch the template, or only check that it did not change if it was
+        already fetched. If the remote server is unreachable the last
+        fetched version is kept.
+        """
+        with self._lock:
+            if self.is_fresh():
+                return
+            headers = {}
+            if self.etag is not None:
+                headers['If-None-Match'] = self.etag
+            if self.last_modified is not None:
+                headers['If-Modified-Since'] = self.last_modified
+            try:
+                response = http_client.request(
+                    'GET', self.url, headers=headers, timeout=TIMEOUT)
+            except Exception:
+                if self.data is None:
+                    raise
+                log.exception("Unable to revalidate the template %s", self.url)
+                self.checked = monotonic()
+                return
+            if response.status_code != 304:
+                self.data = response.content
+                self.etag = response.headers.get('ETag')
+                self.last_modified = response.headers.get('Last-Modified')
+            self.checked = monotonic()
+
+
+_lock = threading.Lock()
+_remote_templates = {}
+
+
+def get_remote_template(url):
+    """
+    Return the up to date RemoteTemplate of the url, its data are the raw
+    template and its template the compiled one.
+    """
+    with _lock:
+        remote_template = _remote_templates.get(url)
+        if remote_template is None:
+            remote_template = _remote_templates[url] = RemoteTemplate(url)
+    if not remote_template.is_fresh():
+        remote_template.refresh()
+    return remote_template
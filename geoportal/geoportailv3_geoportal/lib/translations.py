@@ -0,0 +1,46 @@
+# -*- coding: utf-8 -*-
+import os
+import threading
+from functools import lru_cache
+
+from pyramid.i18n import TranslationStringFactory, make_localizer
+from pyramid.interfaces import ITranslationDirectories
+from pyramid.threadlocal import get_current_registry
+
+# Domain of the names of the themes, groups and layers
+CLIENT_DOMAIN = 'geoportailv3_geoportal-client'
+# Maximum number of translated strings kept by each process
+CACHE_SIZE = int(os.environ.get('TRANSLATION_CACHE_SIZE', '50000'))
+
+_lock = threading.Lock()
+# (lang, translation directories) -> localizer
+_localizers = {}
+
+
+def get_translation_dirs(registry=None):
+    if registry is None:
+        registry = get_current_registry()
+    return tuple(registry.queryUtility(ITranslationDirectories, default=[]))
+
+
+def get_localizer(lang, tdirs):
+    """
+    Return the localizer of a language, the catalogs are read only once by
+    process and language.
+    """
+    key = (lang, tuple(tdirs))
+    with _lock:
+        localizer = _localizers.get(key)
+        if localizer is None:
+            localizer = _localizers[key] = make_localizer(lang, list(tdirs))
+    return localizer
+
+
+@lru_cache(maxsize=CACHE_SIZE)
+def translate(msgid, lang, tdirs, domain=CLIENT_DOMAIN):
+    """
+    Return the translation of a string, tdirs is the tuple of translation
+    directories given by get_translation_dirs.
+    """
+    return get_localizer(lang, tdirs).translate(
+        TranslationStringFactory(domain)(msgid))
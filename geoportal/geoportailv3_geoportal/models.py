@@ -252,6 +252,13 @@ class LuxGetfeatureDefinition(Base):
                            'individual zooms (ex : 10;11;13)'
         }
     })
+    cache_ttl = Column(Integer, info={
+        'colanderalchemy': {
+            'title': _('Cache duration'),
+            'description': 'Number of seconds the results of a click are kept in memory and served again '
+                           'for the clicks at the same place. Empty or 0 disables the cache.'
+        }
+    })
 
 class LuxPrintJob(Base):
     __tablename__ = 'lux_print_job'
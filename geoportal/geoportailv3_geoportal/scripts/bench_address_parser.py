@@ -0,0 +1,85 @@
+# -*- coding: utf-8 -*-
+"""
+Micro-benchmark of the parsing of the addresses given to the geocoder.
+The corpus is a file with one address per line, by default a few sample
+addresses. Each address is also cut in growing prefixes like the ones sent
+while typing, the parsing is timed without and with the memoized results.
+"""
+
+import argparse
+import sys
+import timeit
+
+from geoportailv3_geoportal.lib import address_parser
+
+SAMPLES = [
+    u"54 Avenue gaston diderich 1420 luxembourg",
+    u"Avenue gaston diderich 54 , 1420 luxembourg",
+    u"14 Allée de la Jeunesse Sacrifiée 1940-1945 5863 Alzinghen",
+    u"2A Rue du 9 mai 1944 2112 Howald",
+    u"7-9 bd Royal L-2449 Luxembourg",
+    u"r. de l'Eglise 3 Esch sur Alzette",
+    u"12b rte d'Arlon (Strassen) 8009",
+]
+
+
+def statuslog(text):
+    sys.stdout.write(text)
+    sys.stdout.flush()
+
+
+def load_corpus(path):
+    if path is None:
+        addresses = SAMPLES
+    else:
+        with open(path, encoding='utf-8') as corpus:
+            addresses = [line.strip() for line in corpus if line.strip()]
+    prefixes = []
+    for address in addresses:
+        prefixes.extend(address[:i] for i in range(3, len(address) + 1))
+    return prefixes
+
+
+def clear_caches():
+    address_parser.parse_address.cache_clear()
+    address_parser.replace_words.cache_clear()
+    address_parser.strip_accents.cache_clear()
+
+
+def parse_all(corpus):
+    for address in corpus:
+        parsed = address_parser.parse_address(address)
+        if parsed.street is not None:
+            address_parser.replace_words(
+                address_parser.strip_accents(parsed.street))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument(
+        'corpus', nargs='?',
+        help='A file with one address per line')
+    parser.add_argument(
+        '--repeat', type=int, default=5,
+        help='Number of runs, the best one is reported')
+    options = parser.parse_args()
+
+    corpus = load_corpus(options.corpus)
+    statuslog("%d addresses and prefixes\n" % len(corpus))
+
+    def cold():
+        clear_caches()
+        parse_all(corpus)
+
+    def warm():
+        parse_all(corpus)
+
+    for name, function in (('cold', cold), ('warm', warm)):
+        best = min(timeit.repeat(function, number=1, repeat=options.repeat))
+        statuslog("%s: %.1f us by address\n" % (
+            name, best * 1e6 / max(len(corpus), 1)))
+    statuslog("cache: %s\n" % (address_parser.parse_address.cache_info(),))
+
+
+if __name__ == '__main__':
+    main()
@@ -3,30 +3,59 @@
 from pyramid.paster import bootstrap
 import psycopg2
 from psycopg2.extras import DictCursor
+import os
+import re
 import sys
 import getopt
+import hashlib
 import json
+import time
 from elasticsearch import helpers
-from elasticsearch.helpers import BulkIndexError
-from elasticsearch.exceptions import ConnectionTimeout
 from geoportailv3_geoportal.lib.search import get_elasticsearch, get_index, \
     ensure_index
 
 """
 Utility functions for importing data into Elasticsearch from database
+
+The documents are loaded in a new index named after the index of the
+application and the date, while the current one is still searched. At the
+end the alias of the application index is moved to the new index and the
+older indexes are deleted.
+
+With --delta only the documents whose hash changed are written in the
+current index, and the documents of the removed rows are deleted. With
+--verify the hashes are computed again from the indexed documents instead
+of being read, to also find and repair the documents changed by others.
 """
 
+# Number of rows read from the database at once
+BATCH_SIZE = 1000
+# Number of parallel bulk requests, and of chunks waiting to be sent
+WORKERS = 4
+QUEUE_SIZE = 8
+# Number of previous indexes kept after the swap, to go back quickly
+KEEP = 1
+BULK_TIMEOUT = 120
+# Settings of the new index while loading, no refresh and no replica
+LOAD_SETTINGS = {'refresh_interval': '-1', 'number_of_replicas': 0}
+_MISSING = object()
+
 
-def get_cursor():
+def get_connection():
     source_conf = {
-        'database': 'search',
-        'user': 'postgres',
-        'password': '',
-        'host': 'luigi11',
-        'port': '5432'
+        'database': os.environ.get('SEARCH_DB_NAME', 'search'),
+        'user': os.environ.get('SEARCH_DB_USER', 'postgres'),
+        'password': os.environ.get('SEARCH_DB_PASSWORD', ''),
+        'host': os.environ.get('SEARCH_DB_HOST', 'luigi11'),
+        'port': os.environ.get('SEARCH_DB_PORT', '5432')
     }
-    conn = psycopg2.connect(**source_conf)
-    cursor = conn.cursor(cursor_factory=DictCursor)
+    return psycopg2.connect(**source_conf)
+
+
+def get_cursor(connection, batch_size=BATCH_SIZE):
+    # A named cursor is read on the server side, batch by batch
+    cursor = connection.cursor(name='db2es', cursor_factory=DictCursor)
+    cursor.itersize = batch_size
     query = "Select *, ST_AsGeoJSON(ST_Transform(\"searchLayer\".geom,4326)) as geom_4326 \
             from public.\"searchLayer\" ;"
     cursor.execute(query)
@@ -48,24 +77,229 @@ def update_document(index, type, obj_id, obj=None):
     doc['_source']['label'] = obj['label']
     doc['_source']['role_id'] = 1
     doc['_source']['public'] = True
+    doc['_source']['hash'] = document_hash(doc['_source'])
     return doc
 
 
+def document_hash(source):
+    """
+    Return the hash of the content of a document, without its hash.
+    """
+    content = {key: value for key, value in source.items() if key != 'hash'}
+    return hashlib.sha1(json.dumps(
+        content, sort_keys=True, separators=(',', ':')).encode('utf-8')).\
+        hexdigest()
+
+
 def statuslog(text):
     sys.stdout.write(text)
     sys.stdout.flush()
 
 
+def iter_documents(cursor, index_name):
+    for result in cursor:
+        yield update_document(index_name, 'poi', result['id'], result)
+
+
+def bulk_index(es, actions, workers=WORKERS, batch_size=BATCH_SIZE,
+               queue_size=QUEUE_SIZE):
+    """
+    Send the documents with parallel bulk requests. The documents are read
+    only when a worker can take them, at most queue_size chunks wait to be
+    sent. Return the number of indexed documents and the errors.
+    """
+    indexed = 0
+    errors = []
+    start = time.time()
+    for ok, info in helpers.parallel_bulk(
+            es, actions, thread_count=workers, chunk_size=batch_size,
+            queue_size=queue_size, raise_on_error=False,
+            raise_on_exception=False, request_timeout=BULK_TIMEOUT):
+        if ok:
+            indexed += 1
+        else:
+            errors.append(info)
+        if (indexed + len(errors)) % batch_size == 0:
+            statuslog("\rIndexed Elements: %i (%.0f docs/s)" % (
+                indexed, indexed / max(time.time() - start, 0.001)))
+    duration = max(time.time() - start, 0.001)
+    statuslog("\rIndexed Elements: %i in %.1f s (%.0f docs/s), %i errors\n" % (
+        indexed, duration, indexed / duration, len(errors)))
+    return indexed, errors
+
+
+def prepare_for_load(es, index_name):
+    """
+    Disable the refresh and the replicas while loading, return the settings
+    of the index to give to restore_after_load. The settings which are not
+    set on the index are None, restoring them gives back the default.
+    """
+    result = es.indices.get_settings(
+        index=index_name, name=['index.' + name for name in LOAD_SETTINGS])
+    settings = result.get(index_name, {}).get('settings', {}).get('index', {})
+    previous = {name: settings.get(name) for name in LOAD_SETTINGS}
+    es.indices.put_settings(index=index_name, body={'index': LOAD_SETTINGS})
+    return previous
+
+
+def restore_after_load(es, index_name, previous):
+    es.indices.put_settings(index=index_name, body={'index': previous})
+    es.indices.refresh(index=index_name)
+
+
+def get_old_indexes(es, alias, new_index):
+    # The dated indexes of the alias, the most recent first
+    pattern = re.compile(re.escape(alias) + r'_\d{8,14}$')
+    return sorted(
+        [name for name in es.indices.get(index=alias + '_*')
+         if pattern.match(name) and name != new_index],
+        reverse=True)
+
+
+def swap_alias(es, alias, new_index, keep=KEEP):
+    """
+    Move the alias to the new index in one atomic operation, then delete
+    the older indexes except the keep most recent ones.
+    """
+    actions = [{'add': {'index': new_index, 'alias': alias}}]
+    if es.indices.exists_alias(name=alias):
+        for name in es.indices.get_alias(name=alias):
+            actions.insert(0, {'remove': {'index': name, 'alias': alias}})
+    elif es.indices.exists(index=alias):
+        # A former index has the name of the alias, it is replaced by the
+        # alias
+        statuslog("\rDeleting the index %s to replace it by an alias\n" % alias)
+        actions.insert(0, {'remove_index': {'index': alias}})
+    es.indices.update_aliases(body={'actions': actions})
+    statuslog("\rThe alias %s now points to %s\n" % (alias, new_index))
+
+    for name in get_old_indexes(es, alias, new_index)[keep:]:
+        statuslog("\rDeleting the old index %s\n" % name)
+        es.indices.delete(index=name)
+
+
+def get_live_index(es, alias):
+    if es.indices.exists_alias(name=alias):
+        names = list(es.indices.get_alias(name=alias))
+        if len(names) != 1:
+            raise Exception(
+                "The alias %s points to %d indexes" % (alias, len(names)))
+        return names[0]
+    return alias
+
+
+def get_live_hashes(es, index_name, verify=False, batch_size=BATCH_SIZE):
+    """
+    Return the hash of each indexed document, read from the document or
+    computed again from its content to verify it.
+    """
+    hashes = {}
+    for hit in helpers.scan(
+            es, index=index_name, size=batch_size,
+            query={'query': {'match_all': {}}},
+            _source=True if verify else ['hash']):
+        source = hit.get('_source', {})
+        hashes[hit['_id']] = document_hash(source) if verify \
+            else source.get('hash')
+    return hashes
+
+
+def iter_delta(cursor, index_name, live_hashes, stats):
+    """
+    Yield the index actions of the new and changed rows, then the delete
+    actions of the documents without row.
+    """
+    for result in cursor:
+        doc = update_document(index_name, 'poi', result['id'], result)
+        live_hash = live_hashes.pop(str(doc['_id']), _MISSING)
+        if live_hash is _MISSING:
+            stats['created'] += 1
+        elif live_hash != doc['_source']['hash']:
+            stats['updated'] += 1
+        else:
+            stats['unchanged'] += 1
+            continue
+        yield doc
+    for doc_id in list(live_hashes):
+        stats['deleted'] += 1
+        yield {'_op_type': 'delete', '_index': index_name, '_type': 'poi',
+               '_id': doc_id}
+
+
+def apply_delta(es, alias, verify=False, workers=WORKERS,
+                batch_size=BATCH_SIZE, queue_size=QUEUE_SIZE, **kwargs):
+    """
+    Write in the current index only the documents which changed since the
+    last indexing, and delete the ones of the removed rows.
+    """
+    index_name = get_live_index(es, alias)
+    statuslog("\rReading the hashes of %s " % index_name)
+    live_hashes = get_live_hashes(es, index_name, verify, batch_size)
+    stats = {'created': 0, 'updated': 0, 'deleted': 0, 'unchanged': 0}
+
+    statuslog("\rCreating Database Query ")
+    connection = get_connection()
+    try:
+        cursor = get_cursor(connection, batch_size)
+        indexed, errors = bulk_index(
+            es, iter_delta(cursor, index_name, live_hashes, stats), workers,
+            batch_size, queue_size)
+        cursor.close()
+    finally:
+        connection.close()
+    es.indices.refresh(index=index_name)
+
+    statuslog("\r%(created)i created, %(updated)i updated, %(deleted)i "
+              "deleted, %(unchanged)i unchanged documents\n" % stats)
+    for error in errors[:10]:
+        statuslog("\n {}".format(error))
+    return len(errors) == 0
+
+
+def reindex(es, alias, reset=False, workers=WORKERS, batch_size=BATCH_SIZE,
+            queue_size=QUEUE_SIZE, keep=KEEP):
+    index_name = alias + '_' + time.strftime("%Y%m%d%H%M%S")
+    ensure_index(es, index_name, reset)
+    previous_settings = prepare_for_load(es, index_name)
+
+    statuslog("\rCreating Database Query ")
+    connection = get_connection()
+    try:
+        cursor = get_cursor(connection, batch_size)
+        indexed, errors = bulk_index(
+            es, iter_documents(cursor, index_name), workers, batch_size,
+            queue_size)
+        cursor.close()
+    finally:
+        connection.close()
+
+    restore_after_load(es, index_name, previous_settings)
+    if len(errors) > 0:
+        for error in errors[:10]:
+            statuslog("\n {}".format(error))
+        statuslog("\nThe alias %s is kept on the previous index, %s is "
+                  "incomplete\n" % (alias, index_name))
+        return False
+    swap_alias(es, alias, index_name, keep)
+    return True
+
+
 def main():
     env = bootstrap('development.ini')
     request = env['request']
     try:
-        opts, args = getopt.getopt(sys.argv[1:], 'ri', ['reset', 'index'])
+        opts, args = getopt.getopt(
+            sys.argv[1:], 'ri',
+            ['reset', 'index', 'delta', 'verify', 'workers=', 'batch-size=',
+             'queue-size=', 'keep='])
     except getopt.GetoptError as err:
         print(str(err))
         sys.exit(2)
     index = False
     reset = False
+    delta = False
+    verify = False
+    options = {}
     for o, a in opts:
         if o in ('-r', '--reset'):
             statuslog('\rResetting Index')
@@ -73,37 +307,21 @@ def main():
         if o in ('-i', '--index'):
             statuslog('\rChecking Index')
             index = True
+        if o == '--delta':
+            delta = True
+        if o == '--verify':
+            verify = True
+        if o in ('--workers', '--batch-size', '--queue-size', '--keep'):
+            options[o[2:].replace('-', '_')] = int(a)
 
-    import time
-    index_name = get_index(request) + '_' + time.strftime("%Y%m%d")
-    ensure_index(get_elasticsearch(request), index_name, reset)
-
-    if index is True:
-        statuslog("\rCreating Database Query ")
-        c = get_cursor()
-        counter = 1
-        while True:
-            multiple = 250
-            results = c.fetchmany(multiple)
-            doc_list = []
-            for result in results:
-                doc = update_document(get_index(request),
-                                      'poi',
-                                      result['id'],
-                                      result)
-                doc_list.append(doc)
-                statuslog("\rIndexed Elements: %i" % int(counter))
-                counter = counter + 1
-            try:
-                helpers.bulk(client=get_elasticsearch(request),
-                             actions=doc_list,
-                             chunk_size=multiple,
-                             raise_on_error=True)
-            except (BulkIndexError, ConnectionTimeout) as e:
-                print("\n {}".format(e))
-            if not results:
-                statuslog("\n")
-                break
+    if delta or verify:
+        if not apply_delta(get_elasticsearch(request), get_index(request),
+                           verify, **options):
+            sys.exit(1)
+    elif index is True:
+        if not reindex(get_elasticsearch(request), get_index(request), reset,
+                       **options):
+            sys.exit(1)
 
 
 if __name__ == '__main__':
@@ -0,0 +1,181 @@
+# -*- coding: utf-8 -*-
+"""
+Build the aggregates of the address points used by the geocoder: the
+centroids and extents of the localities, of the localities by post code and
+of the streets, with their range of house numbers, and the indexed house
+numbers of the address points.
+Without localities all the aggregates are built again, otherwise only the
+ones of the given localities.
+"""
+
+import argparse
+import sys
+
+from pyramid.paster import bootstrap
+from sqlalchemy.sql import text
+
+CREATE = """
+CREATE TABLE IF NOT EXISTS geocoding.locality_aggregate (
+    id serial PRIMARY KEY,
+    localite varchar,
+    geom geometry(Geometry, 2169),
+    extent geometry(Geometry, 2169),
+    address_count integer
+);
+CREATE INDEX IF NOT EXISTS locality_aggregate_localite_idx
+    ON geocoding.locality_aggregate (lower(localite));
+
+CREATE TABLE IF NOT EXISTS geocoding.zip_aggregate (
+    id serial PRIMARY KEY,
+    code_postal varchar,
+    localite varchar,
+    geom geometry(Geometry, 2169),
+    extent geometry(Geometry, 2169),
+    address_count integer
+);
+CREATE INDEX IF NOT EXISTS zip_aggregate_code_postal_idx
+    ON geocoding.zip_aggregate (lower(code_postal));
+
+CREATE TABLE IF NOT EXISTS geocoding.street_aggregate (
+    id serial PRIMARY KEY,
+    id_caclr_loca varchar,
+    id_caclr_rue varchar,
+    rue varchar,
+    code_postal varchar,
+    localite varchar,
+    geom geometry(Geometry, 2169),
+    extent geometry(Geometry, 2169),
+    num_min integer,
+    num_max integer,
+    address_count integer
+);
+CREATE INDEX IF NOT EXISTS street_aggregate_localite_idx
+    ON geocoding.street_aggregate (lower(localite));
+CREATE INDEX IF NOT EXISTS street_aggregate_code_postal_idx
+    ON geocoding.street_aggregate (code_postal);
+
+-- One row by part of the house number of an address point: 12-14 gives the
+-- parts 12 and 14, both with the range 12 to 14, the gid has the type of
+-- the gid of the address points
+CREATE TABLE IF NOT EXISTS geocoding.address_house_number (
+    id serial PRIMARY KEY,
+    gid varchar,
+    code_postal integer,
+    localite varchar,
+    numero varchar,
+    numero_part varchar,
+    num_from integer,
+    num_to integer,
+    suffix varchar
+);
+CREATE INDEX IF NOT EXISTS address_house_number_part_idx
+    ON geocoding.address_house_number (numero_part, code_postal);
+CREATE INDEX IF NOT EXISTS address_house_number_numero_idx
+    ON geocoding.address_house_number (code_postal, numero);
+CREATE INDEX IF NOT EXISTS address_house_number_localite_idx
+    ON geocoding.address_house_number (localite, numero_part);
+CREATE INDEX IF NOT EXISTS address_house_number_range_idx
+    ON geocoding.address_house_number (code_postal, num_from, num_to);
+-- The tables built before had an integer gid
+ALTER TABLE geocoding.address_house_number
+    ALTER COLUMN gid TYPE varchar USING gid::varchar;
+"""
+
+# The filter is replaced by the condition on the localities to refresh
+FILL = """
+DELETE FROM geocoding.locality_aggregate WHERE {filter};
+INSERT INTO geocoding.locality_aggregate
+    (localite, geom, extent, address_count)
+SELECT localite, ST_Centroid(ST_Collect(geom)), ST_Envelope(ST_Collect(geom)),
+    count(*)
+FROM diffdata.v_pcn_addresspoints
+WHERE {filter}
+GROUP BY localite;
+
+DELETE FROM geocoding.zip_aggregate WHERE {filter};
+INSERT INTO geocoding.zip_aggregate
+    (code_postal, localite, geom, extent, address_count)
+SELECT code_postal, localite, ST_Centroid(ST_Collect(geom)),
+    ST_Envelope(ST_Collect(geom)), count(*)
+FROM diffdata.v_pcn_addresspoints
+WHERE code_postal IS NOT NULL AND {filter}
+GROUP BY code_postal, localite;
+
+DELETE FROM geocoding.street_aggregate WHERE {filter};
+INSERT INTO geocoding.street_aggregate
+    (id_caclr_loca, id_caclr_rue, rue, code_postal, localite, geom, extent,
+     num_min, num_max, address_count)
+SELECT id_caclr_loca, id_caclr_rue, rue, code_postal, localite,
+    ST_Centroid(ST_Collect(geom)), ST_Envelope(ST_Collect(geom)),
+    min(substring(numero from '^[0-9]+')::integer),
+    max(coalesce(substring(numero from '-\\s*([0-9]+)'),
+                 substring(numero from '^[0-9]+'))::integer),
+    count(*)
+FROM diffdata.v_pcn_addresspoints
+WHERE {filter}
+GROUP BY id_caclr_loca, id_caclr_rue, rue, code_postal, localite;
+
+DELETE FROM geocoding.address_house_number WHERE {filter};
+INSERT INTO geocoding.address_house_number
+    (gid, code_postal, localite, numero, numero_part, num_from, num_to, suffix)
+SELECT gid::varchar,
+    CASE WHEN code_postal ~ '^\\s*[0-9]+\\s*$' THEN code_postal::integer END,
+    lower(localite), lower(numero), numero_part,
+    substring(numero from '^[0-9]+')::integer,
+    coalesce(substring(numero from '-\\s*([0-9]+)'),
+             substring(numero from '^[0-9]+'))::integer,
+    substring(numero_part from '^[0-9]+\\s*([a-z]+)')
+FROM diffdata.v_pcn_addresspoints,
+    unnest(regexp_split_to_array(lower(numero), '-')) AS numero_part
+WHERE numero IS NOT NULL AND {filter};
+"""
+
+
+def statuslog(text):
+    sys.stdout.write(text)
+    sys.stdout.flush()
+
+
+def refresh(engine, localities=None):
+    if localities:
+        filter = "lower(localite) IN :localities"
+        params = {'localities': tuple(l.strip().lower() for l in localities)}
+    else:
+        filter = "true"
+        params = {}
+    with engine.begin() as connection:
+        connection.execute(text(CREATE))
+        for statement in FILL.format(filter=filter).split(';'):
+            if len(statement.strip()) > 0:
+                connection.execute(text(statement), **params)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument(
+        '--app-config', default='development.ini',
+        help='The application .ini config file')
+    parser.add_argument(
+        'localities', nargs='*',
+        help='Only refresh the aggregates of these localities')
+    options = parser.parse_args()
+
+    bootstrap(options.app_config)
+    from c2cgeoportal_commons.models import DBSessions
+    if options.localities:
+        statuslog("\rRefreshing the aggregates of %s" % ", ".join(options.localities))
+    else:
+        statuslog("\rBuilding all the aggregates")
+    refresh(DBSessions['ecadastre'].bind, options.localities)
+
+    # The application keeps the address points and the aggregates in memory
+    from geoportailv3_geoportal.lib import address_autocomplete, \
+        geocoding_index, parcel_lookup, reverse_geocoder
+    for module in (geocoding_index, reverse_geocoder, address_autocomplete,
+                   parcel_lookup):
+        module.invalidate()
+    statuslog("\rDone\n")
+
+
+if __name__ == '__main__':
+    main()
@@ -38,17 +38,30 @@ import yaml
 import requests
 import json
 import os
+import stat
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
 from argparse import ArgumentParser
 from pyramid.paster import get_app, bootstrap
-from pyramid.i18n import TranslationStringFactory, make_localizer
-from pyramid.interfaces import ITranslationDirectories
+from geoportailv3_geoportal.lib.translations import get_translation_dirs, \
+    translate
 from geoportailv3_geoportal.lib.search import get_elasticsearch, get_index, \
     ensure_index
 from elasticsearch import helpers
 from elasticsearch.helpers import BulkIndexError
 from elasticsearch.exceptions import ConnectionTimeout
+from requests.adapters import HTTPAdapter
 from . import lux_get_app, escape_variables
 
+# Number of metadata records fetched at the same time from GeoNetwork
+METADATA_WORKERS = int(os.environ.get('LAYERS2ES_METADATA_WORKERS', '8'))
+# File where the metadata are kept between two runs, none by default
+METADATA_CACHE = os.environ.get('LAYERS2ES_METADATA_CACHE')
+# Number of records of which the change date is asked with one request
+CHANGE_DATE_CHUNK_SIZE = 50
+METADATA_TIMEOUT = 60
+METADATA_LANGS = {'fr': 'fre', 'de': 'ger', 'en': 'eng', 'lb': 'ltz'}
+
 
 def statuslog(text):
     sys.stdout.write(text)
@@ -106,6 +119,30 @@ def main():
         dest="recreate_index",
         help="recreate the index",
     )
+    parser.add_argument(
+        "--metadata-cache",
+        default=METADATA_CACHE,
+        dest="metadata_cache",
+        help="the file where the GeoNetwork metadata are kept between two "
+        "runs, in a directory writable only by the user running the import "
+        "(optional, default is the LAYERS2ES_METADATA_CACHE environment "
+        "variable, or no cache)",
+    )
+    parser.add_argument(
+        "--no-metadata-cache",
+        action="store_const",
+        const=None,
+        dest="metadata_cache",
+        help="fetch all the GeoNetwork metadata again",
+    )
+    parser.add_argument(
+        "--metadata-workers",
+        type=int,
+        default=METADATA_WORKERS,
+        dest="metadata_workers",
+        help="the number of GeoNetwork metadata fetched at the same time "
+        "(optional, default is %i)" % METADATA_WORKERS,
+    )
     parser.add_argument(
         "--package",
         help="the application package",
@@ -134,6 +171,215 @@ def main():
     Import(options)
 
 
+class MetadataFetcher:
+    """
+    Fetch the GeoNetwork metadata of the layers once by record and language,
+    with a bounded pool of threads. The metadata are kept in a file with the
+    change date of their record, they are fetched again only when the record
+    changed.
+    """
+
+    def __init__(self, base_url, cache_path=None, workers=METADATA_WORKERS):
+        self.base_url = base_url
+        self.cache_path = cache_path
+        self.workers = max(workers, 1)
+        # (metadata_id, lang) -> documents to complete
+        self.pending = {}
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_maxsize=self.workers)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+
+    def add(self, metadata_id, lang, fts):
+        self.pending.setdefault((metadata_id, lang), []).append(fts)
+
+    def _get_url(self, metadata_id, lang):
+        return "{}/{}/q?_content_type=json&_isTemplate=y+or+n" \
+            "&_uuid_OR__id={}&fast=index".format(
+                self.base_url, METADATA_LANGS[lang], metadata_id)
+
+    def _load_cache(self):
+        if self.cache_path is None or not os.path.exists(self.cache_path):
+            return {}
+        # The metadata are published in the index, only a file of the user
+        # running the import that the others cannot change is trusted
+        info = os.stat(self.cache_path)
+        if info.st_uid != os.getuid() or \
+                info.st_mode & (stat.S_IWGRP | stat.S_IWOTH):
+            statuslog("\nIgnoring the metadata cache %s: it is not owned by "
+                      "the user or writable by others" % self.cache_path)
+            return {}
+        try:
+            with open(self.cache_path) as f:
+                cache = json.load(f)
+        except ValueError as e:
+            statuslog("\nIgnoring the metadata cache %s: %s" % (
+                self.cache_path, e))
+            return {}
+        if not isinstance(cache, dict):
+            statuslog("\nIgnoring the metadata cache %s: invalid content" %
+                      self.cache_path)
+            return {}
+        return {key: entry for key, entry in cache.items()
+                if self._is_valid_entry(entry)}
+
+    @staticmethod
+    def _is_valid_entry(entry):
+        # The fields given by _parse
+        if not isinstance(entry, dict) or \
+                not isinstance(entry.get('change_date'), str) or \
+                not isinstance(entry.get('fields'), dict):
+            return False
+        fields = entry['fields']
+        return set(fields) <= {'keywords', 'description', 'metadata_name'} \
+            and all(isinstance(fields.get(name, ''), str)
+                    for name in ('description', 'metadata_name')) \
+            and isinstance(fields.get('keywords', []), list) \
+            and all(isinstance(keyword, str)
+                    for keyword in fields.get('keywords', []))
+
+    def _save_cache(self, cache):
+        if self.cache_path is None:
+            return
+        # The temporary file is only readable by the user
+        fd, tmp_path = tempfile.mkstemp(
+            dir=os.path.dirname(os.path.abspath(self.cache_path)),
+            prefix='.layers2es_metadata')
+        try:
+            with os.fdopen(fd, 'w') as f:
+                json.dump(cache, f)
+            os.replace(tmp_path, self.cache_path)
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+
+    def _get_change_dates(self, metadata_ids):
+        """
+        Return the change date of the records, asked for many records at
+        once. The records without known date are fetched again.
+        """
+        change_dates = {}
+        metadata_ids = sorted(metadata_ids)
+        for i in range(0, len(metadata_ids), CHANGE_DATE_CHUNK_SIZE):
+            chunk = metadata_ids[i:i + CHANGE_DATE_CHUNK_SIZE]
+            try:
+                resp = self.session.get(
+                    "{}/eng/q".format(self.base_url), params={
+                        '_content_type': 'json',
+                        '_isTemplate': 'y or n',
+                        '_uuid_OR__id': ' or '.join(chunk),
+                        'fast': 'index',
+                        'buildSummary': 'false',
+                        'from': 1,
+                        'to': len(chunk),
+                    }, timeout=METADATA_TIMEOUT)
+                records = json.loads(resp.text).get('metadata', [])
+            except (requests.exceptions.RequestException, ValueError) as e:
+                statuslog("\nUnable to get the change dates: %s" % e)
+                continue
+            if isinstance(records, dict):
+                records = [records]
+            for record in records:
+                info = record.get('geonet:info', {})
+                for key in ('uuid', 'id'):
+                    if key in info:
+                        change_dates[info[key]] = info.get('changeDate')
+        return change_dates
+
+    def _fetch(self, metadata_id, lang):
+        url = self._get_url(metadata_id, lang)
+        resp = self.session.get(url=url, timeout=METADATA_TIMEOUT)
+        try:
+            data = json.loads(resp.text)
+        except:
+            statuslog("\n %s" % self.base_url)
+            statuslog("\n %s" % str(resp.status_code))
+            return None, {}
+        change_date = None
+        if isinstance(data.get('metadata'), dict):
+            change_date = data['metadata'].get('geonet:info', {}).\
+                get('changeDate')
+        return change_date, self._parse(data, url)
+
+    def _parse(self, data, url):
+        fields = {}
+        try:
+            keywords = []
+            if 'keywords' in data['summary']:
+                for keyword in data['summary']['keywords']:
+                    keywords.append(keyword['@label'])
+            fields['keywords'] = keywords
+            if 'metadata' in data:
+                if 'abstract' in data['metadata']:
+                    fields['description'] = data['metadata']['abstract']
+                elif 'defaultAbstract' in data['metadata']:
+                    fields['description'] = data['metadata']['defaultAbstract']
+                else:
+                    fields['description'] = ''
+                    statuslog("\nAbstract is missing in  %s" % url)
+                if 'title' in data['metadata']:
+                    fields['metadata_name'] = data['metadata']['title']
+                else:
+                    fields['metadata_name'] = ''
+                    statuslog("\nTitle is missing in  %s" % url)
+            else:
+                fields['description'] = ''
+                fields['metadata_name'] = ''
+                statuslog("\nMetadata is missing in %s" % url)
+        except KeyError as e:
+            statuslog("\n %s" % e)
+        return fields
+
+    def fill(self):
+        """
+        Complete the documents with the metadata of their record, from the
+        cache when the record did not change.
+        """
+        cache = self._load_cache()
+        change_dates = {}
+        if len(cache) > 0:
+            change_dates = self._get_change_dates(
+                {metadata_id for metadata_id, lang in self.pending})
+
+        new_cache = {}
+        results = {}
+        missing = []
+        for metadata_id, lang in self.pending:
+            cache_key = "%s/%s" % (lang, metadata_id)
+            entry = cache.get(cache_key)
+            if entry is not None and entry['change_date'] is not None and \
+                    entry['change_date'] == change_dates.get(metadata_id):
+                new_cache[cache_key] = entry
+                results[(metadata_id, lang)] = entry['fields']
+            else:
+                missing.append((metadata_id, lang))
+
+        statuslog("\n%i metadata, %i from the cache, fetching %i" % (
+            len(self.pending), len(results), len(missing)))
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            futures = [(key, executor.submit(self._fetch, *key))
+                       for key in missing]
+            for (metadata_id, lang), future in futures:
+                try:
+                    change_date, fields = future.result()
+                except requests.exceptions.RequestException as e:
+                    statuslog("\n %s" % e)
+                    for key, other in futures:
+                        other.cancel()
+                    sys.exit(1)
+                results[(metadata_id, lang)] = fields
+                if change_date is None:
+                    change_date = change_dates.get(metadata_id)
+                if len(fields) > 0 and change_date is not None:
+                    new_cache["%s/%s" % (lang, metadata_id)] = {
+                        'change_date': change_date, 'fields': fields}
+
+        for key, documents in self.pending.items():
+            for fts in documents:
+                fts.update(results[key])
+        self._save_cache(new_cache)
+
+
 class Import:
     def __init__(self, options):
         self.options = options
@@ -157,15 +403,17 @@ class Import:
         self.session = DBSession()
 
         self._ = {}
-        self.metadata_service_url = base_url = os.environ["GEONETWORK_BASE_URL"]
+        self.metadata_service_url = os.environ["GEONETWORK_BASE_URL"]
+        self.metadata = MetadataFetcher(
+            self.metadata_service_url, options.metadata_cache,
+            options.metadata_workers)
 
         with bootstrap(self.options.app_config, options=escape_variables(os.environ)) as env:
             registry = env['registry']
             request = env['request']
 
         self.es_layer_index = get_index(request) + '_layers'
-        self.tdirs = registry.queryUtility(ITranslationDirectories, default=[])
-        self.tsf = TranslationStringFactory('geoportailv3_geoportal-client')
+        self.tdirs = get_translation_dirs(registry)
 
         self.interfaces = self.session.query(Interface).filter(
             Interface.name.in_(options.interfaces)
@@ -186,6 +434,8 @@ class Import:
                 if theme.name not in exluded_themes:
                     self._add_theme(theme, role)
 
+        self.metadata.fill()
+
         ensure_index(
             get_elasticsearch(request),
             self.es_layer_index,
@@ -217,8 +467,7 @@ class Import:
         if key not in self.imported:
             self.imported.add(key)
             for lang in self.languages:
-                localizer = make_localizer(lang, self.tdirs)
-                translated_name = localizer.translate(self.tsf(item.name))
+                translated_name = translate(item.name, lang, self.tdirs)
                 if role is None:
                     role_id = None
                 else:
@@ -236,51 +485,10 @@ class Import:
                     'description': '',
                     'metadata_name': ''
                 }
-                for metadata in item.metadatas:
-                    if metadata.name == 'metadata_id':
-                        try:
-                            id = metadata.value
-                            langs = {'fr': 'fre',
-                                     'de': 'ger',
-                                     'en': 'eng',
-                                     'lb': 'ltz'}
-                            url = "{}/{}/q?_content_type=json&_isTemplate=y+or+n&_uuid_OR__id={}&fast=index".format(self.metadata_service_url, langs[lang], id)
-
-                            resp = requests.get(url=url)
-                            data = {}
-                            try:
-                                data = json.loads(resp.text)
-                            except:
-                                statuslog("\n %s" % self.metadata_service_url)
-                                statuslog("\n %s" % str(resp.status_code))
-                            try:
-                                keywords = []
-                                if 'keywords' in data['summary']:
-                                    for keyword in data['summary']['keywords']:
-                                        keywords.append(keyword['@label'])
-                                fts['keywords'] = keywords
-                                if 'metadata' in data:
-                                    if 'abstract' in data['metadata']:
-                                        fts['description'] = data['metadata']['abstract']
-                                    elif 'defaultAbstract' in data['metadata']:
-                                        fts['description'] = data['metadata']['defaultAbstract']
-                                    else:
-                                        fts['description'] = ''
-                                        statuslog("\nAbstract is missing in  %s" % url)
-                                    if 'title' in data['metadata']:
-                                        fts['metadata_name'] = data['metadata']['title']
-                                    else:
-                                        fts['metadata_name'] = ''
-                                        statuslog("\nTitle is missing in  %s" % url)
-                                else:
-                                    fts['description'] = ''
-                                    fts['metadata_name'] = ''
-                                    statuslog("\nMetadata is missing in %s" % url)
-                            except KeyError as e:
-                                statuslog("\n %s" % e)
-                        except requests.exceptions.RequestException as e:
-                            statuslog("\n %s" % e)
-                            sys.exit(1)
+                metadata_ids = [metadata.value for metadata in item.metadatas
+                                if metadata.name == 'metadata_id']
+                if len(metadata_ids) > 0:
+                    self.metadata.add(metadata_ids[-1], lang, fts)
                 doc = self._update_document(fts)
                 self.layers.append(doc)
 
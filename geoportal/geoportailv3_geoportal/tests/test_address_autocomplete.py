@@ -0,0 +1,106 @@
+# -*- coding: utf-8 -*-
+import random
+import unittest
+
+from geoportailv3_geoportal.lib import address_autocomplete
+from geoportailv3_geoportal.lib.address_autocomplete import ADDRESS, POI, \
+    STREET, AutocompleteIndex, SortedKeys, Suggestion, normalize
+
+
+def make_index(streets, pois, addresses):
+    index = AutocompleteIndex()
+    for rue, code_postal, localite in streets:
+        idx = index._add(Suggestion(
+            STREET, "%s, %s %s" % (rue, code_postal, localite), None, rue,
+            code_postal, localite, 0, 0))
+        index.places.add(
+            address_autocomplete._join(rue, code_postal, localite), idx,
+            STREET)
+        index.places.add(address_autocomplete._join(localite, rue), idx, STREET)
+    for name, locality in pois:
+        idx = index._add(Suggestion(
+            POI, "%s, %s" % (name, locality), None, None, None, locality, 0,
+            0))
+        index.places.add(address_autocomplete._join(name, locality), idx, POI)
+    for numero, rue, code_postal, localite in addresses:
+        idx = index._add(Suggestion(
+            ADDRESS, "%s, %s, %s %s" % (numero, rue, code_postal, localite),
+            numero, rue, code_postal, localite, 0, 0))
+        index.addresses.add(
+            address_autocomplete._join(numero, rue, code_postal, localite),
+            idx, ADDRESS)
+        index.addresses.add(
+            address_autocomplete._join(rue, numero, code_postal, localite),
+            idx, ADDRESS)
+    index.places.sort()
+    index.addresses.sort()
+    return index
+
+
+class TestAutocomplete(unittest.TestCase):
+
+    def test_normalize(self):
+        self.assertEqual(normalize(u"  Rue de l'Église, "), u"rue de l eglise")
+        self.assertEqual(normalize(None), u"")
+
+    def test_complete(self):
+        index = make_index(
+            [(u"Rue de la Gare", u"1611", u"Luxembourg"),
+             (u"Rue de Hollerich", u"1740", u"Luxembourg"),
+             (u"Avenue de la Gare", u"1611", u"Luxembourg")],
+            [(u"Gare Centrale", u"Luxembourg")],
+            [(u"12", u"Rue de la Gare", u"1611", u"Luxembourg")])
+        labels = [s.label for s in index.complete(u"rue de la g")]
+        self.assertEqual(labels, [
+            u"Rue de la Gare, 1611 Luxembourg",
+            u"12, Rue de la Gare, 1611 Luxembourg"])
+        labels = [s.label for s in index.complete(u"12 rue")]
+        self.assertEqual(labels, [u"12, Rue de la Gare, 1611 Luxembourg"])
+        # The streets and POI before the addresses, the shortest first
+        labels = [s.label for s in index.complete(u"Luxembourg", 3)]
+        self.assertEqual(labels, [
+            u"Rue de la Gare, 1611 Luxembourg",
+            u"Rue de Hollerich, 1740 Luxembourg",
+            u"Avenue de la Gare, 1611 Luxembourg"])
+        self.assertEqual(index.complete(u" , "), [])
+        self.assertEqual(index.complete(u"xyz"), [])
+
+    def test_find_is_ranked_within_the_scan_bound(self):
+        # The short keys are found first even when many longer keys come
+        # before them in the alphabetical order
+        keys = SortedKeys()
+        for i in range(50):
+            keys.add(u"rue a%02d long name of a street" % i, i, STREET)
+        keys.add(u"rue z", 50, STREET)
+        keys.sort()
+        max_scan = address_autocomplete.MAX_SCAN
+        address_autocomplete.MAX_SCAN = 10
+        try:
+            self.assertEqual(keys.find(u"rue", 1), [50])
+        finally:
+            address_autocomplete.MAX_SCAN = max_scan
+
+    def test_find_same_as_full_sort(self):
+        rnd = random.Random(3)
+        words = [u'rue', u'route', u'avenue', u'place', u'op', u'am']
+        keys = SortedKeys()
+        added = []
+        for i in range(3000):
+            text = u' '.join(
+                rnd.choice(words) + rnd.choice(u'abcdef') * rnd.randint(0, 4)
+                for _ in range(rnd.randint(1, 4)))
+            kind = rnd.choice((STREET, POI))
+            keys.add(text, i // 2, kind)
+            added.append((kind, normalize(text), i // 2))
+        keys.sort()
+        for prefix in [u'r', u'rue', u'rue a', u'place', u'am b', u'zz']:
+            ranks = {}
+            for kind, key, idx in added:
+                if key.startswith(prefix):
+                    rank = (kind, len(key), key)
+                    if idx not in ranks or rank < ranks[idx]:
+                        ranks[idx] = rank
+            expected = sorted(ranks.values())[:10]
+            self.assertEqual(
+                [ranks[idx] for idx in keys.find(prefix, 10)], expected,
+                prefix)
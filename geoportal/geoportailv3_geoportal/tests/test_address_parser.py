@@ -0,0 +1,221 @@
+# -*- coding: utf-8 -*-
+import itertools
+import re
+import unittest
+
+from geoportailv3_geoportal.lib import address_parser
+
+
+def former_strip_accents(ligne):
+    # Geocode.supprime_accent before lib/address_parser.py
+    if ligne is None:
+        return None
+    accents = {u'a': [u'à', u'ã', u'á', u'â'],
+               u'e': [u'é', u'è', u'ê', u'ë'],
+               u'i': [u'î', u'ï'],
+               u'u': [u'ù', u'ü', u'û'],
+               u'o': [u'ô', u'ö']}
+    for (char, accented_chars) in accents.items():
+        for accented_char in accented_chars:
+            ligne = ligne.replace(accented_char, char)
+    return ligne
+
+
+def former_replace_words(p_string):
+    # Geocode.replace_words before lib/address_parser.py
+    if p_string is None:
+        return None
+
+    p_string = p_string.replace("-", " ").strip()
+    p_string = p_string.replace(".", " ").strip()
+    p_string = p_string.replace(",", " ").strip()
+    p_string = p_string.replace(";", " ").strip()
+    p_string = p_string.replace(": ", " ").strip()
+
+    abbreviations = {u"p\\.": u"place",
+                     u"pl": u"place",
+                     u"av": u"avenue",
+                     u"bd": u"boulevard",
+                     u"bvd": u"boulevard",
+                     u"bld": u"boulevard",
+                     u"zi": u"zone industrielle",
+                     u"z i": u"zone industrielle",
+                     u"z a c": u"zone activité",
+                     u"zac": u"zone activité",
+                     u"z a e": u"zone activité",
+                     u"zone activité commerciale": u"zone activité",
+                     u"zae": u"zone activité",
+                     u"ctre": u"zone centre",
+                     u"r": u"rue",
+                     u"rte": u"route",
+                     u"r\\.": u"rue",
+                     u"rt": u"route",
+                     u"ob": u"",
+                     u"de": u"",
+                     u"des": u"",
+                     u"du": u"",
+                     u"le": u"",
+                     u"la": u"",
+                     u"les": u"",
+                     u"op": u"",
+                     u"um": u"",
+                     u"an": u"",
+                     u"imp": u"",
+                     u"imp.": u"",
+                     u"chat": u"chateau",
+                     u"zone industrielle": u"",
+                     u"ch": u"",
+                     u"a": u"",
+                     u"d": u"",
+                     u"l": u"",
+                     u"'": u" ",
+                     u"1er": u"",
+                     u"1 er": u"",
+                     u"I er": u"",
+                     u"ier": u"",
+                     u"er": u"",
+                     u"premier": u"1",
+                     u"ste": u"sainte",
+                     u"i": u"1",
+                     u"un": u"1",
+                     u"ii": u"2",
+                     u"deux": u"2",
+                     u"iii": u"3",
+                     u"trois": u"3",
+                     u"X": u"10",
+                     u"XX": u"20",
+                     u"eme": u"",
+                     u"ème": u"",
+                     u"2eme": u"2",
+                     u"2ème": u"2",
+                     u"st": u"",
+                     u"1st": u"1",
+                     u"nd": u"",
+                     u"2nd": u"2"
+                     }
+
+    for abbrev in abbreviations:
+        p_string = re.sub(
+            r'\b%s\b' % abbrev, abbreviations[abbrev], p_string)
+
+    p_string = re.sub(r'\([^)]*\)', '', p_string)
+
+    p_string = p_string.replace(u"'", u" ")
+    return p_string
+
+
+def former_split_street_and_house_number(streetandhouse):
+    # Geocode.split_street_and_house_number before lib/address_parser.py
+    nums = re.findall(r'\d+', streetandhouse)
+
+    street = None
+    house_num = None
+    if nums is not None and len(nums) > 0:
+        idx = streetandhouse.find(nums[0])
+        if idx == 0:
+            house_num = nums[0]
+
+            if streetandhouse[idx + len(house_num):
+                              idx + len(house_num) + 1] != " " and\
+               streetandhouse[idx + len(house_num):
+                              idx + len(house_num) + 1] != ",":
+                if streetandhouse[idx + len(house_num):
+                                  idx + len(house_num) + 1] == "-":
+                    part2 = streetandhouse[len(house_num) + 1:]
+
+                    nums2 = re.findall(r'\d+', part2)
+                    if nums2 is not None and len(nums2) > 0:
+                        idx2 = streetandhouse.find(nums2[0])
+                        house_num = streetandhouse[idx:idx2 + len(nums2[0])]
+                else:
+                    if streetandhouse[idx + len(house_num) + 1:
+                                      idx + len(house_num) + 2] != " ":
+                        house_num = streetandhouse[idx:idx + len(house_num)]
+                    else:
+                        house_num = streetandhouse[
+                            idx:idx + len(house_num) + 1]
+            street = streetandhouse[len(house_num) + 1:]
+        else:
+            house_num = nums[len(nums) - 1]
+            if streetandhouse[idx + len(house_num):
+                              idx + len(house_num) + 1] != " " and\
+               streetandhouse[idx + len(house_num):
+                              idx + len(house_num) + 1] != ",":
+                if streetandhouse[idx + len(house_num):
+                                  idx + len(house_num) + 2] != " ":
+                    house_num = streetandhouse[idx:idx + len(house_num)]
+                else:
+                    house_num = streetandhouse[idx:idx + len(house_num) + 1]
+            street = streetandhouse[len(house_num) + 1:]
+    else:
+        street = streetandhouse
+    return house_num, street
+
+
+NUMBERS = [u'', u'54', u'2A', u'7-9', u'12b', u'1,', u'3 ']
+STREETS = [
+    u"Avenue gaston diderich", u"r. de l'Église", u"bd Royal",
+    u"rte d'Arlon (Strassen)", u"Allée de la Jeunesse Sacrifiée 1940-1945",
+    u"Rue du 9 mai 1944", u"z.a.c. Op der Héi", u"pl. Guillaume II",
+    u"rue du 1er septembre", u"Zone industrielle Bombicht", u"imp. des Lilas",
+    u"Chemin de la Côte-d'Eich", u"Um Bechel; St. Hubert"]
+LOCALITIES = [u'', u'1420 luxembourg', u'L-2449 Luxembourg', u'Esch/Alzette',
+              u'Esch sur Alzette', u'8009', u'5863 Alzinghen']
+
+
+def corpus():
+    for num, street, locality in itertools.product(
+            NUMBERS, STREETS, LOCALITIES):
+        yield ' '.join(part for part in (num, street, locality) if part)
+        yield ' '.join(part for part in (street, num, locality) if part)
+
+
+class TestAddressParser(unittest.TestCase):
+
+    def test_parse_address(self):
+        self.assertEqual(
+            address_parser.parse_address(
+                u"54 Avenue gaston diderich 1420 luxembourg"),
+            (u"avenue gaston diderich", u"54", u"1420", u"luxembourg"))
+        self.assertEqual(
+            address_parser.parse_address(u"7-9 bd Royal L-2449 Luxembourg"),
+            (u"bd royal", u"7-9", u"2449", u"luxembourg"))
+        self.assertEqual(
+            address_parser.parse_address(
+                u"2A Rue du 9 mai 1944 2112 Howald"),
+            (u"rue du 9 mai 1944", u"2A", u"2112", u"howald"))
+
+    def test_parse_address_zip_only(self):
+        # The locality is then found from the post code
+        parsed = address_parser.parse_address(
+            u"12b rte d'Arlon (Strassen) 8009")
+        self.assertEqual(parsed.street, u"rte d'arlon")
+        self.assertEqual(parsed.num, u"12b")
+        self.assertEqual(parsed.zip, u"8009")
+        self.assertIsNone(parsed.locality)
+
+    def test_parse_address_none(self):
+        self.assertEqual(
+            address_parser.parse_address(None), (None, None, None, None))
+
+    def test_normalize_locality(self):
+        self.assertEqual(
+            address_parser.normalize_locality(u"Esch/Alzette"),
+            u"esch-sur-alzette")
+        self.assertEqual(
+            address_parser.normalize_locality(u"L-Esch sur Alzette,"),
+            u"esch-sur-alzette")
+
+    def test_same_as_former_normalization(self):
+        for address in corpus():
+            text = address.lower()
+            self.assertEqual(
+                address_parser.strip_accents(text),
+                former_strip_accents(text), address)
+            self.assertEqual(
+                address_parser.replace_words(
+                    address_parser.strip_accents(text)),
+                former_replace_words(former_strip_accents(text)), address)
+            self.assertEqual(
+                address_parser.split_street_and_house_number(address),
+                former_split_street_and_house_number(address), address)
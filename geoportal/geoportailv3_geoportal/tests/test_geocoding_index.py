@@ -0,0 +1,99 @@
+# -*- coding: utf-8 -*-
+import difflib
+import random
+import unittest
+
+from geoportailv3_geoportal.lib.geocoding_index import Entry, \
+    TrigramMatcher, _length_bound
+
+
+def make_entries(names):
+    return [Entry(name, name, None, name) for name in names]
+
+
+def random_names(rnd, count):
+    syllables = ['bet', 'ten', 'dorf', 'esch', 'sur', 'al', 'zette', 'lux',
+                 'em', 'bourg', 'die', 'kirch', 'berg', 'ange', 'heim', 'wil',
+                 'tz', 'mer', 'sch', 'oh', 'rem', 'ich', 'ling', 'en']
+    return [''.join(rnd.choice(syllables)
+                    for _ in range(rnd.randint(1, 4))) +
+            rnd.choice(['', '-sur-alzette', ' kirchberg', '-les-bains'])
+            for _ in range(count)]
+
+
+class TestTrigramMatcher(unittest.TestCase):
+
+    def setUp(self):  # noqa
+        self.rnd = random.Random(42)
+        self.names = random_names(self.rnd, 400)
+        self.matcher = TrigramMatcher(make_entries(self.names))
+
+    def brute_best(self, key):
+        best_idx, best_ratio = None, 0
+        for idx, name in enumerate(self.names):
+            ratio = difflib.SequenceMatcher(None, key, name).ratio()
+            if ratio > best_ratio:
+                best_idx, best_ratio = idx, ratio
+        return best_idx, best_ratio
+
+    def test_best(self):
+        matcher = TrigramMatcher(make_entries(
+            ['luxembourg', 'esch-sur-sure', 'esch-sur-alzette']))
+        entry, ratio = matcher.best('esch sur alzette')
+        self.assertEqual(entry.key, 'esch-sur-alzette')
+        self.assertEqual(ratio, 0.875)
+        self.assertEqual(
+            [entry.key for entry in matcher.matches('esch sur alzette', 0.8)],
+            ['esch-sur-alzette'])
+
+    def test_exact_match(self):
+        entry, ratio = self.matcher.best(self.names[10])
+        self.assertEqual(entry.key, self.names[10])
+        self.assertEqual(ratio, 1.0)
+
+    def test_best_same_as_full_scan(self):
+        queries = random_names(self.rnd, 300) + \
+            [name[1:] for name in self.names[:100]] + ['x', 'zz', 'e']
+        for key in queries:
+            best_idx, best_ratio = self.brute_best(key)
+            entry, ratio = self.matcher.best(key)
+            self.assertEqual(ratio, best_ratio, key)
+            if key not in self.names:
+                self.assertIs(entry, self.matcher.entries[best_idx], key)
+
+    def test_best_found_outside_of_the_candidates(self):
+        # Many names share trigrams with the key, the best one does not
+        names = ['axbqqqqqqq%02d' % i for i in range(40)] + ['abcd']
+        matcher = TrigramMatcher(make_entries(names))
+        key = 'axbxcxdx'
+        self.assertNotIn(40, matcher.candidates(key))
+        entry, ratio = matcher.best(key)
+        self.assertEqual(entry.key, 'abcd')
+        self.assertEqual(
+            ratio, difflib.SequenceMatcher(None, key, 'abcd').ratio())
+
+    def test_no_match(self):
+        self.assertEqual(self.matcher.best('0123'), (None, 0))
+        self.assertEqual(TrigramMatcher([]).best('esch'), (None, 0))
+
+    def test_matches_same_as_full_scan(self):
+        for key in random_names(self.rnd, 100):
+            expected = [
+                name for name in self.names
+                if difflib.SequenceMatcher(None, key, name).ratio() > 0.8]
+            self.assertEqual(
+                [entry.key for entry in self.matcher.matches(key, 0.8)],
+                expected, key)
+
+    def test_length_buckets(self):
+        self.assertEqual(_length_bound(4, 12), 0.5)
+        self.assertEqual(_length_bound(0, 0), 1.0)
+        matcher = TrigramMatcher(make_entries(
+            ['esch', 'eschdorf', 'esch-sur-alzette']))
+        # The longest name can not reach a ratio of 0.6 with 'esch'
+        self.assertEqual(
+            [length for bound, length in matcher._lengths('esch', 0.6)],
+            [4, 8])
+        self.assertEqual(
+            [entry.key for entry in matcher.matches('esch', 0.6)],
+            ['esch', 'eschdorf'])
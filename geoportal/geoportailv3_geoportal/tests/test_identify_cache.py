@@ -0,0 +1,60 @@
+# -*- coding: utf-8 -*-
+import unittest
+
+from geoportailv3_geoportal.lib import identify_cache
+
+
+class TestIdentifyCache(unittest.TestCase):
+
+    def tearDown(self):  # noqa
+        identify_cache._entries.clear()
+
+    def test_snap_box(self):
+        self.assertIsNone(identify_cache.snap_box(None))
+        # Two close clicks with the same tolerance share their box
+        box1 = identify_cache.snap_box((100.0, 200.0, 110.0, 210.0))
+        box2 = identify_cache.snap_box((100.4, 200.4, 110.4, 210.4))
+        self.assertEqual(box1, box2)
+        # Not when the click moved by more than the grid step
+        box3 = identify_cache.snap_box((105.0, 205.0, 115.0, 215.0))
+        self.assertNotEqual(box1, box3)
+        # Nor when the tolerance changed
+        box4 = identify_cache.snap_box((100.0, 200.0, 120.0, 220.0))
+        self.assertNotEqual(box1, box4)
+        # An empty box is kept as is
+        self.assertEqual(
+            identify_cache.snap_box(('1', '2', '1', '2')),
+            (1.0, 2.0, 1.0, 2.0))
+
+    def test_snap_resolution(self):
+        self.assertEqual(
+            identify_cache.snap_resolution('0,0,1000,500', '1000'), 1.0)
+        self.assertEqual(
+            identify_cache.snap_resolution('0,0,1000,500', '999'), 1.0)
+        self.assertIsNone(identify_cache.snap_resolution(None, '100'))
+        self.assertIsNone(identify_cache.snap_resolution('0,0,1,1', '0'))
+        self.assertIsNone(identify_cache.snap_resolution('a,b', '100'))
+
+    def test_get_set(self):
+        key = ('layer', 'params')
+        self.assertIsNone(identify_cache.get(key))
+        results = [{'attributes': {'a': 1}}]
+        identify_cache.set(key, results, 60)
+        cached = identify_cache.get(key)
+        self.assertEqual(cached, results)
+        # The results are copied, the caller completes them
+        cached[0]['attributes']['a'] = 2
+        self.assertEqual(identify_cache.get(key), results)
+
+    def test_expiration(self):
+        identify_cache.set(('layer', 'params'), [], -1)
+        self.assertIsNone(identify_cache.get(('layer', 'params')))
+
+    def test_invalidate_layer(self):
+        identify_cache.set(('1', 'a'), [1], 60)
+        identify_cache.set(('2', 'a'), [2], 60)
+        identify_cache.invalidate(1)
+        self.assertIsNone(identify_cache.get(('1', 'a')))
+        self.assertEqual(identify_cache.get(('2', 'a')), [2])
+        identify_cache.invalidate()
+        self.assertIsNone(identify_cache.get(('2', 'a')))
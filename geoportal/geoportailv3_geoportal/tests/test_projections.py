@@ -0,0 +1,68 @@
+# -*- coding: utf-8 -*-
+import unittest
+
+from geoportailv3_geoportal.lib.projections import transform_coordinates, \
+    transform_geojson, transform_geometry
+
+
+class TestProjections(unittest.TestCase):
+
+    def test_transform_coordinates(self):
+        # The origin of LUREF, longitude first
+        lons, lats = transform_coordinates(
+            [80000.0], [100000.0], 'epsg:2169', 'epsg:4326')
+        self.assertAlmostEqual(lons[0], 6.1681, 3)
+        self.assertAlmostEqual(lats[0], 49.8344, 3)
+
+    def test_transform_geojson(self):
+        point = {'type': 'Point', 'coordinates': [77000.0, 75000.0, 300.0]}
+        line = {'type': 'LineString',
+                'coordinates': [[70000.0, 70000.0], [80000.0, 80000.0]]}
+        polygon = {'type': 'Polygon', 'coordinates': [[
+            [70000.0, 70000.0], [80000.0, 70000.0], [80000.0, 80000.0],
+            [70000.0, 70000.0]]]}
+        collection = {'type': 'GeometryCollection',
+                      'geometries': [point, line]}
+        result = transform_geojson(
+            [point, None, line, polygon, collection],
+            'epsg:2169', 'epsg:4326')
+
+        self.assertIsNone(result[1])
+        self.assertEqual(
+            [geometry['type'] for geometry in result if geometry is not None],
+            ['Point', 'LineString', 'Polygon', 'GeometryCollection'])
+        # The z value is kept
+        self.assertEqual(result[0]['coordinates'][2], 300.0)
+        # The same as the geometries reprojected one by one
+        for source, projected in ((point, result[0]), (line, result[2]),
+                                  (polygon, result[3])):
+            expected = transform_geometry(source, 'epsg:2169', 'epsg:4326')
+            xs, ys = transform_coordinates(
+                *zip(*[c[:2] for c in _positions(source)]),
+                'epsg:2169', 'epsg:4326')
+            for (x, y), position in zip(zip(xs, ys), _positions(projected)):
+                self.assertAlmostEqual(x, position[0])
+                self.assertAlmostEqual(y, position[1])
+            self.assertEqual(expected.geom_type, source['type'])
+        self.assertEqual(
+            result[4]['geometries'], [result[0], result[2]])
+        # The source geometries are not changed
+        self.assertEqual(point['coordinates'], [77000.0, 75000.0, 300.0])
+
+    def test_transform_geojson_empty(self):
+        self.assertEqual(transform_geojson([], 'epsg:2169', 'epsg:4326'), [])
+        self.assertEqual(
+            transform_geojson([None], 'epsg:2169', 'epsg:4326'), [None])
+
+
+def _positions(geometry):
+    positions = []
+
+    def collect(coordinates):
+        if isinstance(coordinates[0], (int, float)):
+            positions.append(coordinates)
+        else:
+            for child in coordinates:
+                collect(child)
+    collect(geometry['coordinates'])
+    return positions
@@ -0,0 +1,87 @@
+# -*- coding: utf-8 -*-
+import math
+import random
+import unittest
+
+from shapely.geometry import box
+
+from geoportailv3_geoportal.lib.reverse_geocoder import AddressPoint, \
+    Commune, CommuneIndex, ReverseGeocoder
+
+
+def make_address(x, y, numero='1'):
+    return AddressPoint(
+        None, None, None, 'rue', numero, 'localite', '1234', x, y, None, None)
+
+
+class TestReverseGeocoder(unittest.TestCase):
+
+    def setUp(self):  # noqa
+        rnd = random.Random(7)
+        self.communes = CommuneIndex()
+        self.communes.add_commune(
+            Commune(1, 'West', 'c', 'd'), box(50000, 50000, 80000, 110000))
+        self.communes.add_commune(
+            Commune(2, 'East', 'c', 'd'), box(80000, 50000, 110000, 110000))
+        self.geocoder = ReverseGeocoder(self.communes)
+        # Dense and sparse areas, with empty cells between them
+        for i in range(300):
+            self.geocoder.add_address(make_address(
+                rnd.uniform(70000, 72000), rnd.uniform(75000, 77000), str(i)))
+        for i in range(30):
+            self.geocoder.add_address(make_address(
+                rnd.uniform(60000, 100000), rnd.uniform(60000, 100000),
+                str(300 + i)))
+        self.rnd = rnd
+
+    def brute_nearest(self, x, y):
+        best, best_distance = None, None
+        for address in self.geocoder.addresses:
+            distance = math.hypot(address.x - x, address.y - y)
+            if best is None or distance < best_distance:
+                best, best_distance = address, distance
+        return best, best_distance
+
+    def test_nearest_same_as_full_scan(self):
+        for _ in range(500):
+            x = self.rnd.uniform(45000, 115000)
+            y = self.rnd.uniform(45000, 115000)
+            self.assertEqual(
+                self.geocoder.get_nearest(x, y), self.brute_nearest(x, y))
+
+    def test_nearest(self):
+        geocoder = ReverseGeocoder()
+        first = make_address(0, 0)
+        second = make_address(300, 0)
+        geocoder.add_address(first)
+        geocoder.add_address(second)
+        geocoder.add_address(make_address(1000, 1000))
+        self.assertEqual(
+            geocoder.get_nearest(290, 10), (second, math.hypot(10, 10)))
+        # The first loaded address wins on equal distances
+        self.assertEqual(geocoder.get_nearest(150, 0), (first, 150))
+        # Far outside of the grid of the points
+        self.assertEqual(geocoder.get_nearest(-5000, 0), (first, 5000))
+
+    def test_nearest_on_a_point(self):
+        address = self.geocoder.addresses[42]
+        self.assertEqual(
+            self.geocoder.get_nearest(address.x, address.y), (address, 0))
+
+    def test_no_address(self):
+        self.assertEqual(ReverseGeocoder().get_nearest(0, 0), (None, None))
+
+    def test_commune(self):
+        self.assertEqual(self.communes.get_commune(60000, 70000).commune, 'West')
+        self.assertEqual(self.communes.get_commune(90000, 70000).commune, 'East')
+        self.assertIsNone(self.communes.get_commune(0, 0))
+        self.assertIs(
+            self.geocoder.get_commune(60000, 70000),
+            self.communes.get_commune(60000, 70000))
+
+    def test_reverse(self):
+        self.assertIsNone(self.geocoder.reverse(0, 0))
+        address, distance, commune = self.geocoder.reverse(71000, 76000)
+        self.assertEqual(
+            (address, distance), self.brute_nearest(71000, 76000))
+        self.assertEqual(commune.commune, 'West')
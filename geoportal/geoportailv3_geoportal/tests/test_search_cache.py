@@ -0,0 +1,93 @@
+# -*- coding: utf-8 -*-
+import unittest
+
+from geoportailv3_geoportal.lib import invalidation, search_cache
+
+
+class FakeIndices(object):
+
+    def __init__(self):
+        self.creation_date = '1'
+        self.calls = 0
+
+    def get_settings(self, index, name):
+        self.calls += 1
+        return {index + '_1': {
+            'settings': {'index': {'creation_date': self.creation_date}}}}
+
+
+class FakeElasticsearch(object):
+
+    def __init__(self):
+        self.indices = FakeIndices()
+
+
+class TestSearchCache(unittest.TestCase):
+
+    def setUp(self):  # noqa
+        self.check_delay = search_cache.CHECK_DELAY
+        search_cache.CHECK_DELAY = 0
+        self.es = FakeElasticsearch()
+
+    def tearDown(self):  # noqa
+        search_cache.CHECK_DELAY = self.check_delay
+        search_cache.invalidate()
+        invalidation._checked.clear()
+
+    def test_normalize_query(self):
+        self.assertEqual(
+            search_cache.normalize_query(u"  Rue   de la GARE "),
+            u"rue de la gare")
+
+    def test_extent_bucket(self):
+        self.assertIsNone(search_cache.extent_bucket(None))
+        self.assertEqual(
+            search_cache.extent_bucket('5.9123456,49.4,6.5,50.2'),
+            (5.91235, 49.4, 6.5, 50.2))
+        self.assertEqual(search_cache.extent_bucket('a,b'), 'a,b')
+
+    def test_get_set(self):
+        key = ('index', 'gare', None)
+        self.assertIsNone(search_cache.get(self.es, key))
+        results = {'features': [{'id': 1}]}
+        search_cache.set(key, results)
+        cached = search_cache.get(self.es, key)
+        self.assertEqual(cached, results)
+        cached['features'].append({'id': 2})
+        self.assertEqual(search_cache.get(self.es, key), results)
+
+    def test_replaced_index(self):
+        key = ('index', 'gare', None)
+        search_cache.get(self.es, key)
+        search_cache.set(key, [1])
+        self.assertEqual(search_cache.get(self.es, key), [1])
+        self.es.indices.creation_date = '2'
+        self.assertIsNone(search_cache.get(self.es, key))
+
+    def test_check_delay(self):
+        search_cache.CHECK_DELAY = 60
+        key = ('index', 'gare', None)
+        search_cache.get(self.es, key)
+        search_cache.get(self.es, key)
+        self.assertEqual(self.es.indices.calls, 1)
+
+    def test_invalidate_index(self):
+        search_cache.set(('index1', 'a'), [1])
+        search_cache.set(('index2', 'a'), [2])
+        search_cache.invalidate('index1')
+        self.assertIsNone(search_cache.get(self.es, ('index1', 'a')))
+        self.assertEqual(search_cache.get(self.es, ('index2', 'a')), [2])
+
+    def test_least_recently_used_dropped(self):
+        max_entries = search_cache._entries.max_entries
+        search_cache._entries.max_entries = 2
+        try:
+            search_cache.set(('index', 'a'), 'a')
+            search_cache.set(('index', 'b'), 'b')
+            search_cache.get(self.es, ('index', 'a'))
+            search_cache.set(('index', 'c'), 'c')
+            self.assertEqual(search_cache.get(self.es, ('index', 'a')), 'a')
+            self.assertIsNone(search_cache.get(self.es, ('index', 'b')))
+            self.assertEqual(search_cache.get(self.es, ('index', 'c')), 'c')
+        finally:
+            search_cache._entries.max_entries = max_entries
@@ -4,7 +4,9 @@ from pyramid.view import view_config
 import fiona
 from geojson import Feature, FeatureCollection
 from shapely.geometry import shape
-from geoportailv3_geoportal.lib.search import get_elasticsearch, get_index, get_host
+from geoportailv3_geoportal.lib.search import get_elasticsearch, get_index, get_host, \
+    SEARCH_TIMEOUT
+from geoportailv3_geoportal.lib import search_cache
 import os
 import json
 import geojson
@@ -27,6 +29,12 @@ class FullTextSearchView(object):
             request.registry.settings["default_max_age"]
         self.settings = request.registry.settings.get('fulltextsearch', {})
 
+    def _get_role_key(self):
+        # The anonymous users only get the public results
+        if self.request.user is None:
+            return 'public'
+        return self.request.user.settings_role.id
+
     @view_config(route_name='fulltextsearch', renderer='geojson')
     def fulltextsearch(self):
         if 'query' not in self.request.params:
@@ -143,10 +151,19 @@ class FullTextSearchView(object):
             filters['should'].append({"term": {"role_id": role_id}})
 
         es = get_elasticsearch(self.request)
+        cache_key = (
+            get_index(self.request), 'fulltextsearch',
+            search_cache.normalize_query(query), self._get_role_key(), limit,
+            fuzziness, layer, search_cache.extent_bucket(
+                self.request.params.get('extent', None)))
+        cached = search_cache.get(es, cache_key)
+        if cached is not None:
+            return cached
         try:
             search = es.search(index=get_index(self.request),
                                body=query_body,
-                               size=limit)
+                               size=limit,
+                               request_timeout=SEARCH_TIMEOUT)
         except Exception as e:
             log.exception(e)
             log.error('ES error querying {} on {}'.format(get_index(self.request), get_host()))
@@ -177,7 +194,9 @@ class FullTextSearchView(object):
                                   properties=properties,
                                   bbox=bbox)
                 features.append(feature)
-        return FeatureCollection(features)
+        result = FeatureCollection(features)
+        search_cache.set(cache_key, result)
+        return result
 
     @view_config(route_name='layersearch', renderer='json')
     def layersearch(self):
@@ -226,7 +245,11 @@ class FullTextSearchView(object):
                         }
                     },
                 }
-            }
+            },
+            # A layer has a document by role and language, only its best
+            # document is returned
+            "collapse": {"field": "layer_id"},
+            "_source": ["layer_id", "name", "language"]
         }
         filters = query_body['query']['bool']['filter']['bool']
 
@@ -241,24 +264,26 @@ class FullTextSearchView(object):
 
         es = get_elasticsearch(self.request)
         layer_index = get_index(self.request) + '_layers'
+        cache_key = (layer_index, 'layersearch',
+                     search_cache.normalize_query(query), self._get_role_key(),
+                     limit)
+        cached = search_cache.get(es, cache_key)
+        if cached is not None:
+            return cached
         search = es.search(index=layer_index,
                            body=query_body,
-                           size=limit*4)
-        objs = search['hits']['hits']
+                           size=limit,
+                           request_timeout=SEARCH_TIMEOUT)
         features = []
-
-        layer_ids = []
-        for o in objs:
+        for o in search['hits']['hits']:
             s = o['_source']
-            if s['layer_id'] not in layer_ids:
-                feature = {
-                    "language": s['language'],
-                    "name": s['name'],
-                    "layer_id": s['layer_id'],
-                }
-                features.append(feature)
-                layer_ids.append(s['layer_id'])
-        return features[:limit]
+            features.append({
+                "language": s['language'],
+                "name": s['name'],
+                "layer_id": s['layer_id'],
+            })
+        search_cache.set(cache_key, features)
+        return features
 
     @view_config(route_name='cmssearch', renderer='json')
     def cmssearch(self):
@@ -313,9 +338,15 @@ class FullTextSearchView(object):
 
         filters['must'].append({"term": {"language": query_language}})
         es = get_elasticsearch(self.request)
+        cache_key = ('cms-index', 'cmssearch',
+                     search_cache.normalize_query(query), query_language, limit)
+        cached = search_cache.get(es, cache_key)
+        if cached is not None:
+            return cached
         search = es.search(index='cms-index',
                            body=query_body,
-                           size=limit*4)
+                           size=limit*4,
+                           request_timeout=SEARCH_TIMEOUT)
         objs = search['hits']['hits']
         features = []
 
@@ -328,6 +359,7 @@ class FullTextSearchView(object):
                 "language": s['language']
             }
             features.append(feature)
+        search_cache.set(cache_key, features[:limit])
         return features[:limit]
 
     @view_config(route_name='featuresearch', renderer='json')
@@ -5,27 +5,39 @@ from pyramid.httpexceptions import HTTPBadRequest
 from pyramid.response import Response
 from geojson import loads as geojson_loads
 from geoalchemy2 import func
-from geoalchemy2.elements import WKTElement, WKBElement
-from geoportailv3_geoportal.geocode import CommunesLimAdm, Address, WKPOI, \
-    Neighbourhood, Parcel, CommunesLimAdm
+from geoalchemy2.elements import WKBElement
+from geoportailv3_geoportal.geocode import Address, WKPOI, \
+    StreetAggregate, HouseNumber
 from c2cgeoportal_commons.models import DBSessions
 from shapely.wkt import loads
 from shapely.wkb import loads as wkb_loads
-from shapely.geometry import asShape
+from shapely.geometry import asShape, Point
 from geojson import dumps as geojson_dumps
 from geoalchemy2.shape import to_shape
 from sqlalchemy.sql import text
+from geoportailv3_geoportal.lib import address_autocomplete, \
+    address_parser, geocoding_index, parcel_lookup, reverse_geocoder
+from geoportailv3_geoportal.lib.address_parser import replace_words, \
+    split_street_and_house_number, strip_accents
+from geoportailv3_geoportal.lib.projections import transform_coordinates
 
 import urllib.request
 import re
 import difflib
 
 import os
+import io
+import csv
 import json
 
 import logging
 log = logging.getLogger(__name__)
 
+# Maximum number of addresses of a batch
+GEOCODE_BATCH_MAX = int(os.environ.get('GEOCODE_BATCH_MAX', '10000'))
+# Maximum number of suggestions of the autocomplete
+AUTOCOMPLETE_MAX_LIMIT = 50
+
 
 class Geocode(object):
 
@@ -34,6 +46,13 @@ class Geocode(object):
         self.returnParcelInfo = False
         self.db_ecadastre = DBSessions['ecadastre']
         self.config = self.request.registry.settings
+        # Address points prefetched by (zip, house number) and by
+        # (locality, house number) for a batch
+        self.house_numbers = None
+        self.locality_house_numbers = None
+        # Streets prefetched by zip and by locality for a batch
+        self.zip_streets = None
+        self.locality_streets = None
 
     # View used to get an adress from a coordinate.
     @view_config(route_name="reverse_geocode", renderer="json")
@@ -44,33 +63,27 @@ class Geocode(object):
         lon = self.request.params.get('lon', None)
 
         if lat is not None and lon is not None:
-            pointgeom = self.transform_to_luref(lon, lat)
-            if pointgeom is not None:
-                easting = str(pointgeom.centroid.x)
-                northing = str(pointgeom.centroid.y)
+            try:
+                xs, ys = transform_coordinates(
+                    [float(lon)], [float(lat)], 'epsg:4326', 'epsg:2169')
+                easting = str(xs[0])
+                northing = str(ys[0])
+            except ValueError:
+                pass
         if easting is None or northing is None or\
            len(easting) == 0 or len(northing) == 0 or\
            re.match("^[-]?[0-9]*[.]{0,1}[0-9]*$", easting) is None or\
            re.match("^[-]?[0-9]*[.]{0,1}[0-9]*$", northing) is None:
             return HTTPBadRequest("Missing or invalid coordinates")
 
-        distcol = func.ST_distance(WKTElement('POINT(%(x)s %(y)s)' % {
-            "x": easting,
-            "y": northing
-        }, srid=2169), Address.geom)
-
         if os.environ.get('FAKE_REVERSE_GEOCODING') == '1':
             return json.loads('{"count": 1, "results": [{"id_caclr_street": "461", "distance": 33.7389366951768, "street": "Rue Jean-Pierre Brasseur", "postal_code": "1258", "id_caclr_bat": "21478", "geom": {"type": "Point", "coordinates": [76302.2077999998, 75334.6180995487]}, "locality": "Luxembourg", "number": "16"}]}')  # noqa
 
-        cnt = self.db_ecadastre.query(CommunesLimAdm.id). \
-            filter(func.ST_within(WKTElement('POINT(%(x)s %(y)s)' % {
-                "x": easting,
-                "y": northing
-            }, srid=2169), CommunesLimAdm.geom)
-        ).all()
+        found = reverse_geocoder.get_reverse_geocoder().reverse(
+            float(easting), float(northing))
         results = []
         # Check if point is inside luxembourg or not
-        if len(cnt) == 0:
+        if found is None:
             if lat is None and lon is None:
                 pointgeom = self.transform_to_latlon(easting, northing)
                 lon = pointgeom.centroid.x
@@ -116,49 +129,96 @@ class Geocode(object):
                 else:
                     log.error("No address found in reverse geocode service %s: %s "% (request_url, str(res)))
         else:
-            distcol = func.ST_distance(WKTElement('POINT(%(x)s %(y)s)' % {
-                "x": easting,
-                "y": northing
-            }, srid=2169), Address.geom)
-
-            for feature in self.db_ecadastre.query(
-                    Address.id_caclr_loca.label("id_caclr_loca"),
-                    Address.id_caclr_rue.label("id_caclr_rue"),
-                    Address.id_caclr_bat.label("id_caclr_bat"),
-                    Address.rue.label("rue"),
-                    Address.numero.label("numero"),
-                    Address.localite.label("localite"),
-                    Address.code_postal.label("code_postal"),
-                    Address.geom.label("geometry"),
-                    func.ST_AsGeoJSON(Address.geom).label("geom"),
-                    func.ST_AsGeoJSON((func.ST_Transform(Address.geom, 4326))).
-                    label("geomlonlat"),
-                    distcol.label("distance")).order_by(distcol).limit(1):
-                shapely_geom = to_shape(feature.geometry)
-                communes = self.db_ecadastre.query(CommunesLimAdm). \
-                        filter(func.ST_within(WKTElement('POINT(%(x)s %(y)s)' % {
-                            "x": shapely_geom.x,
-                            "y": shapely_geom.y
-                        }, srid=2169), CommunesLimAdm.geom)
-                    ).first()
-                results.append({"id_caclr_locality": feature.id_caclr_loca,
-                                "id_caclr_street": feature.id_caclr_rue,
-                                "id_caclr_bat": feature.id_caclr_bat,
-                                "street": feature.rue,
-                                "number": feature.numero,
-                                "locality": feature.localite,
-                                "commune": communes.commune,
-                                "postal_code": feature.code_postal,
-                                "country": "Luxembourg",
-                                "country_code": "lu",
-                                "distance": feature.distance,
-                                "contributor": "ACT",
-                                "geom": geojson_loads(feature.geom),
-                                "geomlonlat": geojson_loads(feature.geomlonlat)
-                                })
+            results.append(self.encode_reverse_result(*found))
 
         return {'count': len(results), 'results': results}
 
+    def encode_reverse_result(self, address, distance, commune):
+        return {"id_caclr_locality": address.id_caclr_loca,
+                "id_caclr_street": address.id_caclr_rue,
+                "id_caclr_bat": address.id_caclr_bat,
+                "street": address.rue,
+                "number": address.numero,
+                "locality": address.localite,
+                "commune": commune.commune if commune is not None else None,
+                "postal_code": address.code_postal,
+                "country": "Luxembourg",
+                "country_code": "lu",
+                "distance": distance,
+                "contributor": "ACT",
+                "geom": {"type": "Point",
+                         "coordinates": [address.x, address.y]},
+                "geomlonlat": {"type": "Point",
+                               "coordinates": [address.lon, address.lat]}
+                }
+
+    # View used to get the addresses of many coordinates, the body is a JSON
+    # list of {"easting", "northing"} or {"lon", "lat"} objects. The points
+    # outside of the country have no result.
+    @view_config(route_name="reverse_geocode_batch", renderer="json")
+    def reverse_batch(self):
+        try:
+            points = self.request.json_body
+            if isinstance(points, dict):
+                points = points.get('points', [])
+            coordinates = [
+                (float(point['lon']), float(point['lat'])) if 'lon' in point
+                else (float(point['easting']), float(point['northing']))
+                for point in points]
+        except Exception as e:
+            log.exception(e)
+            return HTTPBadRequest("Missing or invalid coordinates")
+        if len(coordinates) > GEOCODE_BATCH_MAX:
+            return HTTPBadRequest(
+                "Too many points, the maximum is %d" % GEOCODE_BATCH_MAX)
+
+        lonlat = [index for index, point in enumerate(points) if 'lon' in point]
+        if len(lonlat) > 0:
+            xs, ys = transform_coordinates(
+                [coordinates[index][0] for index in lonlat],
+                [coordinates[index][1] for index in lonlat],
+                'epsg:4326', 'epsg:2169')
+            for index, x, y in zip(lonlat, xs, ys):
+                coordinates[index] = (x, y)
+
+        results = []
+        for found in reverse_geocoder.get_reverse_geocoder().reverse_many(
+                coordinates):
+            if found is None:
+                results.append({'count': 0, 'results': []})
+            else:
+                results.append({
+                    'count': 1,
+                    'results': [self.encode_reverse_result(*found)]})
+        return {'count': len(results), 'results': results}
+
+    # View used to suggest the streets, well known POI and addresses
+    # starting with the typed text.
+    @view_config(route_name="geocode_autocomplete", renderer="json")
+    def autocomplete(self):
+        query = self.request.params.get('query', None)
+        if query is None or len(query.strip()) == 0:
+            return HTTPBadRequest("Missing query parameter")
+        try:
+            limit = max(1, min(int(self.request.params.get('limit', 10)),
+                               AUTOCOMPLETE_MAX_LIMIT))
+        except ValueError:
+            return HTTPBadRequest("Invalid limit parameter")
+
+        results = []
+        for suggestion in address_autocomplete.get_autocomplete_index().\
+                complete(query, limit):
+            results.append({
+                'type': address_autocomplete.KINDS[suggestion.kind],
+                'label': suggestion.label,
+                'number': suggestion.num,
+                'street': suggestion.street,
+                'postal_code': suggestion.zip,
+                'locality': suggestion.locality,
+                'easting': suggestion.x,
+                'northing': suggestion.y})
+        return {'count': len(results), 'results': results}
+
     # View used to get an address from a cadastral number (parcel ID).
     @view_config(route_name="get_address_by_parcel", renderer="json")
     def get_address_by_parcel(self):
@@ -170,52 +230,51 @@ class Geocode(object):
         results = []
 
         try:
-            # Query addresses by cadastral number
-            for feature in self.db_ecadastre.query(
-                    Address.id_caclr_loca.label("id_caclr_loca"),
-                    Address.id_caclr_rue.label("id_caclr_rue"),
-                    Address.id_caclr_bat.label("id_caclr_bat"),
-                    Address.rue.label("rue"),
-                    Address.numero.label("numero"),
-                    Address.localite.label("localite"),
-                    Address.code_postal.label("code_postal"),
-                    Address.cle_parcelle.label("cle_parcelle"),
-                    Address.geom.label("geometry"),
-                    func.ST_AsGeoJSON(Address.geom).label("geom"),
-                    func.ST_AsGeoJSON((func.ST_Transform(Address.geom, 4326))).
-                    label("geomlonlat")).filter(Address.cle_parcelle == parcel_id):
-                
-                shapely_geom = to_shape(feature.geometry)
-                communes = self.db_ecadastre.query(CommunesLimAdm). \
-                        filter(func.ST_within(WKTElement('POINT(%(x)s %(y)s)' % {
-                            "x": shapely_geom.x,
-                            "y": shapely_geom.y
-                        }, srid=2169), CommunesLimAdm.geom)
-                    ).first()
-                
-                results.append({"id_caclr_locality": feature.id_caclr_loca,
-                                "id_caclr_street": feature.id_caclr_rue,
-                                "id_caclr_bat": feature.id_caclr_bat,
-                                "street": feature.rue,
-                                "number": feature.numero,
-                                "locality": feature.localite,
-                                "commune": communes.commune if communes else None,
-                                "postal_code": feature.code_postal,
-                                "country": "Luxembourg",
-                                "country_code": "lu",
-                                "distance": 0,
-                                "contributor": "ACT",
-                                "parcel_id": feature.cle_parcelle,
-                                "geom": geojson_loads(feature.geom),
-                                "geomlonlat": geojson_loads(feature.geomlonlat)
-                                })
-
+            results = parcel_lookup.get_addresses(
+                self.db_ecadastre, [parcel_id])[parcel_id]
         except Exception as e:
             log.exception(e)
+            self.db_ecadastre.rollback()
             return HTTPBadRequest("Error querying address by parcel_id: " + str(e))
 
         return {'count': len(results), 'results': results}
 
+    # View used to get the addresses of many cadastral numbers, from a JSON
+    # list or from the comma separated parcel_ids parameter.
+    @view_config(route_name="get_address_by_parcels", renderer="json")
+    def get_address_by_parcels(self):
+        parcel_ids = self.request.params.get('parcel_ids', None)
+        if parcel_ids is not None:
+            parcel_ids = [parcel_id.strip() for parcel_id in
+                          parcel_ids.split(',') if len(parcel_id.strip()) > 0]
+        elif self.request.method == 'POST':
+            try:
+                parcel_ids = [str(parcel_id) for parcel_id in
+                              self.request.json_body]
+            except Exception as e:
+                log.exception(e)
+                return HTTPBadRequest("Invalid parcel ids, a JSON list is expected")
+
+        if parcel_ids is None or len(parcel_ids) == 0:
+            return HTTPBadRequest("Missing parcel_ids parameter")
+        if len(parcel_ids) > GEOCODE_BATCH_MAX:
+            return HTTPBadRequest(
+                "Too many parcels, the maximum is %d" % GEOCODE_BATCH_MAX)
+
+        try:
+            addresses = parcel_lookup.get_addresses(
+                self.db_ecadastre, parcel_ids)
+        except Exception as e:
+            log.exception(e)
+            self.db_ecadastre.rollback()
+            return HTTPBadRequest("Error querying address by parcel_ids: " + str(e))
+
+        results = [{'parcel_id': parcel_id,
+                    'count': len(addresses[parcel_id]),
+                    'results': addresses[parcel_id]}
+                   for parcel_id in parcel_ids]
+        return {'count': len(results), 'results': results}
+
     def get_formatted_address(self, p_num, p_street, p_locality, p_zip):
         num = p_num
         if num is None:
@@ -228,103 +287,9 @@ class Geocode(object):
             p_zip = ""
         return "{} , {} {} {}".format(num, p_street, p_locality, p_zip)
 
-    def replace_words(self, p_string):
-        if p_string is None:
-            return None
-
-        p_string = p_string .replace("-", " ").strip()
-        p_string = p_string .replace(".", " ").strip()
-        p_string = p_string .replace(",", " ").strip()
-        p_string = p_string .replace(";", " ").strip()
-        p_string = p_string .replace(": ", " ").strip()
-
-        abbreviations = {u"p\.": u"place",
-                         u"pl": u"place",
-                         u"av": u"avenue",
-                         u"bd": u"boulevard",
-                         u"bvd": u"boulevard",
-                         u"bld": u"boulevard",
-                         u"zi": u"zone industrielle",
-                         u"z i": u"zone industrielle",
-                         u"z a c": u"zone activité",
-                         u"zac": u"zone activité",
-                         u"z a e": u"zone activité",
-                         u"zone activité commerciale": u"zone activité",
-                         u"zae": u"zone activité",
-                         u"ctre": u"zone centre",
-                         u"r": u"rue",
-                         u"rte": u"route",
-                         u"r\.": u"rue",
-                         u"rt": u"route",
-                         u"ob": u"",
-                         u"de": u"",
-                         u"des": u"",
-                         u"du": u"",
-                         u"le": u"",
-                         u"la": u"",
-                         u"les": u"",
-                         u"op": u"",
-                         u"um": u"",
-                         u"an": u"",
-                         u"imp": u"",
-                         u"imp.": u"",
-                         u"chat": u"chateau",
-                         u"zone industrielle": u"",
-                         u"ch": u"",
-                         u"a": u"",
-                         u"d": u"",
-                         u"l": u"",
-                         u"'": u" ",
-                         u"1er": u"",
-                         u"1 er": u"",
-                         u"I er": u"",
-                         u"ier": u"",
-                         u"er": u"",
-                         u"premier": u"1",
-                         u"ste": u"sainte",
-                         u"i": u"1",
-                         u"un": u"1",
-                         u"ii": u"2",
-                         u"deux": u"2",
-                         u"iii": u"3",
-                         u"trois": u"3",
-                         u"X": u"10",
-                         u"XX": u"20",
-                         u"eme": u"",
-                         u"ème": u"",
-                         u"2eme": u"2",
-                         u"2ème": u"2",
-                         u"st": u"",
-                         u"1st": u"1",
-                         u"nd": u"",
-                         u"2nd": u"2"
-                         }
-
-        for abbrev in abbreviations:
-            p_string = re.sub(
-                r'\b%s\b' % abbrev, abbreviations[abbrev], p_string)
-
-        p_string = re.sub(r'\([^)]*\)', '', p_string)
-
-        p_string = p_string.replace(u"'", u" ")
-        return p_string
-
     # Returns the zip code corresponding to the locality
     def get_zips_code_from_locality(self, locality, p_session):
-        zips = []
-        for feature in p_session.query(Address.code_postal, Address.localite).\
-                filter(text("code_postal is not null")).\
-                group_by(Address.code_postal, Address.localite):
-            ratio = difflib.SequenceMatcher(
-                None, self.supprime_accent(locality.strip().lower()),
-                re.sub(r'\([^)]*\)', '',
-                       self.supprime_accent(feature.localite)).
-                strip().lower()).ratio()
-
-            if ratio > 0.80:
-                zips.append(str(feature.code_postal).strip())
-
-        return zips
+        return geocoding_index.get_index().get_zips(locality)
 
     def encoded_locality_result(self, locality):
         locality_info = self.get_best_locality_name(
@@ -333,18 +298,10 @@ class Geocode(object):
             if locality_info['locality'] is None:
                 locality_info['locality'] = ""
             if locality_info['geom'] is None:
-                features = self.db_ecadastre.query((func.ST_AsText(
-                    func.ST_Centroid(
-                        func.ST_Collect(Address.geom)))).label("geom"),
-                            Address.localite).filter(text(
-                            " lower(localite) = lower(:locality)").bindparams(locality=locality)).\
-                            group_by(Address.localite).all()
-                for feature in features:
-                    locality_info.locality = feature.localite
-                    if isinstance(feature.geom, str):
-                        locality_info['geom'] = loads(feature.geom)
-                        if isinstance(feature.geom, WKBElement):
-                            locality_info['geom'] = to_shape(feature.geom)
+                entry = geocoding_index.get_index().get_locality(locality)
+                if entry is not None:
+                    locality_info['locality'] = entry.label
+                    locality_info['geom'] = entry.geom
 
         if locality_info is not None and locality_info['geom'] is not None\
            and locality_info['geom'].centroid is not None and\
@@ -375,21 +332,12 @@ class Geocode(object):
         return self.encoded_country_result()
 
     def encoded_post_code_result(self, p_zip):
-        features = self.db_ecadastre.query(
-            (func.ST_AsText(func.ST_Centroid(func.ST_Collect(Address.geom)))).
-            label("geom"),
-            Address.localite).\
-            filter(text(" lower(code_postal) = lower(:p_zip)").bindparams(p_zip=p_zip)).\
-            group_by(Address.localite).all()
         res = Address()
-        for feature in features:
-            res.localite = feature.localite
+        for localite, geom in geocoding_index.get_index().get_zip_centroids(p_zip):
+            res.localite = localite
             if res.localite is not None:
                 res.localite = res.localite.strip()
-            if isinstance(feature.geom, str):
-                res.geom = loads(feature.geom)
-            if isinstance(feature.geom, WKBElement):
-                res.geom = to_shape(feature.geom)
+            res.geom = geom
 
         if res is not None and res.geom is not None and\
            res.geom.centroid is not None:
@@ -416,35 +364,19 @@ class Geocode(object):
         return self.encoded_country_result()
 
     def encoded_post_code_locality_result(self, p_zip, p_locality):
-        features = self.db_ecadastre.query(
-            (func.ST_AsText(func.ST_Centroid(func.ST_Collect(Address.geom)))).
-            label("geom"), Address.localite).\
-            filter(text(" lower(code_postal) = lower(:p_zip)").bindparams(p_zip=p_zip)).\
-            group_by(Address.localite)
-
+        index = geocoding_index.get_index()
         res = Address()
-        for feature in features.all():
-            res.localite = feature.localite
-            if isinstance(feature.geom, str):
-                res.geom = loads(feature.geom)
-            if isinstance(feature.geom, WKBElement):
-                res.geom = to_shape(feature.geom)
+        for localite, geom in index.get_zip_centroids(p_zip):
+            res.localite = localite
+            res.geom = geom
 
         if res.localite is None:
             res.localite = ''
-            features = self.db_ecadastre.query(
-                (func.ST_AsText(func.ST_Centroid(
-                    func.ST_Collect(Address.geom)))).
-                label("geom"), Address.localite).\
-                filter(text(" lower(localite) = lower(:p_locality)").bindparams(p_locality=p_locality)).\
-                group_by(Address.localite)
-            for feature in features.all():
-                res.localite = feature.localite
+            entry = index.get_locality(p_locality)
+            if entry is not None:
+                res.localite = entry.label
                 p_zip = ""
-                if isinstance(feature.geom, str):
-                    res.geom = loads(feature.geom)
-                if isinstance(feature.geom, WKBElement):
-                    res.geom = to_shape(feature.geom)
+                res.geom = entry.geom
 
         if res.localite is not None:
             res.localite = res.localite.strip()
@@ -552,44 +484,32 @@ class Geocode(object):
             "id_caclr_locality": str(caclr_loca)
         }}
         if hasattr(feature, 'cle_parcelle') and self.returnParcelInfo is True:
-            label = self.db_ecadastre.query(
-                Parcel).get(feature.cle_parcelle)
+            labels = parcel_lookup.get_labels(
+                self.db_ecadastre, [feature.cle_parcelle])
 
             resp['parcel'] = {
                 'key': feature.cle_parcelle,
-                'label': label.label
+                'label': labels[feature.cle_parcelle]
                 }
         return resp
 
+    # The points are transformed in memory, without a query by result
     def transform_to_latlon(self, x, y):
         try:
-            geomwgs = func.ST_AsText(func.ST_Centroid(func.ST_Transform(
-                WKTElement(
-                    'POINT(%(x)s %(y)s)' % {"x": x, "y": y}, 2169), 4326)))
-            result = self.db_ecadastre.query(geomwgs.label(
-                "geom"), WKPOI.geom.label("geom2")).first()
-            geom = result.geom
-            if isinstance(geom, str):
-                geom = loads(geom)
-            return geom
+            lons, lats = transform_coordinates(
+                [float(x)], [float(y)], 'epsg:2169', 'epsg:4326')
+            return Point(lons[0], lats[0])
         except Exception as e:
             log.exception(e)
         return None
 
     def transform_to_luref(self, lon, lat):
         try:
-            geomwgs = func.ST_AsText(func.ST_Centroid(func.ST_Transform(
-                WKTElement(
-                    'POINT(%(x)s %(y)s)' % {"x": lon, "y": lat}, 4326), 2169)))
-            result = self.db_ecadastre.query(geomwgs.label(
-                "geom"), WKPOI.geom.label("geom2")).first()
-            geom = result.geom
-            if isinstance(geom, str):
-                geom = loads(geom)
-            return geom
+            xs, ys = transform_coordinates(
+                [float(lon)], [float(lat)], 'epsg:4326', 'epsg:2169')
+            return Point(xs[0], ys[0])
         except Exception as e:
             log.error(e)
-            self.db_ecadastre.rollback()
         return None
 
     # Returns true if zip code exists in database
@@ -602,8 +522,7 @@ class Geocode(object):
         except:
             pass
 
-        return p_session.query(Address).\
-            filter(Address.code_postal == p_zip).count() > 0
+        return geocoding_index.get_index().has_zip(p_zip)
 
     # Returns the best matching loçcality name.
     # For instance Esch/Alzette should return Esch sur Alzette
@@ -611,91 +530,28 @@ class Geocode(object):
         if p_locality is None:
             return None
 
-        is_neighbourhood = False
         p_locality = p_locality.replace(" sur ", "-sur-")
         p_locality = p_locality.replace("/", "-sur-")
-        best_locality_name = None
-        best_locality_geom = None
-        best_locality_ratio = 0
-
-        for feature in p_session.query((func.ST_AsText(func.ST_Centroid(
-                func.ST_Collect(Address.geom)))).label("geom"),
-                Address.localite).group_by(Address.localite).all():
-            ratio = difflib.SequenceMatcher(
-                None,
-                self.supprime_accent(p_locality.strip().lower()),
-                re.sub(
-                    r'\([^)]*\)', '',
-                    self.supprime_accent(feature.localite)).
-                strip().lower()).ratio()
-
-            if ratio > best_locality_ratio:
-                best_locality_ratio = ratio
-                best_locality_name = feature.localite.strip().lower()
-                best_locality_geom = feature.geom
-
-        if best_locality_ratio != 1:
-            for feature in p_session.query(
-                    (func.ST_AsText(func.ST_Centroid(Neighbourhood.geom))).
-                    label("geom"),
-                    Neighbourhood.id,
-                    Neighbourhood.locality,
-                    Neighbourhood.name).all():
-                name = feature.name.strip().lower()
-                name = name.replace("-", " ")
-
-                ratio = difflib.SequenceMatcher(
-                    None,
-                    self.supprime_accent(p_locality.strip().lower()),
-                    self.supprime_accent(name)).ratio()
-                if ratio > best_locality_ratio:
-                    best_locality_ratio = ratio
-                    best_locality_name = feature.locality.strip().lower()
-                    best_locality_geom = feature.geom
-                    is_neighbourhood = True
-
-        if best_locality_name is None:
+
+        # The localities and neighbourhoods are compared in memory,
+        # see lib/geocoding_index.py
+        index = geocoding_index.get_index()
+        match = index.best_locality(p_locality)
+        if match is None:
             return None
-        best_locality_name = best_locality_name.lower().strip()
-        best_locality_name = self.supprime_accent(best_locality_name)
+        best_locality_name = match.name.lower().strip()
+        best_locality_name = strip_accents(best_locality_name)
+        best_locality_geom = match.geom
 
         if "luxembourg" in best_locality_name:
             best_locality_name = "luxembourg"
 
-        if isinstance(best_locality_geom, str):
-            best_locality_geom = loads(best_locality_geom)
-        if isinstance(best_locality_geom, WKBElement):
-            best_locality_geom = to_shape(best_locality_geom)
         if get_geom:
-            if best_locality_geom is None and is_neighbourhood:
-                best_locality_ratio = 0
-
-                for feature in p_session.query(
-                     (func.ST_AsText(func.ST_Centroid(
-                        func.ST_Collect(Address.geom)))).label("geom"),
-                     Address.localite).filter(
-                         func.lower(Address.localite) ==
-                         best_locality_name.lower()).\
-                        group_by(Address.localite).all():
-
-                    ratio = difflib.SequenceMatcher(
-                        None,
-                        self.supprime_accent(
-                            best_locality_name.strip().lower()),
-                        re.sub(
-                            r'\([^)]*\)', '',
-                            self.supprime_accent(feature.localite)).strip().
-                        lower()).ratio()
-
-                    if ratio > best_locality_ratio:
-                        best_locality_ratio = ratio
-                        best_locality_geom = feature.geom
-                        best_locality_name = feature.localite.strip().lower()
-
-            if isinstance(best_locality_geom, str):
-                best_locality_geom = loads(best_locality_geom)
-            if isinstance(best_locality_geom, WKBElement):
-                best_locality_geom = to_shape(best_locality_geom)
+            if best_locality_geom is None and match.is_neighbourhood:
+                entry = index.get_locality(best_locality_name)
+                if entry is not None:
+                    best_locality_geom = entry.geom
+                    best_locality_name = entry.name
 
             return {'locality': best_locality_name, 'geom': best_locality_geom}
         else:
@@ -719,14 +575,14 @@ class Geocode(object):
     def search_for_street(self, features, search, ratio, p_debug=False):
         results = []
         if search is not None:
-            string1 = self.replace_words(
+            string1 = replace_words(
                 search.lower()).strip()
             mw1 = self.get_main_word(string1, True)
 
             for feature in features:
-                string2 = self.replace_words(self.supprime_accent(
+                string2 = replace_words(strip_accents(
                     feature.rue.lower()).strip())
-                mw2 = self.get_main_word(self.supprime_accent(string2))
+                mw2 = self.get_main_word(strip_accents(string2))
                 cur_ratio = difflib.SequenceMatcher(None, mw1, mw2).ratio()
 
                 if (cur_ratio > ratio):
@@ -736,18 +592,42 @@ class Geocode(object):
                     results.append(result)
         return results
 
+    def query_by_house_number(self, p_session, p_num, zips=None,
+                              locality=None):
+        """
+        Return the query of the address points with this house number, or
+        this number as part of their house number (12 in 12-14), with the
+        index of the geocoding.address_house_number table.
+        """
+        numbers = p_session.query(HouseNumber.gid).filter(
+            HouseNumber.numero_part == str(p_num).replace("'", "").lower())
+        if zips is not None:
+            numbers = numbers.filter(
+                HouseNumber.code_postal.in_([int(zip) for zip in zips]))
+        if locality is not None:
+            numbers = numbers.filter(HouseNumber.localite == locality)
+        return p_session.query(Address).filter(Address.id.in_(numbers))
+
+    def query_by_house_number_range(self, p_session, p_num, p_zip):
+        """
+        Return the query of the address points of the post code with a range
+        of house numbers containing the number.
+        """
+        numbers = p_session.query(HouseNumber.gid).filter(
+            HouseNumber.code_postal == int(p_zip),
+            HouseNumber.num_from <= p_num,
+            HouseNumber.num_to >= p_num,
+            HouseNumber.num_from < HouseNumber.num_to)
+        return p_session.query(Address).filter(Address.id.in_(numbers))
+
     def search_by_zips_and_house_number(
             self, p_ratio, p_num, p_street, p_locality, p_session):
         results = []
         # List of zip code belonging to the locality
         zips = self.get_zips_code_from_locality(p_locality, p_session)
         if len(zips) > 0:
-            features =\
-                p_session.query(Address).filter(text(
-                    " code_postal::integer  in (" + (",".join(zips)) +
-                    ") and lower('" + str(p_num).replace("'", "") +
-                    "') = ANY  (regexp_split_to_array (lower(numero), '-'))")).\
-                all()
+            features = self.query_by_house_number(
+                p_session, p_num, zips=zips).all()
 
             if len(features) > 0:
                 features = self.search_for_street(features, p_street, p_ratio)
@@ -768,10 +648,13 @@ class Geocode(object):
         results = []
         # List of zip code belonging to the locality
         if len(p_locality) > 0:
-            filter = " lower(localite) = '" + p_locality + \
-                "' and lower('" + str(p_num).replace("'", "") + \
-                "') = ANY  (regexp_split_to_array (lower(numero), '-'))"
-            features = p_session.query(Address).filter(text(filter)).all()
+            key = (p_locality, str(p_num).replace("'", "").lower())
+            if self.locality_house_numbers is not None and\
+               key in self.locality_house_numbers:
+                features = self.locality_house_numbers[key]
+            else:
+                features = self.query_by_house_number(
+                    p_session, p_num, locality=p_locality).all()
 
             if len(features) > 0:
                 features = self.search_for_street(features, p_street, p_ratio)
@@ -792,19 +675,17 @@ class Geocode(object):
         # List of zip code belonging to the locality
 
         if p_locality is not None and len(p_locality) > 0:
-            features = p_session.query(
-                (func.ST_AsText(func.ST_Centroid(func.ST_Collect(
-                    Address.geom)))).label("geom"),
-                Address.id_caclr_loca,
-                Address.id_caclr_rue, Address.rue,
-                Address.code_postal, Address.localite).filter(
-                text(" lower(localite) = lower(:p_locality)").bindparams(p_locality=p_locality)).\
-                group_by(
-                    Address.id_caclr_loca,
-                    Address.id_caclr_rue,
-                    Address.rue,
-                    Address.code_postal,
-                    Address.localite).order_by(Address.rue).all()
+            if self.locality_streets is not None and\
+               p_locality.lower() in self.locality_streets:
+                features = self.locality_streets[p_locality.lower()]
+            else:
+                features = p_session.query(
+                    func.ST_AsText(StreetAggregate.geom).label("geom"),
+                    StreetAggregate.id_caclr_loca,
+                    StreetAggregate.id_caclr_rue, StreetAggregate.rue,
+                    StreetAggregate.code_postal, StreetAggregate.localite).filter(
+                    text(" lower(localite) = lower(:p_locality)").bindparams(p_locality=p_locality)).\
+                    order_by(StreetAggregate.rue).all()
 
             if len(features) > 0:
                 features = self.search_for_street(
@@ -836,10 +717,10 @@ class Geocode(object):
                                 filter(text(" zip = " + p_zip)).all():
                             cur_ratio = difflib.SequenceMatcher(
                                 None,
-                                self.supprime_accent(
-                                    self.replace_words(
+                                strip_accents(
+                                    replace_words(
                                         feature.name).strip().lower()),
-                                self.replace_words(self.supprime_accent(p_street)).
+                                replace_words(strip_accents(p_street)).
                                 strip().lower()).ratio()
                             if (cur_ratio > p_ratio):
                                 result = {'ratio' : 0, 'accuracy': 0, 'feature': feature}
@@ -865,10 +746,10 @@ class Geocode(object):
                         all():
                     cur_ratio = difflib.SequenceMatcher(
                         None,
-                        self.supprime_accent(
-                            self.replace_words(feature.name).strip().lower()),
-                        self.replace_words(
-                            self.supprime_accent(p_street)).strip().lower()).\
+                        strip_accents(
+                            replace_words(feature.name).strip().lower()),
+                        replace_words(
+                            strip_accents(p_street)).strip().lower()).\
                         ratio()
                     if (cur_ratio > p_ratio):
                         result = {'ratio' : 0, 'accuracy': 0, 'feature': feature}
@@ -896,19 +777,13 @@ class Geocode(object):
         zips = self.get_zips_code_from_locality(p_locality, p_session)
         if len(zips) > 0:
             features = p_session.query(
-                (func.ST_AsText(func.ST_Centroid(
-                    func.ST_Collect(Address.geom)))).label("geom"),
-                Address.id_caclr_loca,
-                Address.id_caclr_rue, Address.rue,
-                Address.code_postal, Address.localite).\
+                func.ST_AsText(StreetAggregate.geom).label("geom"),
+                StreetAggregate.id_caclr_loca,
+                StreetAggregate.id_caclr_rue, StreetAggregate.rue,
+                StreetAggregate.code_postal, StreetAggregate.localite).\
                 filter(text(
                     " code_postal::integer  in (" + (",".join(zips)) + ")")).\
-                group_by(
-                    Address.id_caclr_loca,
-                    Address.id_caclr_rue,
-                    Address.rue,
-                    Address.code_postal,
-                    Address.localite).all()
+                all()
 
             if len(features) > 0:
                 features = self.search_for_street(features, p_street, p_ratio)
@@ -931,21 +806,18 @@ class Geocode(object):
         if p_zip is None:
             return results
 
-        features = p_session.query(
-            Address.id_caclr_loca,
-            Address.id_caclr_rue,
-            Address.rue,
-            Address.code_postal,
-            Address.localite,
-            (func.ST_AsText(func.ST_Centroid(func.ST_Collect(Address.geom)))).
-            label('geom')).\
-            filter(text(" code_postal::integer  = (" + str(p_zip) + ") ")).\
-            group_by(
-                Address.id_caclr_loca,
-                Address.id_caclr_rue,
-                Address.rue,
-                Address.code_postal,
-                Address.localite).all()
+        if self.zip_streets is not None and str(p_zip) in self.zip_streets:
+            features = self.zip_streets[str(p_zip)]
+        else:
+            features = p_session.query(
+                StreetAggregate.id_caclr_loca,
+                StreetAggregate.id_caclr_rue,
+                StreetAggregate.rue,
+                StreetAggregate.code_postal,
+                StreetAggregate.localite,
+                func.ST_AsText(StreetAggregate.geom).label('geom')).\
+                filter(text(" code_postal::integer  = (" + str(p_zip) + ") ")).\
+                all()
         if len(features) > 0:
             features = self.search_for_street(
                 features, p_street, p_ratio, True)
@@ -970,17 +842,10 @@ class Geocode(object):
         results = []
 
         features = p_session.query(
-            (func.ST_AsText(func.ST_Centroid(
-                func.ST_Collect(Address.geom)))).label('geom'),
-            Address.id_caclr_loca,
-            Address.id_caclr_rue, Address.rue,
-            Address.code_postal, Address.localite).\
-            group_by(
-                Address.id_caclr_loca,
-                Address.id_caclr_rue,
-                Address.rue,
-                Address.code_postal,
-                Address.localite).all()
+            func.ST_AsText(StreetAggregate.geom).label('geom'),
+            StreetAggregate.id_caclr_loca,
+            StreetAggregate.id_caclr_rue, StreetAggregate.rue,
+            StreetAggregate.code_postal, StreetAggregate.localite).all()
 
         if len(features) > 0:
             features = self.search_for_street(features, p_street, p_ratio)
@@ -997,9 +862,7 @@ class Geocode(object):
     def search_by_house_number(self, p_ratio, p_num, p_street, p_session):
         results = []
         if p_num is not None and len(p_num) > 0:
-            features = p_session.query(Address).filter(text(
-                " lower('" + str(p_num).replace("'", "") +
-                "') = ANY  (regexp_split_to_array (lower(numero), '-'))")).all()
+            features = self.query_by_house_number(p_session, p_num).all()
 
             if len(features) > 0:
                 features = self.search_for_street(features, p_street, p_ratio)
@@ -1020,11 +883,11 @@ class Geocode(object):
         except:
             return results
 
+        numbers = p_session.query(HouseNumber.gid).filter(
+            HouseNumber.code_postal == int(p_zip),
+            HouseNumber.numero == str(p_num).replace("'", "").lower())
         features = p_session.query(Address).\
-            filter(text(
-                " code_postal::integer  = (" + str(p_zip) +
-                ") and lower(numero) = (lower('" +
-                str(p_num).replace("'", "") + "'))")).all()
+            filter(Address.id.in_(numbers)).all()
 
         if len(features) > 0:
             # accuracy = 8   Address level accuracy.
@@ -1044,25 +907,31 @@ class Geocode(object):
         except:
             return results
 
-        features = p_session.query(Address).filter(text(
-            " code_postal::integer  = (" + str(p_zip) +
-            ") and lower('" + str(p_num).replace("'", "") +
-            "') = ANY  (regexp_split_to_array (lower(numero), '-'))")).all()
+        key = (p_zip, str(p_num).replace("'", "").lower())
+        if self.house_numbers is not None and key in self.house_numbers:
+            features = self.house_numbers[key]
+        else:
+            features = self.query_by_house_number(
+                p_session, p_num, zips=[p_zip]).all()
+        # The number may be inside a range of house numbers, 13 in 12-16
+        if len(features) == 0 and str(p_num).isdigit():
+            features = self.query_by_house_number_range(
+                p_session, int(p_num), p_zip).all()
 
         if len(features) > 0:
             for feature in features:
                 result = {'ratio' : 0, 'accuracy': 0, 'feature': feature}
                 cur_ratio = difflib.SequenceMatcher(
                     None,
-                    self.supprime_accent(
+                    strip_accents(
                         feature.rue.lower()),
-                    self.supprime_accent(p_street)).ratio()
+                    strip_accents(p_street)).ratio()
                 if cur_ratio > 0.7:
-                    mw1 = self.get_main_word(self.replace_words(
-                        self.supprime_accent(
+                    mw1 = self.get_main_word(replace_words(
+                        strip_accents(
                             feature.rue.lower())).strip(), True)
-                    mw2 = self.get_main_word(self.supprime_accent(
-                        self.replace_words(
+                    mw2 = self.get_main_word(strip_accents(
+                        replace_words(
                             p_street.strip())))
                     cur_ratio = difflib.SequenceMatcher(None, mw1, mw2).ratio()
                     result['ratio'] = cur_ratio
@@ -1107,8 +976,8 @@ class Geocode(object):
         for output in outputs:
             cur_ratio = difflib.SequenceMatcher(
                 None,
-                self.supprime_accent(p_street.strip().lower()),
-                self.supprime_accent(
+                strip_accents(p_street.strip().lower()),
+                strip_accents(
                     output['matching street']).strip().lower()).ratio()
 
             if (cur_ratio > ratio):
@@ -1121,19 +990,29 @@ class Geocode(object):
 
         return outputs2
 
-    def supprime_accent(self, ligne):
-        if ligne is None:
-            return None
-        """ supprime les accents du texte source """
-        accents = {u'a': [u'à', u'ã', u'á', u'â'],
-                   u'e': [u'é', u'è', u'ê', u'ë'],
-                   u'i': [u'î', u'ï'],
-                   u'u': [u'ù', u'ü', u'û'],
-                   u'o': [u'ô', u'ö']}
-        for (char, accented_chars) in accents.items():
-            for accented_char in accented_chars:
-                ligne = ligne.replace(accented_char, char)
-        return ligne
+    def normalize_zip(self, p_zip):
+        if p_zip is None:
+            p_zip = ""
+        try:
+            return str(int(float(re.sub("[^0-9]", "", p_zip))))
+        except:
+            return p_zip.replace("L", "").replace("-", "").replace(" ", "")
+
+    # If the number has many components, (ex: 7 à 17 or 7-17)
+    # Then only use the first one
+    def split_house_number(self, p_num):
+        nums = None
+        if p_num.find(u"à") >= 0:
+            nums = p_num.split(u"à")
+            p_num = (nums[0])
+        if p_num.find("-") >= 0:
+            nums = p_num.split("-")
+            p_num = (nums[0])
+        if p_num.find("/") >= 0:
+            nums = p_num.split("/")
+            p_num = (nums[0])
+
+        return p_num.replace(" ", ""), nums
 
     def start_search(
             self, p_ratio, p_num, p_street, p_zip, p_locality,
@@ -1143,32 +1022,14 @@ class Geocode(object):
         if p_street is not None:
             p_street = p_street.lower()
 
-        p_street = self.supprime_accent(p_street)
+        p_street = strip_accents(p_street)
 
-        if p_zip is None:
-            p_zip = ""
-        try:
-            p_zip = str(int(float(re.sub("[^0-9]", "", p_zip))))
-        except:
-            p_zip = p_zip.replace("L", "").replace("-", "").replace(" ", "")
+        p_zip = self.normalize_zip(p_zip)
 
         zip_exist = self.is_zip_code_exists(p_zip, p_session)
 
         if p_num is not None and len(p_num) > 0:
-            # If the number has many components, (ex: 7 à 17 or 7-17)i
-            # Then only use the first one
-            nums = None
-            if p_num.find(u"à") >= 0:
-                nums = p_num.split(u"à")
-                p_num = (nums[0])
-            if p_num.find("-") >= 0:
-                nums = p_num.split("-")
-                p_num = (nums[0])
-            if p_num.find("/") >= 0:
-                nums = p_num.split("/")
-                p_num = (nums[0])
-
-            p_num = p_num.replace(" ", "")
+            p_num, nums = self.split_house_number(p_num)
 
             # Accuracy expected address level
             if zip_exist and p_zip is not None and len(p_zip) > 0:
@@ -1276,27 +1137,8 @@ class Geocode(object):
                     lower().strip()
                 p_num = self.request.params.get('num', '').lower().strip()
 
-            results = self.start_search(
-                0.7, p_num, p_street, p_zip, p_locality, p_country,
-                self.db_ecadastre)
-            results = self.keep_the_best_result(results, p_street)
-
-            if results is not None and p_zip is not None and\
-               p_locality is not None and len(results) == 0 and\
-               len(p_zip) > 0 and len(p_locality) > 0:
-                results.append(
-                    self.encoded_post_code_locality_result(p_zip, p_locality))
-
-            if results is not None and p_zip is not None and\
-               len(results) == 0 and len(p_zip) > 0:
-                results.append(self.encoded_post_code_result(p_zip))
-
-            if results is not None and p_locality is not None and\
-               len(results) == 0 and len(p_locality) > 0:
-                results.append(self.encoded_locality_result(p_locality))
-
-            if results is not None and len(results) == 0:
-                results.append(self.encoded_country_result())
+            results = self.geocode_address(
+                p_num, p_street, p_zip, p_locality, p_country)
 
         except Exception as e:
             log.exception(e)
@@ -1345,6 +1187,240 @@ class Geocode(object):
                         'num': p_num
                         }, 'results': results}) + ');', headers=headers)
 
+    def geocode_address(self, p_num, p_street, p_zip, p_locality, p_country):
+        results = self.start_search(
+            0.7, p_num, p_street, p_zip, p_locality, p_country,
+            self.db_ecadastre)
+        results = self.keep_the_best_result(results, p_street)
+
+        if results is not None and p_zip is not None and\
+           p_locality is not None and len(results) == 0 and\
+           len(p_zip) > 0 and len(p_locality) > 0:
+            results.append(
+                self.encoded_post_code_locality_result(p_zip, p_locality))
+
+        if results is not None and p_zip is not None and\
+           len(results) == 0 and len(p_zip) > 0:
+            results.append(self.encoded_post_code_result(p_zip))
+
+        if results is not None and p_locality is not None and\
+           len(results) == 0 and len(p_locality) > 0:
+            results.append(self.encoded_locality_result(p_locality))
+
+        if results is not None and len(results) == 0:
+            results.append(self.encoded_country_result())
+
+        return results
+
+    def parse_batch_item(self, item):
+        """
+        Return the id and the parsed address of an item of a batch, the item
+        is a full address or a dict with either an address or the zip,
+        locality, street and num fields.
+        """
+        item_id = None
+        if isinstance(item, dict):
+            item_id = item.get('id')
+            address = item.get('address', item.get('queryString'))
+        else:
+            address = item
+        if address is not None:
+            res = self._split_address(str(address))
+            return item_id, address, (
+                res['num'], res['street'], res['zip'], res['locality'], 'lu')
+        p_zip = str(item.get('zip') or '').lower().\
+            strip().replace("l", "").replace(" ", "").replace("-", "")
+        p_locality = str(item.get('locality') or '').lower().strip()
+        p_country = str(item.get('country') or 'lu').lower().strip()
+        p_street = str(item.get('street') or '').lower().strip()
+        p_num = str(item.get('num') or '').lower().strip()
+        request = {'zip': p_zip, 'locality': p_locality, 'country': p_country,
+                   'street': p_street, 'num': p_num}
+        return item_id, request, (p_num, p_street, p_zip, p_locality, p_country)
+
+    def prefetch_house_numbers(self, addresses, p_session):
+        """
+        Load with one query by kind the address points of all the (zip,
+        house number) and (locality, house number) of a batch, the searches
+        by house number then read them instead of querying each address.
+        """
+        keys = set()
+        locality_keys = set()
+        for p_num, p_street, p_zip, p_locality, p_country in addresses:
+            if p_num is None or len(p_num) == 0:
+                continue
+            p_num, nums = self.split_house_number(p_num)
+            p_num = p_num.replace("'", "").lower()
+            p_zip = self.normalize_zip(p_zip)
+            if p_zip.isdigit():
+                keys.add((p_zip, p_num))
+            p_locality = self.get_best_locality_name(p_locality, p_session)
+            if p_locality is not None and len(p_locality) > 0:
+                locality_keys.add((p_locality, p_num))
+        self.house_numbers = {key: [] for key in keys}
+        self.locality_house_numbers = {key: [] for key in locality_keys}
+        if len(keys) > 0:
+            rows = p_session.query(
+                Address, HouseNumber.code_postal, HouseNumber.numero_part).\
+                join(HouseNumber, HouseNumber.gid == Address.id).filter(
+                    HouseNumber.code_postal.in_({int(key[0]) for key in keys}),
+                    HouseNumber.numero_part.in_({key[1] for key in keys})).all()
+            for feature, code_postal, numero_part in rows:
+                features = self.house_numbers.get(
+                    (str(code_postal), numero_part))
+                # 12-12 gives the part 12 twice
+                if features is not None and feature not in features:
+                    features.append(feature)
+        if len(locality_keys) > 0:
+            rows = p_session.query(
+                Address, HouseNumber.localite, HouseNumber.numero_part).\
+                join(HouseNumber, HouseNumber.gid == Address.id).filter(
+                    HouseNumber.localite.in_({key[0] for key in locality_keys}),
+                    HouseNumber.numero_part.in_(
+                        {key[1] for key in locality_keys})).all()
+            for feature, localite, numero_part in rows:
+                features = self.locality_house_numbers.get(
+                    (localite, numero_part))
+                if features is not None and feature not in features:
+                    features.append(feature)
+
+    def prefetch_streets(self, addresses, p_session):
+        """
+        Load with one query by kind the streets of all the zips and
+        localities of a batch, search_by_zip and search_by_locality then
+        read them instead of querying each address.
+        """
+        zips = set()
+        localities = set()
+        for p_num, p_street, p_zip, p_locality, p_country in addresses:
+            p_zip = self.normalize_zip(p_zip)
+            if p_zip.isdigit() and self.is_zip_code_exists(p_zip, p_session):
+                zips.add(p_zip)
+            p_locality = self.get_best_locality_name(p_locality, p_session)
+            if p_locality is not None and len(p_locality) > 0:
+                localities.add(p_locality.lower())
+        self.zip_streets = {p_zip: [] for p_zip in zips}
+        self.locality_streets = {p_locality: [] for p_locality in localities}
+        columns = (
+            StreetAggregate.id_caclr_loca,
+            StreetAggregate.id_caclr_rue,
+            StreetAggregate.rue,
+            StreetAggregate.code_postal,
+            StreetAggregate.localite,
+            func.ST_AsText(StreetAggregate.geom).label('geom'))
+        if len(zips) > 0:
+            features = p_session.query(*columns).filter(text(
+                " code_postal::integer  in (" + (",".join(sorted(zips))) +
+                ")")).all()
+            for feature in features:
+                self.zip_streets[str(int(feature.code_postal))].append(feature)
+        if len(localities) > 0:
+            features = p_session.query(*columns).filter(
+                func.lower(StreetAggregate.localite).in_(localities)).\
+                order_by(StreetAggregate.rue).all()
+            for feature in features:
+                streets = self.locality_streets.get(feature.localite.lower())
+                if streets is not None:
+                    streets.append(feature)
+
+    def read_batch(self):
+        """
+        Return the items of the batch, from a JSON list (or an object with an
+        addresses list) or from a CSV with a header.
+        """
+        if 'csv' in (self.request.content_type or ''):
+            reader = csv.DictReader(io.StringIO(self.request.text))
+            return [dict(row) for row in reader]
+        body = self.request.json_body
+        if isinstance(body, dict):
+            body = body.get('addresses', [])
+        return body
+
+    # View used to geocode many addresses in one request, the whole batch is
+    # geocoded before the response, then written as one JSON object (or CSV
+    # row) by address.
+    @view_config(route_name="geocode_batch")
+    def batch(self):
+        try:
+            items = self.read_batch()
+        except Exception as e:
+            log.exception(e)
+            return HTTPBadRequest("Invalid batch, a JSON list or a CSV is expected")
+        if not isinstance(items, list):
+            return HTTPBadRequest("Invalid batch, a JSON list or a CSV is expected")
+        if len(items) > GEOCODE_BATCH_MAX:
+            return HTTPBadRequest(
+                "Too many addresses, the maximum is %d" % GEOCODE_BATCH_MAX)
+
+        parsed = [self.parse_batch_item(item) for item in items]
+        self.returnParcelInfo = (
+            self.request.params.get('returnParcelInfo', 'False').lower() ==
+            'true')
+        unique_addresses = list(dict.fromkeys(
+            address for item_id, request, address in parsed))
+        self.prefetch_house_numbers(unique_addresses, self.db_ecadastre)
+        self.prefetch_streets(unique_addresses, self.db_ecadastre)
+
+        # The addresses are geocoded here, inside the transaction of the
+        # request, the size of the batch is bounded by GEOCODE_BATCH_MAX.
+        geocoded = list(self._geocode_batch(parsed))
+        if self.request.params.get('format', 'json').lower() == 'csv':
+            return Response(
+                app_iter=self._iter_batch_csv(geocoded),
+                headers={'Content-Type': 'text/csv; charset=utf-8'})
+        return Response(
+            app_iter=self._iter_batch_json(geocoded),
+            headers={'Content-Type': 'application/x-ndjson; charset=utf-8'})
+
+    def _geocode_batch(self, parsed):
+        # The duplicated addresses are only geocoded once
+        done = {}
+        for index, (item_id, request, address) in enumerate(parsed):
+            if address not in done:
+                try:
+                    results = self.geocode_address(*address)
+                    if len(results) == 1 and results[0]['accuracy'] == 1:
+                        status = 'not_found'
+                    else:
+                        status = 'ok'
+                except Exception as e:
+                    log.exception(e)
+                    self.db_ecadastre.rollback()
+                    results = [self.encoded_country_result()]
+                    status = 'error'
+                done[address] = (status, results)
+            status, results = done[address]
+            yield index, item_id, request, status, results
+
+    def _iter_batch_json(self, geocoded):
+        for index, item_id, request, status, results in geocoded:
+            yield (geojson_dumps({
+                'index': index,
+                'id': item_id,
+                'request': request,
+                'status': status,
+                'count': len(results),
+                'results': results}) + '\n').encode('utf-8')
+
+    def _iter_batch_csv(self, geocoded):
+        columns = ['index', 'id', 'status', 'address', 'accuracy', 'ratio',
+                   'easting', 'northing', 'postnumber', 'street', 'zip',
+                   'locality']
+        output = io.StringIO()
+        writer = csv.writer(output)
+        writer.writerow(columns)
+        for index, item_id, request, status, results in geocoded:
+            result = results[0]
+            details = result['AddressDetails']
+            writer.writerow([
+                index, item_id, status, result['address'], result['accuracy'],
+                result['ratio'], result.get('easting'), result.get('northing'),
+                details['postnumber'], details['street'], details['zip'],
+                details['locality']])
+            yield output.getvalue().encode('utf-8')
+            output.seek(0)
+            output.truncate(0)
+
     def is_int(self, s):
         try:
             int(s)
@@ -1359,67 +1435,6 @@ class Geocode(object):
 
         return {'success': True, 'count': 1, 'results': [result]}
 
-    def split_street_and_house_number(self, streetandhouse):
-
-        nums = re.findall(r'\d+', streetandhouse)
-
-        street = None
-        house_num = None
-        if nums is not None and len(nums) > 0:
-            idx = streetandhouse.find(nums[0])
-            if idx == 0:
-                house_num = nums[0]
-
-                if streetandhouse[idx + len(house_num):
-                                  idx + len(house_num) + 1] != " " and\
-                   streetandhouse[idx + len(house_num):
-                                  idx + len(house_num) + 1] != ",":
-                    if streetandhouse[idx + len(house_num):
-                                      idx + len(house_num) + 1] == "-":
-                        part2 = streetandhouse[len(house_num) + 1:]
-
-                        nums2 = re.findall(r'\d+', part2)
-                        if nums2 is not None and len(nums2) > 0:
-                            idx2 = streetandhouse.find(nums2[0])
-                            house_num = streetandhouse[idx:idx2 + len(nums2[0])]
-                    else:
-                        try:
-                            if streetandhouse[idx + len(house_num) + 1:
-                                              idx + len(house_num) + 2] != " ":
-                                house_num = streetandhouse[
-                                    idx:idx + len(house_num)]
-                            else:
-                                house_num = streetandhouse[
-                                    idx:idx + len(house_num) + 1]
-                        except:
-                            house_num = streetandhouse[
-                                idx:idx + len(house_num) + 1]
-                            log.debug('error - split_street_and_house_number')
-                street = streetandhouse[len(house_num) + 1:]
-            else:
-                # Rue du 9 mai
-                house_num = nums[len(nums) - 1]
-                if streetandhouse[idx + len(house_num):
-                                  idx + len(house_num) + 1] != " " and\
-                   streetandhouse[idx + len(house_num):
-                                  idx + len(house_num) + 1] != ",":
-                    try:
-                        if streetandhouse[idx + len(house_num):
-                                          idx + len(house_num) + 2] != " ":
-                            house_num = streetandhouse[idx:
-                                                       idx + len(house_num)]
-                        else:
-                            house_num = streetandhouse[
-                                idx:idx + len(house_num) + 1]
-                    except:
-                        house_num = streetandhouse[idx:
-                                                   idx + len(house_num) + 1]
-                        log.debug('error - split_street_and_house_number')
-                street = streetandhouse[len(house_num) + 1:]
-        else:
-            street = streetandhouse
-        return house_num, street
-
     def _split_zip_and_town(self, address):
         zip = None
         town = None
@@ -1464,7 +1479,7 @@ class Geocode(object):
         stripped_address = stripped_address.replace("L-", "")
         stripped_address = stripped_address.replace("l-", "")
 
-        house_num, rest = self.split_street_and_house_number(stripped_address)
+        house_num, rest = split_street_and_house_number(stripped_address)
         zip, locality = self._split_zip_and_town(rest)
         idx = rest.find(str(zip))
         street = rest[0:idx]
@@ -1475,355 +1490,21 @@ class Geocode(object):
                 'zip': zip,
                 'locality': locality}
 
-    # We start with house number + street or street + house number
-    # 54 avenue G. Diderich or avenue G. Diderich 54
-    # Post code 4 digits
-    # House number after or before the street
-    # House number composed of digit but sometimes letter 54A
-    # Post code is followed by locality
-    # 54 Avenue gaston diderich 1420 luxembourg
-    # Avenue gaston diderich 54 , 1420 luxembourg
-    # 14 Allée de la Jeunesse Sacrifiée 1940-1945 5863 Alzinghen
-    # 2A Rue du 9 mai 1944 2112 Howald
     def _split_address(self, address):
-        street = None
-        house_num = None
-        zip = None
-        locality = None
-
-        if address is None:
-            return {
-                'street': street,
-                'num': house_num,
-                'zip': zip,
-                'locality': locality}
-
-        address = re.sub(r'\([^)]*\)', '',  address.strip())
-
-        stripped_address = address.strip()
-        stripped_address = stripped_address.replace(",", " ")
-        stripped_address = stripped_address.replace("L-", "")
-        stripped_address = stripped_address.replace("l-", "")
-
-        # Last word always locality name except if only a number
-        words = stripped_address.split(" ")
-        locality = words[len(words) - 1]
-
-        if locality is not None and locality.isdigit():
-            zip = locality
-            locality = self.get_locality_from_zip(zip)
-
-        # Next to the last word, if 4 digits then this is the post code
-        if zip is None:
-            t_zip = words[len(words) - 2]
-            if t_zip.isdigit() and len(t_zip) == 4:
-                zip = t_zip
-
-        if zip is not None:
-            parts = stripped_address.split(zip)
-            street = parts[0]
-        else:
-            if locality is not None:
-                street = stripped_address[
-                    0:len(stripped_address) - len(locality)]
-            else:
-                street = stripped_address
-
-        house_num, street = self.split_street_and_house_number(street)
-
-        if street is not None:
-            street = street.replace(",", "")
-            street = street.replace("L-", "")
-            street = street.replace("l-", "")
-            street = street.strip().lower()
-
-        if house_num is not None:
-            house_num = house_num.replace(",", "")
-            house_num = house_num.replace("L-", "")
-            house_num = house_num.replace("l-", "")
-            house_num = house_num.strip()
-
-        if zip is not None:
-            zip = zip.replace(",", "")
-            zip = zip.replace("L-", "")
-            zip = zip.replace("l-", "")
-            zip = zip.strip()
-
-        if locality is not None:
-            locality = locality.replace(",", "")
-            locality = locality.replace("L-", "")
-            locality = locality.replace("l-", "")
-            locality = locality.strip().lower()
-            locality = locality.replace(" sur ", "-sur-")
-            locality = locality.replace("/", "-sur-")
+        parsed = address_parser.parse_address(address)
+        locality = parsed.locality
+        if locality is None and parsed.zip is not None:
+            locality = address_parser.normalize_locality(
+                self.get_locality_from_zip(parsed.zip))
 
         return {
-                'street': street,
-                'num': house_num,
-                'zip': zip,
-                'locality': locality}
-
-        nums = re.findall(r'\d+', stripped_address)
-
-        # No numbers: Always locality after street
-        if len(nums) == 0:
-            street = stripped_address
-            words = street.split(" ")
-            words = words[len(words) - 1].split(",")
-            locality = words[len(words) - 1]
-            locality = locality.replace(",", "")
-            locality = locality.strip()
-            street = street[0:len(street) - len(locality)]
-
-            return {
-                'street': street,
-                'num': house_num,
-                'zip': zip,
-                'locality': locality}
-
-        # 2 numbers: 1 of 4 digits and
-        # one with less than 4 digits
-        # The one with 4 digits is the post code,
-        # other is house number
-        if len(nums) == 2:
-            for num in nums:
-                if len(num) == 4:
-                    zip = num
-                    locality = self.get_locality_from_zip(zip)
-                else:
-                    house_num = num
-                    idx = stripped_address.find(house_num)
-
-                    if idx >= 0 and\
-                       stripped_address[idx + len(house_num):
-                                        idx + len(house_num) + 1] != " " and\
-                       stripped_address[idx + len(house_num):
-                                        idx + len(house_num) + 1] != ",":
-                        house_num = stripped_address[
-                            idx:idx + len(house_num) + 1]
-
-            if zip is not None and house_num is not None:
-                parts = stripped_address.split(zip)
-
-                if len(parts[0]) > 0:
-                    street = parts[0].replace(house_num, "")
-                    street = street.replace(",", "")
-                    street = street.replace("L-", "")
-                    street = street.replace("l-", "")
-                    street = street.strip()
-                return {
-                    'street': street,
-                    'num': house_num,
-                    'zip': zip,
-                    'locality': locality}
-
-        # 1 number
-        # If 4 digits Then this is the post code
-        # If less then this is the house number
-        if len(nums) == 1:
-            num = nums[0]
-            if len(num) == 4:
-                zip = num
-                locality = self.get_locality_from_zip(zip)
-                # The part before the post code is the street
-                parts = stripped_address.split(zip)
-
-                street = parts[0].replace(num, "")
-                street = street.replace(",", "")
-                street = street.replace("L-", "")
-                street = street.replace("l-", "")
-                street = street.strip()
-
-                return {
-                    'street': street,
-                    'num': house_num,
-                    'zip': zip,
-                    'locality': locality}
-            if len(num) > 4:
-                # House number has a maximum of 3 digits
-                street = stripped_address
-                street = street.replace(",", "")
-                street = street.replace("L-", "")
-                street = street.replace("l-", "")
-                street = street.strip()
-
-                return {
-                    'street': street,
-                    'num': house_num,
-                    'zip': zip,
-                    'locality': locality}
-
-            # Todo: Find the street and find if the number is the house number
-            if len(num) < 4:
-                street = stripped_address
-                # Le numéro est au début de la chaine
-                if stripped_address[0:len(num)].isdigit():
-                    house_num = stripped_address[0:len(num)]
-                    idx = stripped_address.find(house_num)
-                    if idx >= 0 and\
-                       stripped_address[idx + len(house_num):
-                                        idx + len(house_num) + 1] != " " and\
-                       stripped_address[idx + len(house_num):
-                                        idx + len(house_num) + 1] != ",":
-                        house_num = stripped_address[
-                            idx:idx + len(house_num) + 1]
-
-                    street = stripped_address[len(house_num):]
-
-                    # The last word is probably locality
-                    words = street.split(" ")
-                    words = words[len(words) - 1].split(",")
-
-                    locality = words[len(words) - 1]
-                    locality = locality.replace(",", "")
-                    locality = locality.strip()
-
-                    street = street[0:len(street) - len(locality)]
-                else:
-                    # The number is inside the string
-                    house_num = num
-                    idx = stripped_address.find(house_num)
-                    if idx >= 0 and\
-                       stripped_address[idx + len(house_num):
-                                        idx + len(house_num) + 1] != " " and\
-                       stripped_address[idx + len(house_num):
-                                        idx + len(house_num) + 1] != ",":
-                        house_num = stripped_address[
-                            idx:idx + len(house_num) + 1]
-
-                    parts = stripped_address.split(house_num)
-                    street = parts[0]
-                    locality = parts[1]
-                    locality = locality.strip()
-
-                street = street.replace(house_num, "")
-                street = street.replace(",", "")
-                street = street.replace("L-", "")
-                street = street.replace("l-", "")
-                street = street.strip()
-
-                return {
-                    'street': street,
-                    'num': house_num,
-                    'zip': zip,
-                    'locality': locality}
-
-        # Plus que 2 nombres:
-        if len(nums) > 2:
-            # Find the one with 4 digits that is the post code
-            for num in nums:
-                if len(num) == 4:
-                    t_zip = num
-                    t_locality = self.get_locality_from_zip(t_zip)
-                    parts = stripped_address.split(" ")
-                    for part in parts:
-                        cur_ratio = difflib.SequenceMatcher(
-                                None, self.supprime_accent(part),
-                                self.supprime_accent(t_locality)).ratio()
-                        # If ratio is ok that probably means this is
-                        # the post code
-                        if (cur_ratio > 0.8):
-                            zip = t_zip
-                            locality = t_locality
-                            break
-
-            if zip is not None:
-                parts = stripped_address.split(zip)
-                for num in nums:
-                    if len(num) < 4:
-                        # To be the house number, it should be first or last
-                        if parts[0][0:len(num)].isdigit():
-                            house_num = parts[0][0:len(num)]
-                            if house_num is not None:
-                                idx = stripped_address.find(house_num)
-                                if idx >= 0 and\
-                                   stripped_address[
-                                        idx + len(house_num):
-                                        idx + len(house_num) + 1] != " " and\
-                                   stripped_address[
-                                        idx + len(house_num):
-                                        idx + len(house_num) + 1] != ",":
-                                    house_num = stripped_address[
-                                        idx:idx + len(house_num) + 1]
-
-                            street = parts[0].replace(house_num, "")
-                            street = street.replace(",", "")
-                            street = street.replace("L-", "")
-                            street = street.replace("l-", "")
-                            street = street.strip()
-                            break
-            return {
-                'street': street,
-                'num': house_num,
-                'zip': zip,
-                'locality': locality}
-        return {
-            'street': street,
-            'num': house_num,
-            'zip': zip,
-            'locality': locality}
-
-        if zip is not None and house_num is not None:
-            parts = stripped_address.split(zip)
-
-            if len(parts[0]) > 0:
-                street = parts[0].strip()
-            if len(parts[1]) > 0:
-                street = parts[1].strip()
-            return {
-                'street': street,
-                'num': house_num,
-                'zip': zip,
-                'locality': locality}
-
-        for num in nums:
-            # If this number has 4 digits this is a good candidate
-            # to be post code
-            if len(num) == 4:
-                zip = num
-
-        # If the first char is a number then this is the beginning of
-        # the house number
-        for i in range(1, len(stripped_address)):
-            if stripped_address[0:i].isdigit():
-                num = stripped_address[0:i]
-                stripped_address = stripped_address[i:]
-            else:
-                break
-
-        # Si L is followed by a number this is the post code
-        # And what is before is the street and the nouse number
-        if stripped_address.lower().find("l-") > 0:
-            cp = stripped_address[stripped_address.lower().find("l-"):]
-            for i in range(1, len(cp)):
-                if cp[0:i].isdigit():
-                    zip = cp[0:i]
-                    locality = cp[i:]
-                else:
-                    if zip is not None:
-                        street = stripped_address[
-                            0:stripped_address.lower().find("l-")]
-                    break
-
-        # We start with street name
-        for i in range(1, len(stripped_address)):
-            if stripped_address[0:i].isdigit():
-                num = stripped_address[0:i]
-                stripped_address = stripped_address[i:]
-                break
-
-        return {
-                'street': street,
-                'num': house_num,
-                'zip': zip,
+                'street': parsed.street,
+                'num': parsed.num,
+                'zip': parsed.zip,
                 'locality': locality}
 
     def get_locality_from_zip(self, p_zip):
-        features = self.db_ecadastre.query(Address.localite).filter(text(
-            " lower(code_postal) = lower(:p_zip)").bindparams(p_zip=p_zip)).\
-            group_by(Address.localite).all()
-
-        for feature in features:
-            return feature.localite.strip()
+        for localite in geocoding_index.get_index().get_localities(p_zip):
+            return localite
 
         return None
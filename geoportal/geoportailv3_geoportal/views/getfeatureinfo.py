@@ -3,45 +3,202 @@ import logging
 import re
 import urllib.request
 import datetime
-import pyproj
 import geojson
 import os
 import json
 import pytz
 import dateutil
 import copy
+import threading
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import TimeoutError as FuturesTimeoutError
+from time import monotonic
 from urllib.parse import urlencode
 from pyramid.renderers import render
 from pyramid.view import view_config
-from geoportailv3_geoportal.models import LuxGetfeatureDefinition
-from geoportailv3_geoportal.models import LuxLayerInternalWMS, LuxDownloadUrl
+from geoportailv3_geoportal.models import LuxDownloadUrl
 from mako.template import Template
 from pyramid.httpexceptions import HTTPBadRequest, HTTPBadGateway
 from pyramid.i18n import get_localizer, TranslationStringFactory
 from pyramid.response import Response
-from pkg_resources import resource_filename
-from os.path import isfile
 from geojson import loads as geojson_loads
 from shapely.geometry import asShape, box
 from shapely.geometry.polygon import LinearRing
 from c2cgeoportal_commons.models import DBSession, DBSessions
-from c2cgeoportal_commons.models.main import RestrictionArea, Role, Layer, Metadata
 from shapely.geometry import MultiLineString, mapping, shape
-from shapely.ops import transform
 from shapely.wkt import loads as wkt_loads
-from functools import partial
+from sqlalchemy import event
 from arcgis2geojson import arcgis2geojson
 from geoportailv3_geoportal.lib.esri_authentication import ESRITokenException
-from geoportailv3_geoportal.lib.esri_authentication import get_arcgis_token, read_request_with_token
+from geoportailv3_geoportal.lib.esri_authentication import get_arcgis_token, read_request_with_token, \
+    open_request_with_token
 from geoportailv3_geoportal.views.download import Download
+from geoportailv3_geoportal.lib import feature_definitions
+from geoportailv3_geoportal.lib import http_client
+from geoportailv3_geoportal.lib import identify_cache
+from geoportailv3_geoportal.lib import tooltip_templates
+from geoportailv3_geoportal.lib.projections import transform_geojson, transform_geometry
 log = logging.getLogger(__name__)
 
+# Maximum number of layers queried in parallel for one getfeatureinfo request
+GFI_MAX_WORKERS = int(os.environ.get('GFI_MAX_WORKERS', '8'))
+# Time in seconds after which the layers still running are dropped
+GFI_LAYER_TIMEOUT = float(os.environ.get('GFI_LAYER_TIMEOUT', '20'))
+# Column holding the total number of rows of a paginated query
+TOTAL_COUNT_COLUMN = 'gfi_total_count'
+# Parameters forwarded to the WMS server of the OGC layers, part of their
+# cache key
+OGC_CACHE_KEY_PARAMS = ('srs', 'X', 'Y', 'WIDTH', 'HEIGHT', 'BBOX')
+# Shortest timeout in seconds of a query or a request done after the deadline
+MIN_TIMEOUT = 0.1
+
+DetachedUser = namedtuple('DetachedUser', ['username', 'settings_role'])
+DetachedRole = namedtuple('DetachedRole', ['id', 'name'])
+
+# Threads querying the layers, shared by all the requests of the process so
+# GFI_MAX_WORKERS bounds the concurrent layer queries of a worker process
+_executor_lock = threading.Lock()
+_executor = None
+_executor_pid = None
+# Deadline of the layer queried by the current worker thread
+_worker = threading.local()
+
+
+def get_executor():
+    """
+    Return the thread pool of the process, created again after a fork.
+    """
+    global _executor, _executor_pid
+    if _executor is None or _executor_pid != os.getpid():
+        with _executor_lock:
+            if _executor is None or _executor_pid != os.getpid():
+                _executor = ThreadPoolExecutor(max_workers=GFI_MAX_WORKERS)
+                _executor_pid = os.getpid()
+    return _executor
+
+
+def _get_remaining_time(deadline, timeout):
+    if deadline is None:
+        return timeout
+    return max(MIN_TIMEOUT, min(timeout, deadline - monotonic()))
+
+
+def _set_statement_timeout(session, transaction, connection):
+    # Listener of the sessions of a worker, PostgreSQL cancels its queries at
+    # the deadline of its layer, also when a rollback started a new
+    # transaction.
+    deadline = getattr(_worker, 'deadline', None)
+    if deadline is not None:
+        connection.execute("SET LOCAL statement_timeout = %d" % int(
+            _get_remaining_time(deadline, GFI_LAYER_TIMEOUT) * 1000))
+
+
+class DetachedRequest(object):
+    """
+    The values of a request needed to query a layer in a worker thread. A
+    worker may still run after the response is sent, so it never reads the
+    request itself.
+    """
+
+    # Routes of which the url is used by the additional info functions
+    ROUTES = ('download',)
+
+    def __init__(self, request):
+        self.params = request.params.copy()
+        self.registry = request.registry
+        self.locale_name = request.locale_name
+        self.referer = request.referer
+        self.user = None
+        if request.user is not None:
+            role = request.user.settings_role
+            self.user = DetachedUser(
+                request.user.username,
+                DetachedRole(role.id, role.name) if role is not None else None)
+        self._route_urls = {
+            name: request.route_url(name) for name in self.ROUTES}
+
+    def route_url(self, name):
+        return self._route_urls[name]
+
+
+class PageRow(object):
+    """
+    A row of a paginated query without its last column, the total count.
+    It is read like the rows of SQLAlchemy, by position, by name or by
+    attribute, by the features and the additional info functions.
+    """
+
+    __slots__ = ('_row',)
+
+    def __init__(self, row):
+        self._row = row
+
+    def __getitem__(self, key):
+        if isinstance(key, (int, slice)):
+            return tuple(self)[key]
+        if key == TOTAL_COUNT_COLUMN:
+            raise KeyError(key)
+        return self._row[key]
+
+    def __getattr__(self, name):
+        if name == TOTAL_COUNT_COLUMN:
+            raise AttributeError(name)
+        return getattr(self._row, name)
+
+    def __iter__(self):
+        return iter(tuple(self._row)[:-1])
+
+    def __len__(self):
+        return len(self._row) - 1
+
+    def __contains__(self, key):
+        return key != TOTAL_COUNT_COLUMN and key in self._row
+
+    def __eq__(self, other):
+        return tuple(self) == tuple(other)
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __hash__(self):
+        return hash(tuple(self))
+
+    def __repr__(self):
+        return repr(tuple(self))
+
+    def keys(self):
+        return [key for key in self._row.keys() if key != TOTAL_COUNT_COLUMN]
+
+    def values(self):
+        return list(self)
+
+    def items(self):
+        return list(zip(self.keys(), self))
+
+    def has_key(self, key):
+        return key in self
+
 
 class Getfeatureinfo(object):
 
     def __init__(self, request):
         self.request = request
+        self._local = threading.local()
         self.content_count = 0
+        # Deadline of the layers queried by the worker threads
+        self._deadline = None
+
+    # The count of the last ArcGIS query, kept per thread as the layers
+    # are queried concurrently.
+    @property
+    def content_count(self):
+        return getattr(self._local, 'content_count', 0)
+
+    @content_count.setter
+    def content_count(self, value):
+        self._local.content_count = value
+
     @view_config(route_name='download_resource')
     def download_resource(self):
         fid = self.request.params.get('fid', None)
@@ -155,8 +312,7 @@ class Getfeatureinfo(object):
 
                 try:
                     url_request = urllib.request.Request(url2)
-                    result = read_request_with_token(url_request, self.request, log, renew_token=use_auth)
-                    data = result.data
+                    result = open_request_with_token(url_request, self.request, log, renew_token=use_auth)
                 except Exception as e:
                     log.exception(e)
                     log.error(url2)
@@ -165,7 +321,7 @@ class Getfeatureinfo(object):
                 headers = {"Content-Type": contentType,
                            "Content-Disposition": "attachment; filename=\"%(pdf_name)s\"" %{'pdf_name': pdf_name}}
 
-                return Response(data, headers=headers)
+                return Response(app_iter=http_client.iter_content(result), headers=headers)
         return HTTPBadGateway("Unable to access the remote url")
 
     # Get the remote template
@@ -181,8 +337,9 @@ class Getfeatureinfo(object):
 
         if (luxgetfeaturedefinitions[0].template is not None and
                 len(luxgetfeaturedefinitions[0].template) > 0):
-            f = urllib.request.urlopen(luxgetfeaturedefinitions[0].template, None, 15)
-            return Response(f.read())
+            remote_template = tooltip_templates.get_remote_template(
+                luxgetfeaturedefinitions[0].template)
+            return Response(remote_template.data)
 
         return HTTPBadRequest()
 
@@ -354,251 +511,322 @@ class Getfeatureinfo(object):
 
     def get_info(self, fid, coordinates_big_box, coordinates_small_box,
                  results, layers, big_box, p_geometry=None, p_zoom=None, p_query_limit='20', offset=None, time=None):
-        rows_cnt = 0
-        luxgetfeaturedefinitions = self.get_lux_feature_definition(layers)
-        for luxgetfeaturedefinition in luxgetfeaturedefinitions:
-            if not self.is_zoom_ok(p_zoom, luxgetfeaturedefinition.zoom_level):
-                continue
-            if (luxgetfeaturedefinition is not None):
-                metadata = DBSession.query(Metadata).filter(Metadata.item_id == luxgetfeaturedefinition.layer).\
-                    filter(Metadata.name == "return_clicked_point").first()
-                if metadata is not None and metadata.value.lower() == 'true':
-                    is_ordered = luxgetfeaturedefinition.columns_order is not None\
-                        and len(luxgetfeaturedefinition.columns_order) > 0
-                    box2 = self.request.params.get('box2', None)
-                    coords = box2.split(',')
-                    the_box = box(float(coords[0]), float(coords[1]),
-                        float(coords[2]), float(coords[3]))
+        luxgetfeaturedefinitions = [
+            luxgetfeaturedefinition
+            for luxgetfeaturedefinition in self.get_lux_feature_definition(layers)
+            if luxgetfeaturedefinition is not None and
+            self.is_zoom_ok(p_zoom, luxgetfeaturedefinition.zoom_level)]
+        layers_results = self._fan_out(
+            luxgetfeaturedefinitions, fid, coordinates_big_box,
+            coordinates_small_box, layers, big_box, p_geometry,
+            p_query_limit, offset, time)
+        for layer_results in layers_results:
+            if isinstance(layer_results, HTTPBadRequest):
+                return layer_results
+            results.extend(layer_results)
 
-                    geometry = geojson_loads(geojson.dumps(mapping(the_box.centroid)))
-                    f = []
-                    if luxgetfeaturedefinition.rest_url is not None and len(luxgetfeaturedefinition.rest_url) > 0:
-                        cur_time = self.get_time_of_layer(luxgetfeaturedefinition.layer, layers, time)
-                        features = self._get_external_data(
-                            luxgetfeaturedefinition.layer,
-                            luxgetfeaturedefinition.rest_url,
-                            None,
-                            None, None, None, None,
-                            None,
-                            use_auth=luxgetfeaturedefinition.use_auth,
-                            p_geometry=the_box.centroid.wkt, srs_geometry="2169", time=cur_time)
+        if self.request.params.get('tooltip', None) is not None:
+            path = 'templates/tooltip/'
+            localizer = self.request.localizer
+            server = TranslationStringFactory("geoportailv3_geoportal-server")
+            tooltips = TranslationStringFactory("geoportailv3_geoportal-tooltips")
+            client = TranslationStringFactory("geoportailv3_geoportal-client")
+            info_format = self.request.params.get('INFO_FORMAT', self.request.params.get('info_format', 'text/html'))
+            for r in results:
+                l_template = r['template']
+                template = l_template if tooltip_templates.has_template(path + l_template) else 'default.html'
+                features = r['features']
+                context = {
+                    "_s": lambda s: localizer.translate(server(s)),
+                    "_t": lambda s: localizer.translate(tooltips(s)),
+                    "_c": lambda s: localizer.translate(client(s)),
+                    "features": features}
+                if r['remote_template'] is not None and\
+                   r['remote_template']:
+                    try:
+                        DBSession.rollback()
+                        cached_template = tooltip_templates.get_remote_template(
+                            l_template + "&render=apiv4")
+                        remote_template = cached_template.template
+                    except Exception as e:
+                        log.exception(e)
+                        log.error(l_template)
+                        return HTTPBadGateway()
+                    if b"${features" in cached_template.data:
+                        r['tooltip'] =\
+                            remote_template.render(features=features)
+                    else:
                         if len(features) > 0:
-                            f.append(self.to_feature(luxgetfeaturedefinition.layer, None,
-                                                    geometry,
-                                                    [],
-                                                    [],
-                                                    None))
+                            r['tooltip'] =\
+                                remote_template.render(feature=features[0])
+                        else:
+                            r['tooltip'] = ''
+                else:
+                    if info_format == 'application/json':
+                        name = 'json_' + l_template
+                        template = name if tooltip_templates.has_template(
+                            path + name) else 'json.html'
+                        r['tooltip'] = render(
+                            'geoportailv3_geoportal:' + path + template, context)
+                    elif info_format == 'text/xml':
+                        name = 'xml_' + l_template
+                        template = name if tooltip_templates.has_template(
+                            path + name) else 'xml.html'
+                        r['tooltip'] = render(
+                            'geoportailv3_geoportal:' + path + template, context)
+                    elif info_format == 'text/plain':
+                        name = 'text_' + l_template
+                        template = name if tooltip_templates.has_template(
+                            path + name) else 'text.html'
+                        r['tooltip'] = render(
+                            'geoportailv3_geoportal:' + path + template, context)
                     else:
+                        r['tooltip'] = render(
+                            'geoportailv3_geoportal:' + path + template, context)
+
+        return results
+
+    def _fan_out(self, luxgetfeaturedefinitions, fid, coordinates_big_box,
+                 coordinates_small_box, layers, big_box, p_geometry,
+                 p_query_limit, offset, time):
+        # Query every layer concurrently, the results keep the order of the
+        # definitions. A layer which does not answer before the deadline is
+        # returned without features and flagged as timed out instead of
+        # delaying the whole click.
+        args = (fid, coordinates_big_box, coordinates_small_box, layers,
+                big_box, p_geometry, p_query_limit, offset, time)
+        if GFI_MAX_WORKERS <= 1 or len(luxgetfeaturedefinitions) <= 1:
+            return [self._get_cached_layer_info(luxgetfeaturedefinition, *args)
+                    for luxgetfeaturedefinition in luxgetfeaturedefinitions]
+
+        worker = Getfeatureinfo(DetachedRequest(self.request))
+        worker._deadline = deadline = monotonic() + GFI_LAYER_TIMEOUT
+        executor = get_executor()
+        futures = [
+            executor.submit(
+                worker._get_layer_info_in_thread,
+                luxgetfeaturedefinition, *args)
+            for luxgetfeaturedefinition in luxgetfeaturedefinitions]
+        layers_results = []
+        for luxgetfeaturedefinition, future in zip(
+                luxgetfeaturedefinitions, futures):
+            try:
+                layers_results.append(
+                    future.result(max(0, deadline - monotonic())))
+            except FuturesTimeoutError:
+                # A layer still waiting for a thread is dropped, a running
+                # one stops at its statement and HTTP timeouts.
+                future.cancel()
+                log.warning(
+                    "Getfeatureinfo of layer %s timed out after %ss"
+                    % (luxgetfeaturedefinition.layer, GFI_LAYER_TIMEOUT))
+                layers_results.append(
+                    [self.to_timeout_featureinfo(luxgetfeaturedefinition)])
+        return layers_results
+
+    def _get_layer_info_in_thread(self, luxgetfeaturedefinition, *args):
+        if monotonic() >= self._deadline:
+            return [self.to_timeout_featureinfo(luxgetfeaturedefinition)]
+        _worker.deadline = self._deadline
+        # Only the sessions of this thread get the statement timeout, the
+        # scoped sessions are thread local.
+        sessions = []
+        for scoped_session in [DBSession] + list(DBSessions.values()):
+            session = scoped_session()
+            if all(session is not s for s in sessions):
+                sessions.append(session)
+                event.listen(session, 'after_begin', _set_statement_timeout)
+        try:
+            return self._get_cached_layer_info(luxgetfeaturedefinition, *args)
+        finally:
+            _worker.deadline = None
+            for session in sessions:
+                event.remove(session, 'after_begin', _set_statement_timeout)
+            # The scoped sessions are thread local, release the connections
+            # opened by this worker.
+            DBSession.remove()
+            for session in DBSessions.values():
+                session.remove()
+
+    def _get_timeout(self, timeout=http_client.READ_TIMEOUT):
+        # The network calls of the workers stop waiting at the deadline
+        return _get_remaining_time(self._deadline, timeout)
+
+    def _get_cached_layer_info(self, luxgetfeaturedefinition, fid,
+                               coordinates_big_box, coordinates_small_box,
+                               layers, big_box, p_geometry, p_query_limit,
+                               offset, time):
+        # The results of the definitions with a cache duration are kept for
+        # the next clicks at the same place, see lib/identify_cache.py
+        args = (fid, coordinates_big_box, coordinates_small_box, layers,
+                big_box, p_geometry, p_query_limit, offset, time)
+        if not luxgetfeaturedefinition.cache_ttl or \
+                luxgetfeaturedefinition.cache_ttl <= 0 or \
+                self._returns_clicked_point(luxgetfeaturedefinition):
+            return self._get_layer_info(luxgetfeaturedefinition, *args)
+
+        role_id = None
+        if self.request.user is not None:
+            role_id = self.request.user.settings_role.id
+        key = (
+            str(luxgetfeaturedefinition.layer).strip(),
+            luxgetfeaturedefinition.id,
+            role_id,
+            self.request.locale_name,
+            identify_cache.snap_box(coordinates_big_box),
+            identify_cache.snap_box(coordinates_small_box),
+            fid, p_geometry, p_query_limit, offset,
+            self.get_time_of_layer(luxgetfeaturedefinition.layer, layers, time),
+        ) + self._get_cache_key_params(luxgetfeaturedefinition)
+        results = identify_cache.get(key)
+        if results is None:
+            results = self._get_layer_info(luxgetfeaturedefinition, *args)
+            if isinstance(results, list):
+                identify_cache.set(key, results, luxgetfeaturedefinition.cache_ttl)
+        return results
+
+    def _returns_clicked_point(self, luxgetfeaturedefinition):
+        return_clicked_point = feature_definitions.get_snapshot().get_metadata(
+            luxgetfeaturedefinition.layer, "return_clicked_point")
+        return return_clicked_point is not None and \
+            return_clicked_point.lower() == 'true'
+
+    def _get_cache_key_params(self, luxgetfeaturedefinition):
+        params = self.request.params
+        if (luxgetfeaturedefinition.rest_url is None or
+            len(luxgetfeaturedefinition.rest_url) == 0) and \
+            (luxgetfeaturedefinition.query is None or
+                len(luxgetfeaturedefinition.query) == 0):
+            # The clicked pixel is sent to the WMS server
+            return tuple(params.get(name) for name in OGC_CACHE_KEY_PARAMS)
+        # The map only gives the tolerance around the points and lines,
+        # from its resolution
+        return (
+            params.get('geometry_srs'), params.get('srs'),
+            identify_cache.snap_resolution(
+                params.get('BBOX'), params.get('WIDTH')))
+
+    def _get_layer_info(self, luxgetfeaturedefinition, fid,
+                        coordinates_big_box, coordinates_small_box, layers,
+                        big_box, p_geometry, p_query_limit, offset, time):
+        results = []
+        rows_cnt = 0
+
+        if (luxgetfeaturedefinition is not None):
+            if self._returns_clicked_point(luxgetfeaturedefinition):
+                is_ordered = luxgetfeaturedefinition.columns_order is not None\
+                    and len(luxgetfeaturedefinition.columns_order) > 0
+                box2 = self.request.params.get('box2', None)
+                coords = box2.split(',')
+                the_box = box(float(coords[0]), float(coords[1]),
+                    float(coords[2]), float(coords[3]))
+
+                geometry = geojson_loads(geojson.dumps(mapping(the_box.centroid)))
+                f = []
+                if luxgetfeaturedefinition.rest_url is not None and len(luxgetfeaturedefinition.rest_url) > 0:
+                    cur_time = self.get_time_of_layer(luxgetfeaturedefinition.layer, layers, time)
+                    features = self._get_external_data(
+                        luxgetfeaturedefinition.layer,
+                        luxgetfeaturedefinition.rest_url,
+                        None,
+                        None, None, None, None,
+                        None,
+                        use_auth=luxgetfeaturedefinition.use_auth,
+                        p_geometry=the_box.centroid.wkt, srs_geometry="2169", time=cur_time)
+                    if len(features) > 0:
                         f.append(self.to_feature(luxgetfeaturedefinition.layer, None,
                                                 geometry,
                                                 [],
                                                 [],
                                                 None))
-                    results.append(
-                        self.to_featureinfo(
-                            f,
-                            luxgetfeaturedefinition.layer,
-                            luxgetfeaturedefinition.template,
-                            is_ordered,
-                            luxgetfeaturedefinition.has_profile,
-                            luxgetfeaturedefinition.remote_template,
-                            len(f)))
-                    continue
-            if (luxgetfeaturedefinition is not None and
-                luxgetfeaturedefinition.engine_gfi is not None and
-                luxgetfeaturedefinition.query is not None and
-                    len(luxgetfeaturedefinition.query) > 0):
-                is_ordered = luxgetfeaturedefinition.columns_order is not None\
-                    and len(luxgetfeaturedefinition.columns_order) > 0
-                query_1 = luxgetfeaturedefinition.query
-                if "WHERE" in query_1.upper():
-                    query_1 = query_1 + " AND "
                 else:
-                    query_1 = query_1 + " WHERE "
+                    f.append(self.to_feature(luxgetfeaturedefinition.layer, None,
+                                            geometry,
+                                            [],
+                                            [],
+                                            None))
+                results.append(
+                    self.to_featureinfo(
+                        f,
+                        luxgetfeaturedefinition.layer,
+                        luxgetfeaturedefinition.template,
+                        is_ordered,
+                        luxgetfeaturedefinition.has_profile,
+                        luxgetfeaturedefinition.remote_template,
+                        len(f)))
+                return results
+        if (luxgetfeaturedefinition is not None and
+            luxgetfeaturedefinition.engine_gfi is not None and
+            luxgetfeaturedefinition.query is not None and
+                len(luxgetfeaturedefinition.query) > 0):
+            is_ordered = luxgetfeaturedefinition.columns_order is not None\
+                and len(luxgetfeaturedefinition.columns_order) > 0
+            query_1 = luxgetfeaturedefinition.query
+            if "WHERE" in query_1.upper():
+                query_1 = query_1 + " AND "
+            else:
+                query_1 = query_1 + " WHERE "
 
-                if "SELECT" in query_1.upper():
-                    query_1 = query_1.replace(
-                        "SELECT",
-                        "SELECT ST_AsGeoJSON (%(geom)s), "
-                        % {'geom': luxgetfeaturedefinition.geometry_column}, 1)
+            if "SELECT" in query_1.upper():
+                query_1 = query_1.replace(
+                    "SELECT",
+                    "SELECT ST_AsGeoJSON (%(geom)s), "
+                    % {'geom': luxgetfeaturedefinition.geometry_column}, 1)
 
+            else:
+                query_1 = "SELECT *,ST_AsGeoJSON(%(geom)s) FROM "\
+                    % {'geom': luxgetfeaturedefinition.geometry_column} +\
+                    query_1
+            if fid is None:
+                if p_geometry is None:
+                    query_point = query_1 + "ST_Intersects( %(geom)s, "\
+                        "ST_MakeEnvelope(%(left)s, %(bottom)s, %(right)s,"\
+                        "%(top)s, 2169) ) AND ST_NRings(%(geom)s) = 0"\
+                        % {'left': coordinates_big_box[0],
+                           'bottom': coordinates_big_box[1],
+                           'right': coordinates_big_box[2],
+                           'top': coordinates_big_box[3],
+                           'geom': luxgetfeaturedefinition.geometry_column}
+
+                    query_others = query_1 + "ST_Intersects( %(geom)s,"\
+                        " ST_MakeEnvelope (%(left)s, %(bottom)s, %(right)s,"\
+                        " %(top)s, 2169) ) AND  ST_NRings(%(geom)s) > 0"\
+                        % {'left': coordinates_small_box[0],
+                           'bottom': coordinates_small_box[1],
+                           'right': coordinates_small_box[2],
+                           'top': coordinates_small_box[3],
+                           'geom': luxgetfeaturedefinition.geometry_column}
+                    query = query_point + " UNION ALL " + query_others
                 else:
-                    query_1 = "SELECT *,ST_AsGeoJSON(%(geom)s) FROM "\
-                        % {'geom': luxgetfeaturedefinition.geometry_column} +\
-                        query_1
-                if fid is None:
-                    if p_geometry is None:
-                        query_point = query_1 + "ST_Intersects( %(geom)s, "\
-                            "ST_MakeEnvelope(%(left)s, %(bottom)s, %(right)s,"\
-                            "%(top)s, 2169) ) AND ST_NRings(%(geom)s) = 0"\
-                            % {'left': coordinates_big_box[0],
-                               'bottom': coordinates_big_box[1],
-                               'right': coordinates_big_box[2],
-                               'top': coordinates_big_box[3],
-                               'geom': luxgetfeaturedefinition.geometry_column}
-
-                        query_others = query_1 + "ST_Intersects( %(geom)s,"\
-                            " ST_MakeEnvelope (%(left)s, %(bottom)s, %(right)s,"\
-                            " %(top)s, 2169) ) AND  ST_NRings(%(geom)s) > 0"\
-                            % {'left': coordinates_small_box[0],
-                               'bottom': coordinates_small_box[1],
-                               'right': coordinates_small_box[2],
-                               'top': coordinates_small_box[3],
-                               'geom': luxgetfeaturedefinition.geometry_column}
-                        query = query_point + " UNION ALL " + query_others
-                    else:
-                        geometry_srs = self.request.params.get('geometry_srs', '2169')
-                        query = query_1 + "ST_Intersects(%(geom)s, ST_Transform('SRID=%(geometry_srs)s;%(geometry)s'::geometry,2169))"\
-                            % {'geometry': p_geometry,
-                               'geom': luxgetfeaturedefinition.geometry_column,
-                               'geometry_srs': geometry_srs}
-                    query_limit = int(p_query_limit)
-                    if luxgetfeaturedefinition.query_limit is not None:
-                        query_limit = luxgetfeaturedefinition.query_limit
-                    if query_limit > 0:
-                        query = query + " LIMIT " + str(query_limit)
+                    geometry_srs = self.request.params.get('geometry_srs', '2169')
+                    query = query_1 + "ST_Intersects(%(geom)s, ST_Transform('SRID=%(geometry_srs)s;%(geometry)s'::geometry,2169))"\
+                        % {'geometry': p_geometry,
+                           'geom': luxgetfeaturedefinition.geometry_column,
+                           'geometry_srs': geometry_srs}
+                query_limit = int(p_query_limit)
+                if luxgetfeaturedefinition.query_limit is not None:
+                    query_limit = luxgetfeaturedefinition.query_limit
+            else:
+                query_limit = 0
+                if luxgetfeaturedefinition.id_column is not None:
+                    query = query_1 + luxgetfeaturedefinition.id_column +\
+                        " = '" + fid + "'"
                 else:
-                    query_limit = 1
-                    if luxgetfeaturedefinition.id_column is not None:
-                        query = query_1 + luxgetfeaturedefinition.id_column +\
-                            " = '" + fid + "'"
-                    else:
-                        query = query_1 + " id = '" + fid + "'"
+                    query = query_1 + " id = '" + fid + "'"
 
-                session = self._get_session(luxgetfeaturedefinition.engine_gfi)
-                if offset is not None:
-                    res = session.execute(query + " OFFSET " + str(int(offset)))
-                else:
-                    res = session.execute(query)
-                rows = res.fetchall()
-                try:
-                    session = self._get_session(luxgetfeaturedefinition.engine_gfi)
-                    query_cnt = "SELECT COUNT(*) FROM (" + query + ") as request"
-                    query_cnt = query_cnt.replace("LIMIT " + str(query_limit), "" , 1)
+            session = self._get_session(luxgetfeaturedefinition.engine_gfi)
+            rows, rows_cnt = self._execute_page(
+                session, query, query_limit, offset)
 
-                    res_cnt = session.execute(query_cnt)
-                    rows_cnt = res_cnt.fetchall()[0][0]
-                except Exception as e:
-                    session.rollback()
-                    log.exception(e)
-                    log.error("ERROR COUNTING")
+            if (luxgetfeaturedefinition.additional_info_function
+                is not None and
+                len(luxgetfeaturedefinition.
+                    additional_info_function) > 0):
 
-                if (luxgetfeaturedefinition.additional_info_function
-                    is not None and
-                    len(luxgetfeaturedefinition.
-                        additional_info_function) > 0):
+                features = eval(luxgetfeaturedefinition.
+                                additional_info_function)
 
-                    features = eval(luxgetfeaturedefinition.
-                                    additional_info_function)
-
-                    if len(features) > 0:
-                        results.append(
-                            self.to_featureinfo(
-                                features,
-                                luxgetfeaturedefinition.layer,
-                                luxgetfeaturedefinition.template,
-                                is_ordered,
-                                luxgetfeaturedefinition.has_profile,
-                                luxgetfeaturedefinition.remote_template,
-                                rows_cnt))
-                    else:
-                        results.append(
-                            self.to_featureinfo(
-                                [],
-                                luxgetfeaturedefinition.layer,
-                                luxgetfeaturedefinition.template,
-                                False,
-                                luxgetfeaturedefinition.has_profile,
-                                luxgetfeaturedefinition.remote_template,
-                                rows_cnt))
-                else:
-                    features = []
-                    for row in rows:
-                        geometry = geojson_loads(row['st_asgeojson'])
-                        attributes = dict(row)
-                        if luxgetfeaturedefinition.id_column in row:
-                            featureid = row[luxgetfeaturedefinition.id_column]
-                        else:
-                            if 'id' in row:
-                                featureid = row['id']
-                            else:
-                                featureid = None
-                        f = self.to_feature(
-                            luxgetfeaturedefinition.layer,
-                            featureid,
-                            geometry,
-                            attributes,
-                            luxgetfeaturedefinition.attributes_to_remove,
-                            luxgetfeaturedefinition.columns_order,
-                            luxgetfeaturedefinition.geometry_column)
-                        features.append(f)
-                    if len(features) > 0:
-                        if fid is None:
-                            results.append(
-                                self.to_featureinfo(
-                                    self.remove_features_outside_tolerance(
-                                        features, coordinates_small_box),
-                                    luxgetfeaturedefinition.layer,
-                                    luxgetfeaturedefinition.template,
-                                    is_ordered,
-                                    luxgetfeaturedefinition.has_profile,
-                                    luxgetfeaturedefinition.remote_template,
-                                    rows_cnt))
-                        else:
-                            results.append(
-                                self.to_featureinfo(
-                                    features,
-                                    luxgetfeaturedefinition.layer,
-                                    luxgetfeaturedefinition.template,
-                                    is_ordered,
-                                    luxgetfeaturedefinition.has_profile,
-                                    luxgetfeaturedefinition.remote_template,
-                                    rows_cnt))
-                    else:
-                        results.append(
-                            self.to_featureinfo(
-                                [],
-                                luxgetfeaturedefinition.layer,
-                                luxgetfeaturedefinition.template,
-                                False,
-                                luxgetfeaturedefinition.has_profile,
-                                luxgetfeaturedefinition.remote_template,
-                                rows_cnt))
-            if (luxgetfeaturedefinition is not None and
-                (luxgetfeaturedefinition.rest_url is None or
-                    len(luxgetfeaturedefinition.rest_url) == 0) and
-                (luxgetfeaturedefinition.query is None or
-                    len(luxgetfeaturedefinition.query) == 0)):
-                x = self.request.params.get('X', None)
-                y = self.request.params.get('Y', None)
-                width = self.request.params.get('WIDTH', None)
-                height = self.request.params.get('HEIGHT', None)
-                bbox = self.request.params.get('BBOX', None)
-                if x is None or y is None or width is None or\
-                   height is None or bbox is None:
-                    return HTTPBadRequest()
-                srs = self.request.params.get('srs', 'EPSG:2169')
-                internal_wms = DBSession.query(LuxLayerInternalWMS).filter(
-                    LuxLayerInternalWMS.id == luxgetfeaturedefinition.layer).\
-                    first()
-                url = internal_wms.url
-                ogc_layers = internal_wms.layers
-
-                features = self._ogc_getfeatureinfo(
-                    url, x, y, width, height,
-                    ogc_layers, bbox, srs, luxgetfeaturedefinition.layer,
-                    luxgetfeaturedefinition.attributes_to_remove,
-                    luxgetfeaturedefinition.columns_order)
                 if len(features) > 0:
-                    if (luxgetfeaturedefinition.additional_info_function
-                        is not None and
-                        len(luxgetfeaturedefinition.
-                            additional_info_function) > 0):
-                        features = eval(luxgetfeaturedefinition.
-                                        additional_info_function)
-                    is_ordered =\
-                        luxgetfeaturedefinition.columns_order is not None\
-                        and len(luxgetfeaturedefinition.columns_order) > 0
                     results.append(
                         self.to_featureinfo(
                             features,
@@ -606,7 +834,8 @@ class Getfeatureinfo(object):
                             luxgetfeaturedefinition.template,
                             is_ordered,
                             luxgetfeaturedefinition.has_profile,
-                            luxgetfeaturedefinition.remote_template))
+                            luxgetfeaturedefinition.remote_template,
+                            rows_cnt))
                 else:
                     results.append(
                         self.to_featureinfo(
@@ -615,51 +844,30 @@ class Getfeatureinfo(object):
                             luxgetfeaturedefinition.template,
                             False,
                             luxgetfeaturedefinition.has_profile,
-                            luxgetfeaturedefinition.remote_template))
-            if (luxgetfeaturedefinition is not None and
-                luxgetfeaturedefinition.rest_url is not None and
-                    len(luxgetfeaturedefinition.rest_url) > 0):
-                if fid is None:
-                    if p_geometry is not None:
-                        cur_time = self.get_time_of_layer(luxgetfeaturedefinition.layer, layers, time)
-                        features = self._get_external_data(
-                            luxgetfeaturedefinition.layer,
-                            luxgetfeaturedefinition.rest_url,
-                            luxgetfeaturedefinition.id_column,
-                            None, None, None, None,
-                            luxgetfeaturedefinition.columns_order,
-                            use_auth=luxgetfeaturedefinition.use_auth,
-                            p_geometry=p_geometry, srs_geometry=self.request.params.get('srs', self.request.params.get('geometry_srs', '2169')), time=cur_time)
-                    else :
-                        cur_time = self.get_time_of_layer(luxgetfeaturedefinition.layer, layers, time)
-                        features = self._get_external_data(
-                            luxgetfeaturedefinition.layer,
-                            luxgetfeaturedefinition.rest_url,
-                            luxgetfeaturedefinition.id_column,
-                            big_box, None, None, None,
-                            luxgetfeaturedefinition.columns_order,
-                            use_auth=luxgetfeaturedefinition.use_auth, time=cur_time)
-                else:
-                    cur_time = self.get_time_of_layer(luxgetfeaturedefinition.layer, layers, time)
-                    features = self._get_external_data(
+                            luxgetfeaturedefinition.remote_template,
+                            rows_cnt))
+            else:
+                features = []
+                for row in rows:
+                    geometry = geojson_loads(row['st_asgeojson'])
+                    attributes = dict(row)
+                    if luxgetfeaturedefinition.id_column in row:
+                        featureid = row[luxgetfeaturedefinition.id_column]
+                    else:
+                        if 'id' in row:
+                            featureid = row['id']
+                        else:
+                            featureid = None
+                    f = self.to_feature(
                         luxgetfeaturedefinition.layer,
-                        luxgetfeaturedefinition.rest_url,
-                        luxgetfeaturedefinition.id_column,
-                        None, fid, None, None,
+                        featureid,
+                        geometry,
+                        attributes,
+                        luxgetfeaturedefinition.attributes_to_remove,
                         luxgetfeaturedefinition.columns_order,
-                        use_auth=luxgetfeaturedefinition.use_auth, time=cur_time)
-
+                        luxgetfeaturedefinition.geometry_column)
+                    features.append(f)
                 if len(features) > 0:
-                    if (luxgetfeaturedefinition.additional_info_function
-                        is not None and
-                        len(luxgetfeaturedefinition.
-                            additional_info_function) > 0):
-                        features = eval(luxgetfeaturedefinition.
-                                        additional_info_function)
-                    is_ordered =\
-                        luxgetfeaturedefinition.columns_order is not None\
-                        and len(luxgetfeaturedefinition.columns_order) > 0
-                    features = self.remove_attributes_from_features(features, luxgetfeaturedefinition.attributes_to_remove)
                     if fid is None:
                         results.append(
                             self.to_featureinfo(
@@ -670,7 +878,7 @@ class Getfeatureinfo(object):
                                 is_ordered,
                                 luxgetfeaturedefinition.has_profile,
                                 luxgetfeaturedefinition.remote_template,
-                                self.content_count))
+                                rows_cnt))
                     else:
                         results.append(
                             self.to_featureinfo(
@@ -680,7 +888,7 @@ class Getfeatureinfo(object):
                                 is_ordered,
                                 luxgetfeaturedefinition.has_profile,
                                 luxgetfeaturedefinition.remote_template,
-                                self.content_count))
+                                rows_cnt))
                 else:
                     results.append(
                         self.to_featureinfo(
@@ -690,77 +898,135 @@ class Getfeatureinfo(object):
                             False,
                             luxgetfeaturedefinition.has_profile,
                             luxgetfeaturedefinition.remote_template,
+                            rows_cnt))
+        if (luxgetfeaturedefinition is not None and
+            (luxgetfeaturedefinition.rest_url is None or
+                len(luxgetfeaturedefinition.rest_url) == 0) and
+            (luxgetfeaturedefinition.query is None or
+                len(luxgetfeaturedefinition.query) == 0)):
+            x = self.request.params.get('X', None)
+            y = self.request.params.get('Y', None)
+            width = self.request.params.get('WIDTH', None)
+            height = self.request.params.get('HEIGHT', None)
+            bbox = self.request.params.get('BBOX', None)
+            if x is None or y is None or width is None or\
+               height is None or bbox is None:
+                return HTTPBadRequest()
+            srs = self.request.params.get('srs', 'EPSG:2169')
+            internal_wms = feature_definitions.get_snapshot().get_internal_wms(
+                luxgetfeaturedefinition.layer)
+            url = internal_wms.url
+            ogc_layers = internal_wms.layers
+
+            features = self._ogc_getfeatureinfo(
+                url, x, y, width, height,
+                ogc_layers, bbox, srs, luxgetfeaturedefinition.layer,
+                luxgetfeaturedefinition.attributes_to_remove,
+                luxgetfeaturedefinition.columns_order)
+            if len(features) > 0:
+                if (luxgetfeaturedefinition.additional_info_function
+                    is not None and
+                    len(luxgetfeaturedefinition.
+                        additional_info_function) > 0):
+                    features = eval(luxgetfeaturedefinition.
+                                    additional_info_function)
+                is_ordered =\
+                    luxgetfeaturedefinition.columns_order is not None\
+                    and len(luxgetfeaturedefinition.columns_order) > 0
+                results.append(
+                    self.to_featureinfo(
+                        features,
+                        luxgetfeaturedefinition.layer,
+                        luxgetfeaturedefinition.template,
+                        is_ordered,
+                        luxgetfeaturedefinition.has_profile,
+                        luxgetfeaturedefinition.remote_template))
+            else:
+                results.append(
+                    self.to_featureinfo(
+                        [],
+                        luxgetfeaturedefinition.layer,
+                        luxgetfeaturedefinition.template,
+                        False,
+                        luxgetfeaturedefinition.has_profile,
+                        luxgetfeaturedefinition.remote_template))
+        if (luxgetfeaturedefinition is not None and
+            luxgetfeaturedefinition.rest_url is not None and
+                len(luxgetfeaturedefinition.rest_url) > 0):
+            if fid is None:
+                if p_geometry is not None:
+                    cur_time = self.get_time_of_layer(luxgetfeaturedefinition.layer, layers, time)
+                    features = self._get_external_data(
+                        luxgetfeaturedefinition.layer,
+                        luxgetfeaturedefinition.rest_url,
+                        luxgetfeaturedefinition.id_column,
+                        None, None, None, None,
+                        luxgetfeaturedefinition.columns_order,
+                        use_auth=luxgetfeaturedefinition.use_auth,
+                        p_geometry=p_geometry, srs_geometry=self.request.params.get('srs', self.request.params.get('geometry_srs', '2169')), time=cur_time)
+                else :
+                    cur_time = self.get_time_of_layer(luxgetfeaturedefinition.layer, layers, time)
+                    features = self._get_external_data(
+                        luxgetfeaturedefinition.layer,
+                        luxgetfeaturedefinition.rest_url,
+                        luxgetfeaturedefinition.id_column,
+                        big_box, None, None, None,
+                        luxgetfeaturedefinition.columns_order,
+                        use_auth=luxgetfeaturedefinition.use_auth, time=cur_time)
+            else:
+                cur_time = self.get_time_of_layer(luxgetfeaturedefinition.layer, layers, time)
+                features = self._get_external_data(
+                    luxgetfeaturedefinition.layer,
+                    luxgetfeaturedefinition.rest_url,
+                    luxgetfeaturedefinition.id_column,
+                    None, fid, None, None,
+                    luxgetfeaturedefinition.columns_order,
+                    use_auth=luxgetfeaturedefinition.use_auth, time=cur_time)
+
+            if len(features) > 0:
+                if (luxgetfeaturedefinition.additional_info_function
+                    is not None and
+                    len(luxgetfeaturedefinition.
+                        additional_info_function) > 0):
+                    features = eval(luxgetfeaturedefinition.
+                                    additional_info_function)
+                is_ordered =\
+                    luxgetfeaturedefinition.columns_order is not None\
+                    and len(luxgetfeaturedefinition.columns_order) > 0
+                features = self.remove_attributes_from_features(features, luxgetfeaturedefinition.attributes_to_remove)
+                if fid is None:
+                    results.append(
+                        self.to_featureinfo(
+                            self.remove_features_outside_tolerance(
+                                features, coordinates_small_box),
+                            luxgetfeaturedefinition.layer,
+                            luxgetfeaturedefinition.template,
+                            is_ordered,
+                            luxgetfeaturedefinition.has_profile,
+                            luxgetfeaturedefinition.remote_template,
                             self.content_count))
-
-        if self.request.params.get('tooltip', None) is not None:
-            path = 'templates/tooltip/'
-            localizer = self.request.localizer
-            server = TranslationStringFactory("geoportailv3_geoportal-server")
-            tooltips = TranslationStringFactory("geoportailv3_geoportal-tooltips")
-            client = TranslationStringFactory("geoportailv3_geoportal-client")
-            info_format = self.request.params.get('INFO_FORMAT', self.request.params.get('info_format', 'text/html'))
-            for r in results:
-                l_template = r['template']
-                filename = resource_filename('geoportailv3_geoportal', path + l_template)
-                template = l_template if isfile(filename) else 'default.html'
-                features = r['features']
-                context = {
-                    "_s": lambda s: localizer.translate(server(s)),
-                    "_t": lambda s: localizer.translate(tooltips(s)),
-                    "_c": lambda s: localizer.translate(client(s)),
-                    "features": features}
-                if r['remote_template'] is not None and\
-                   r['remote_template']:
-                    data = ""
-                    try:
-                        DBSession.rollback()
-                        url_remote = urllib.request.urlopen(
-                            l_template + "&render=apiv4", None, 15)
-                        data = url_remote.read()
-                    except Exception as e:
-                        log.exception(e)
-                        log.error(l_template)
-                        return HTTPBadGateway()
-                    remote_template = Template(data.decode('utf-8'))
-                    if "${features" in data.decode('utf-8'):
-                        r['tooltip'] =\
-                            remote_template.render(features=features)
-                    else:
-                        if len(features) > 0:
-                            r['tooltip'] =\
-                                remote_template.render(feature=features[0])
-                        else:
-                            r['tooltip'] = ''
                 else:
-                    if info_format == 'application/json':
-                        filename = resource_filename('geoportailv3_geoportal', path + 'json_' + l_template)
-                        template = 'json_' + l_template if isfile(filename) else 'json.html'
-                        r['tooltip'] = render(
-                            'geoportailv3_geoportal:' + path + template, context)
-                    elif info_format == 'text/xml':
-                        filename = resource_filename('geoportailv3_geoportal', path + 'xml_' + l_template)
-                        template = 'xml_' + l_template if isfile(filename) else 'xml.html'
-                        r['tooltip'] = render(
-                            'geoportailv3_geoportal:' + path + template, context)
-                    elif info_format == 'text/plain':
-                        filename = resource_filename('geoportailv3_geoportal', path + 'text_' + l_template)
-                        template = 'text_' + l_template if isfile(filename) else 'text.html'
-                        r['tooltip'] = render(
-                            'geoportailv3_geoportal:' + path + template, context)
-                    else:
-                        r['tooltip'] = render(
-                            'geoportailv3_geoportal:' + path + template, context)
-
+                    results.append(
+                        self.to_featureinfo(
+                            features,
+                            luxgetfeaturedefinition.layer,
+                            luxgetfeaturedefinition.template,
+                            is_ordered,
+                            luxgetfeaturedefinition.has_profile,
+                            luxgetfeaturedefinition.remote_template,
+                            self.content_count))
+            else:
+                results.append(
+                    self.to_featureinfo(
+                        [],
+                        luxgetfeaturedefinition.layer,
+                        luxgetfeaturedefinition.template,
+                        False,
+                        luxgetfeaturedefinition.has_profile,
+                        luxgetfeaturedefinition.remote_template,
+                        self.content_count))
         return results
 
-    def transform_(self, geometry, source, dest):
-        project = partial(
-            pyproj.transform,
-            pyproj.Proj(init=source), # source coordinate system
-            pyproj.Proj(init=dest)) # destination coordinate system
-
-        return transform(project, shape(geometry))  # apply projection
-
     def pixels2meter (self, width, height, bbox, epsg_source, epsg_dest, pixels):
         box3857 = bbox.split(',')
         the_box = box(float(box3857[0]), float(box3857[1]), float(box3857[2]), float(box3857[3]))
@@ -796,6 +1062,7 @@ class Getfeatureinfo(object):
 
         the_box = box(float(coords[0]), float(coords[1]),
                       float(coords[2]), float(coords[3]))
+        buffer = None
         for feature in features:
             s = asShape(feature['geometry'])
             try:
@@ -809,7 +1076,8 @@ class Getfeatureinfo(object):
                     if width is None or height is None or bbox is None:
                         features_to_keep.append(feature)
                     else:
-                        buffer = self.pixel2meter(float(width), float(height), bbox, "epsg:3857", "epsg:2169", 10)
+                        if buffer is None:
+                            buffer = self.pixel2meter(float(width), float(height), bbox, "epsg:3857", "epsg:2169", 10)
                         if the_box.intersects(s.buffer(buffer, 1)):
                             features_to_keep.append(feature)
             except:
@@ -860,57 +1128,29 @@ class Getfeatureinfo(object):
                 "total_features_count": total_count,
                 "features_count": len(features)}
 
+    def to_timeout_featureinfo(self, luxgetfeaturedefinition):
+        # The layer is kept in the response, the client tells the user its
+        # features are missing
+        featureinfo = self.to_featureinfo(
+            [], luxgetfeaturedefinition.layer,
+            luxgetfeaturedefinition.template, False)
+        featureinfo["timeout"] = True
+        return featureinfo
+
     def get_lux_feature_definition(self, layers, bypass_public=False):
         luxgetfeaturedefinitions = []
         try:
             if layers is not None:
+                snapshot = feature_definitions.get_snapshot()
+                role_id = None
+                if self.request.user is not None:
+                    role_id = self.request.user.settings_role.id
                 for layer in layers.split(','):
-                    cur_layer = DBSession.query(Layer).filter(
-                        Layer.id == layer).first()
-                    if cur_layer is None:
-                        continue
-                    if not bypass_public and not cur_layer.public:
-                        if self.request.user is None:
-                            continue
-                        # Check if the layer has a resctriction area
-                        restriction = DBSession.query(RestrictionArea).filter(
-                            RestrictionArea.roles.any(
-                                Role.id == self.request.user.settings_role.id)).filter(
-                            RestrictionArea.layers.any(
-                                Layer.id == layer
-                            )
-                            ).first()
-                        # If not restriction is set then check next layer
-                        if restriction is None:
-                            continue
-
-                    query = DBSession.query(
-                        LuxGetfeatureDefinition).filter(
-                            LuxGetfeatureDefinition.layer == layer
-                        )
-                    if self.request.user is not None:
-                        if query.filter(
-                                LuxGetfeatureDefinition.role ==
-                                self.request.user.settings_role.id
-                                ).count() > 0:
-                            for res in query.filter(
-                                LuxGetfeatureDefinition.role ==
-                                    self.request.user.settings_role.id).all():
-                                luxgetfeaturedefinitions.append(res)
-                        else:
-                            for res in query.filter(
-                                LuxGetfeatureDefinition.role == None
-                                    ).all():  # noqa
-                                luxgetfeaturedefinitions.append(res)
-                    else:
-                        for res in query.filter(
-                            LuxGetfeatureDefinition.role == None
-                                ).all():  # noqa
-                            luxgetfeaturedefinitions.append(res)
+                    luxgetfeaturedefinitions.extend(
+                        snapshot.get_definitions(layer, role_id, bypass_public))
         except Exception as e:
             log.exception(e)
             return []
-            return HTTPBadRequest()
         return luxgetfeaturedefinitions
 
     def remove_attributes_from_features(self, features, attributes_to_remove):
@@ -1165,7 +1405,8 @@ class Getfeatureinfo(object):
 
             try:
                 url_request = urllib.request.Request(url1)
-                result = read_request_with_token(url_request, self.request, log)
+                result = read_request_with_token(
+                    url_request, self.request, log, self._get_timeout())
                 data = result.data
                 data_json = json.loads(data)
                 if "attachmentGroups" in data_json:
@@ -1341,7 +1582,7 @@ class Getfeatureinfo(object):
             hdr = {'api-key': api_key}
             try:
                 req = urllib.request.Request(url, headers=hdr)
-                response = urllib.request.urlopen(req)
+                response = urllib.request.urlopen(req, timeout=self._get_timeout(15))
                 pf_data = json.loads(response.read())
                 #attributes['PF'] = dict(pf_data)
                 #attributes['PF'] = dict(self._add_snake_case_aliases(pf_data))
@@ -1355,7 +1596,7 @@ class Getfeatureinfo(object):
                     attributes['measurements'] = []
                     url = f"{base_url}/document/from-parcel-ids/?parcel_ids={fid}&include_descendants=false"
                     req = urllib.request.Request(url, headers=hdr)
-                    response = urllib.request.urlopen(req)
+                    response = urllib.request.urlopen(req, timeout=self._get_timeout(15))
                     info = json.loads(response.read())
                     authorized_download = {}
                     dossiers = {}
@@ -1379,7 +1620,7 @@ class Getfeatureinfo(object):
                                     if cur_measurement['dossier_id'] not in dossiers:
                                         url = f"{base_url}/dossiers/{cur_measurement['dossier_id']}/"
                                         req = urllib.request.Request(url, headers=hdr)
-                                        response = urllib.request.urlopen(req)
+                                        response = urllib.request.urlopen(req, timeout=self._get_timeout(15))
                                         cur_dossier = json.loads(response.read())
                                         dossiers[cur_measurement['dossier_id']] = cur_dossier
                                     else:
@@ -1517,29 +1758,25 @@ class Getfeatureinfo(object):
             'HEIGHT': height,
             'BBOX': bbox
         }
-        metadata = DBSession.query(Metadata).filter(Metadata.item_id == layer_id).\
-            filter(Metadata.name == "ogc_layers").first()
+        snapshot = feature_definitions.get_snapshot()
+        metadata = snapshot.get_metadata(layer_id, "ogc_layers")
         if metadata is not None:
-            body['LAYERS'] = metadata.value
+            body['LAYERS'] = metadata
 
-        metadata = DBSession.query(Metadata).filter(Metadata.item_id == layer_id).\
-            filter(Metadata.name == "ogc_query_layers").first()
+        metadata = snapshot.get_metadata(layer_id, "ogc_query_layers")
         if metadata is not None:
-            body['QUERY_LAYERS'] = metadata.value
+            body['QUERY_LAYERS'] = metadata
 
-        metadata = DBSession.query(Metadata).filter(Metadata.item_id == layer_id).\
-            filter(Metadata.name == "ogc_info_format").first()
+        metadata = snapshot.get_metadata(layer_id, "ogc_info_format")
         if metadata is not None:
-            body['INFO_FORMAT'] = metadata.value
+            body['INFO_FORMAT'] = metadata
         ogc_info_srs = "epsg:2169"
-        metadata = DBSession.query(Metadata).filter(Metadata.item_id == layer_id).\
-            filter(Metadata.name == "ogc_info_srs").first()
+        metadata = snapshot.get_metadata(layer_id, "ogc_info_srs")
         if metadata is not None:
-            ogc_info_srs = metadata.value
-        metadata = DBSession.query(Metadata).filter(Metadata.item_id == layer_id).\
-            filter(Metadata.name == "ogc_info_url").first()
+            ogc_info_srs = metadata
+        metadata = snapshot.get_metadata(layer_id, "ogc_info_url")
         if metadata is not None:
-            url = metadata.value
+            url = metadata
 
         separator = "?"
         if url.find(separator) > 0:
@@ -1548,7 +1785,8 @@ class Getfeatureinfo(object):
         content = ""
         try:
             DBSession.rollback()
-            result = urllib.request.urlopen(query, None, 15)
+            result = urllib.request.urlopen(
+                query, None, self._get_timeout(15))
             content = result.read()
         except Exception as e:
             log.exception(e)
@@ -1559,12 +1797,11 @@ class Getfeatureinfo(object):
             if content is not None and content == b"\n\n":
                 return []
             ogc_features = geojson_loads(content)
+            geometries = [feature['geometry'] for feature in ogc_features['features']]
+            if ogc_info_srs.lower() != "epsg:2169":
+                geometries = transform_geojson(geometries, ogc_info_srs, "epsg:2169")
 
-            for feature in ogc_features['features']:
-                geometry = feature['geometry']
-
-                if geometry is not None and ogc_info_srs.lower() != "epsg:2169":
-                    geometry = self.transform_(geometry, ogc_info_srs, "epsg:2169")
+            for feature, geometry in zip(ogc_features['features'], geometries):
                 if geometry is None:
                     box2 = self.request.params.get('box2', None)
                     coords = box2.split(',')
@@ -1755,7 +1992,8 @@ class Getfeatureinfo(object):
         query = '%s%s%s' % (url, separator, urlencode(body))
         try:
             url_request = urllib.request.Request(query)
-            result = read_request_with_token(url_request, self.request, log)
+            result = read_request_with_token(
+                url_request, self.request, log, self._get_timeout())
             content = result.data
         except ESRITokenException as e:
             log.exception(e)
@@ -1773,7 +2011,8 @@ class Getfeatureinfo(object):
             querygeojson = '%s%s%s' % (url, separator, urlencode(bodygeojson))
             try:
                 url_request = urllib.request.Request(querygeojson)
-                result = read_request_with_token(url_request, self.request, log)
+                result = read_request_with_token(
+                    url_request, self.request, log, self._get_timeout())
                 contentgeojson = json.loads(result.data)
             except Exception as e:
                 log.exception(e)
@@ -1786,7 +2025,8 @@ class Getfeatureinfo(object):
             query_count = '%s%s%s' % (url, separator, urlencode(body))
             try:
                 url_request = urllib.request.Request(query_count)
-                result = read_request_with_token(url_request, self.request, log)
+                result = read_request_with_token(
+                    url_request, self.request, log, self._get_timeout())
                 geojson_res = geojson_loads(result.data)
                 self.content_count = 0
                 if 'count' in geojson_res:
@@ -1865,7 +2105,8 @@ class Getfeatureinfo(object):
             tokenurl = baseurl.split('rest/')[0] +\
                 'tokens?username=%s&password=%s'\
                 % (user_password[0], user_password[1])
-            token = urllib.request.urlopen(tokenurl, None, 15).read()
+            token = http_client.request(
+                'GET', tokenurl, timeout=self._get_timeout()).text
             return baseurl + "token=" + token
         except Exception as e:
             log.exception(e)
@@ -1874,13 +2115,34 @@ class Getfeatureinfo(object):
     def _get_session(self, engine_name):
         return DBSessions[engine_name]
 
-    def transform_(self, geometry, source, dest):
-        project = partial(
-            pyproj.transform,
-            pyproj.Proj(init=source), # source coordinate system
-            pyproj.Proj(init=dest)) # destination coordinate system
+    def _execute_page(self, session, query, query_limit, offset=None):
+        # Get one page of the query together with the total number of rows
+        # with a window function, the spatial filter is evaluated only once.
+        page_query = "SELECT *, count(*) OVER () AS %(count)s FROM (%(query)s) AS request"\
+            % {'count': TOTAL_COUNT_COLUMN, 'query': query}
+        if query_limit > 0:
+            page_query = page_query + " LIMIT " + str(query_limit)
+        if offset is not None:
+            page_query = page_query + " OFFSET " + str(int(offset))
+        rows = session.execute(page_query).fetchall()
+        if len(rows) > 0:
+            rows_cnt = rows[0][TOTAL_COUNT_COLUMN]
+        elif offset is not None and int(offset) > 0:
+            # The page is after the last row, the total is still needed.
+            try:
+                query_cnt = "SELECT COUNT(*) FROM (" + query + ") as request"
+                rows_cnt = session.execute(query_cnt).fetchall()[0][0]
+            except Exception as e:
+                session.rollback()
+                log.exception(e)
+                log.error("ERROR COUNTING")
+                rows_cnt = 0
+        else:
+            rows_cnt = 0
+        return [PageRow(row) for row in rows], rows_cnt
 
-        g2 = transform(project, shape(geometry))  # apply projection
+    def transform_(self, geometry, source, dest):
+        g2 = transform_geometry(geometry, source, dest)
 
         return geojson_loads(geojson.dumps(mapping(g2)))
 
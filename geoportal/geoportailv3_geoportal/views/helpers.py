@@ -4,12 +4,8 @@ from pyramid.response import Response
 from pyramid.httpexceptions import HTTPBadRequest
 from c2cgeoportal_geoportal.lib.caching import set_common_headers, NO_CACHE
 from geojson import loads as geojson_loads
-import geojson
-import pyproj
+from geoportailv3_geoportal.lib.projections import transform_geojson
 import logging
-from functools import partial
-from shapely.ops import transform
-from shapely.geometry import mapping, shape
 log = logging.getLogger(__name__)
 
 
@@ -34,17 +30,10 @@ class Helpers(object):
 
         json = geojson_loads(p_json)
 
-        for feature in json['features']:
-            geometry = feature['geometry']
+        geometries = transform_geojson(
+            [feature['geometry'] for feature in json['features']],
+            from_srs, to_srs)
+        for feature, geometry in zip(json['features'], geometries):
             if geometry is not None:
-                geometry = self._transform(geometry, from_srs, to_srs)
-                feature['geometry'] = mapping(geometry)
-        return json
-
-    def _transform(self, geometry, source, dest):
-        project = partial(
-            pyproj.transform,
-            pyproj.Proj(init=source), # source coordinate system
-            pyproj.Proj(init=dest)) # destination coordinate system
-
-        return transform(project, shape(geometry))  # apply projection
\ No newline at end of file
+                feature['geometry'] = geometry
+        return json
\ No newline at end of file
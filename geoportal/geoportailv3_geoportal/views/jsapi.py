@@ -4,9 +4,6 @@ import json
 import logging
 from c2cgeoportal_geoportal.views.theme import Theme
 from c2cgeoportal_commons.models import DBSession
-from pyramid.i18n import make_localizer, TranslationStringFactory
-from pyramid.interfaces import ITranslationDirectories
-from pyramid.threadlocal import get_current_registry
 from pyramid.renderers import render
 from c2cgeoportal_commons import models
 from c2cgeoportal_commons.models import main, static
@@ -14,6 +11,8 @@ from c2cgeoportal_geoportal.lib import get_url2
 from c2cgeoportal_geoportal.lib.caching import get_region, invalidate_region
 from pyramid.response import Response
 from geoportailv3_geoportal.models import LuxLayerInternalWMS
+from geoportailv3_geoportal.lib.translations import get_translation_dirs, \
+    translate
 
 log = logging.getLogger(__name__)
 cache_region = get_region("std")
@@ -26,13 +25,7 @@ class JsapiEntry(Theme):
     def apithemes_full(self):
         t = []
         themes, errors = self._themes(u'main', True, 0)
-        client = TranslationStringFactory("geoportailv3_geoportal-client")
-        registry = get_current_registry()
-        dir = registry.queryUtility(ITranslationDirectories, default=[])
-        localizer_fr = make_localizer("fr", dir)
-        localizer_de = make_localizer("de", dir)
-        localizer_en = make_localizer("en", dir)
-        localizer_lb = make_localizer("lb", dir)
+        tdirs = get_translation_dirs()
 
         for theme in themes:
             entry = models.DBSession.query(main.Theme).filter(main.Theme.id == theme['id']).one()
@@ -40,10 +33,10 @@ class JsapiEntry(Theme):
                 'id': entry.id,
                 'public': entry.public,
                 'name': entry.name,
-                'name_fr': localizer_fr.translate(client(entry.name)),
-                'name_de': localizer_de.translate(client(entry.name)),
-                'name_en': localizer_en.translate(client(entry.name)),
-                'name_lb': localizer_lb.translate(client(entry.name))
+                'name_fr': translate(entry.name, 'fr', tdirs),
+                'name_de': translate(entry.name, 'de', tdirs),
+                'name_en': translate(entry.name, 'en', tdirs),
+                'name_lb': translate(entry.name, 'lb', tdirs)
             })
         return t
 
@@ -72,14 +65,7 @@ class JsapiEntry(Theme):
 
         self._extract_layers(group, layers, True)
         l = []
-        registry = get_current_registry()
-        dir = registry.queryUtility(ITranslationDirectories, default=[])
-        localizer_fr = make_localizer("fr", dir)
-        localizer_de = make_localizer("de", dir)
-        localizer_en = make_localizer("en", dir)
-        localizer_lb = make_localizer("lb", dir)
-
-        client = TranslationStringFactory("geoportailv3_geoportal-client")
+        tdirs = get_translation_dirs()
         all_errors = set()
 
         for id in layers:
@@ -103,10 +89,10 @@ class JsapiEntry(Theme):
                 'id': layers[id]['id'],
                 'public': is_public,
                 'name': layers[id]['name'],
-                'name_fr': localizer_fr.translate(client(layers[id]['name'])),
-                'name_de': localizer_de.translate(client(layers[id]['name'])),
-                'name_en': localizer_en.translate(client(layers[id]['name'])),
-                'name_lb': localizer_lb.translate(client(layers[id]['name'])),
+                'name_fr': translate(layers[id]['name'], 'fr', tdirs),
+                'name_de': translate(layers[id]['name'], 'de', tdirs),
+                'name_en': translate(layers[id]['name'], 'en', tdirs),
+                'name_lb': translate(layers[id]['name'], 'lb', tdirs),
                 'external_url': url,
                 'groups': layers[id].get('came_from'),
                 'metadata_id': layers[id]['metadata']['metadata_id'] if 'metadata_id' in layers[id]['metadata'] else None,
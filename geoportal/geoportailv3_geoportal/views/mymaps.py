@@ -10,7 +10,6 @@ import geojson
 import transaction
 import gpxpy
 import gpxpy.gpx
-import pyproj
 
 from sqlalchemy.sql import text
 
@@ -38,10 +37,9 @@ from shapely.geometry import Point, LineString
 from c2cgeoportal_geoportal.lib.caching import set_common_headers, NO_CACHE
 from c2cgeoportal_commons.models import DBSessions
 from geoportailv3_geoportal import mailer
+from geoportailv3_geoportal.lib.projections import transform_geometry
 from shapely import wkb
-from shapely.geometry import asShape, shape
-from shapely.ops import transform
-from functools import partial
+from shapely.geometry import asShape
 from osgeo import ogr, osr
 from shapely.geometry import Polygon
 import tempfile
@@ -1919,9 +1917,4 @@ class Mymaps(object):
         return full_mymaps
 
     def _transform(self, geometry, source, dest):
-        project = partial(
-            pyproj.transform,
-            pyproj.Proj(init=source), # source coordinate system
-            pyproj.Proj(init=dest)) # destination coordinate system
-
-        return transform(project, shape(geometry))  # apply projection
\ No newline at end of file
+        return transform_geometry(geometry, source, dest)
\ No newline at end of file
@@ -1,7 +1,16 @@
 ﻿# -*- coding: utf-8 -*-
+import hmac
+import os
+from pyramid.httpexceptions import HTTPUnauthorized
 from pyramid.response import Response
 from pyramid.view import view_config
 from c2cgeoportal_geoportal.lib.caching import set_common_headers, NO_CACHE
+from geoportailv3_geoportal.lib import http_client
+
+# Token giving access to the statistics, sent in the X-Stats-Token header.
+# The statistics are disabled when it is not set.
+STATS_TOKEN = os.environ.get('HTTP_POOL_STATS_TOKEN', '')
+
 
 class Ping(object):
 
@@ -16,3 +25,12 @@ class Ping(object):
         return set_common_headers(
             self.request, "ping", NO_CACHE
         )
+
+    # Reuse statistics of the ArcGIS connection pools of the worker
+    @view_config(route_name="http_pool_stats", renderer="json")
+    def http_pool_stats(self):
+        token = self.request.headers.get("X-Stats-Token", "")
+        if not STATS_TOKEN or not hmac.compare_digest(
+                token.encode('utf-8'), STATS_TOKEN.encode('utf-8')):
+            return HTTPUnauthorized()
+        return {"pid": os.getpid(), "pools": http_client.get_stats()}
@@ -5,6 +5,7 @@ from pyramid.view import view_config
 from geoportailv3_geoportal.models import LuxLayerInternalWMS, LuxPredefinedWms
 from c2cgeoportal_commons.models import DBSession
 from c2cgeoportal_commons.models.main import RestrictionArea, Role, Layer, LayerWMTS
+from pyramid.request import Request
 from pyramid.response import Response
 from pyramid.httpexceptions import HTTPBadGateway, HTTPBadRequest
 from pyramid.httpexceptions import HTTPNotFound, HTTPUnauthorized
@@ -17,7 +18,8 @@ import os
 import dateutil
 
 from geoportailv3_geoportal.lib.esri_authentication import ESRITokenException
-from geoportailv3_geoportal.lib.esri_authentication import get_arcgis_token, read_request_with_token
+from geoportailv3_geoportal.lib.esri_authentication import get_arcgis_token, open_request_with_token
+from geoportailv3_geoportal.lib import http_client
 
 log = logging.getLogger(__name__)
 
@@ -169,7 +171,6 @@ class Wms:
             from shapely.geometry import asShape, box, shape
             import json
             gfi = Getfeatureinfo(self.request)
-            url = "https://map.geoportail.lu/getfeatureinfo?"
             params_dict = {'tooltip':1, 'lang': 'fr'}
             for key in self.request.params.keys():
                 if key.lower() == 'query_layers':
@@ -217,13 +218,15 @@ class Wms:
                     params_dict[key.lower()] = box
                 else:
                     params_dict[key.lower()] = self.request.params.get(key)
-            params = urllib.parse.urlencode(params_dict)
-            separator = "?"
-            if "?" in url:
-                separator = "&"
-            url = url + separator + params
-            f = urllib.request.urlopen(url, None, 15)
-            data = f.read()
+            # Dispatch to the getfeatureinfo view of this application, as an
+            # anonymous request like the former call to the public url
+            subrequest = Request.blank(
+                self.request.route_url('getfeatureinfo', _app_url='', _query=params_dict),
+                base_url=self.request.application_url)
+            response = self.request.invoke_subrequest(subrequest)
+            if response.status_int != 200:
+                return response
+            data = response.body
             info_format = self.request.params.get('INFO_FORMAT', self.request.params.get('info_format', 'text/plain'))
             headers = {"Content-Type": info_format}
             tooltips = []
@@ -355,7 +358,7 @@ class Wms:
         if base64user is not None:
             url_request.add_header("Authorization", "Basic %s" % base64user)
         try:
-            data, content_type = read_request_with_token(url_request, self.request, log)
+            result = open_request_with_token(url_request, self.request, log)
         except ESRITokenException as e:
             raise HTTPBadGateway(e)
         # retry for other errors not related to tokens
@@ -363,17 +366,17 @@ class Wms:
             try:
                 DBSession.rollback()
                 # Retry to get the result
-                f = urllib.request.urlopen(url_request, None, timeout)
-                data = f.read()
-                content_type = f.info()['Content-Type']
+                result = http_client.request(
+                    'GET', url, headers=dict(url_request.header_items()),
+                    timeout=timeout, stream=True)
             except Exception as e:
                 log.exception(e)
                 log.error(url)
                 return HTTPBadGateway()
 
-        headers = {"Content-Type": content_type}
+        headers = {"Content-Type": result.headers.get('Content-Type')}
 
-        return Response(data, headers=headers)
+        return Response(app_iter=http_client.iter_content(result), headers=headers)
 
     @view_config(route_name='predefined_wms', renderer='json')
     def predefined_wms(self):
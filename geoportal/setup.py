@@ -23,6 +23,7 @@ setup(
           'create_db = geoportailv3_geoportal.scripts.create_db:main',
           'db2es = geoportailv3_geoportal.scripts.db2es:main',
           'layers2es = geoportailv3_geoportal.scripts.layers2es:main',
+          'geocode_aggregates = geoportailv3_geoportal.scripts.geocode_aggregates:main',
           'lux_gunicorn = geoportailv3_geoportal.scripts.lux_gunicorn:main',
         ],
         "lingua.extractors": [